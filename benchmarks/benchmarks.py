@@ -0,0 +1,242 @@
+# coding: utf-8
+"""Benchmarks of the numerical hot paths of pyfog
+
+The benchmarks follow the conventions of airspeed velocity (asv): each class
+is set up once per value of `params`, and its ``time_*`` and ``peakmem_*``
+methods are timed and memory profiled. ``timeraw_*`` methods return code
+that is timed in a fresh interpreter, to measure import times. They are run
+with ``run.py`` in this directory, which records the results of each commit
+and compares them.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfog.allan_variance import allan_var
+from pyfog.experiment import Experiment, Tombstone
+from pyfog.flight_simulator import (
+    Leg, SimulationSweep, get_cross_track_error, get_navigation_error,
+    simulate_tombstone)
+from pyfog.signal_processing import sigma_deviation
+from pyfog.storage import StorageService
+from pyfog.waveforms import _cached_square_pulse, square_pulse
+
+
+sizes = [10 ** k for k in range(3, 9)]
+
+
+def _samples(n):
+    return np.random.default_rng(0).standard_normal(n)
+
+
+class AllanVar():
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.data = _samples(n)
+
+    def time_allan_var(self, n):
+        allan_var(self.data, 1)
+
+    def peakmem_allan_var(self, n):
+        allan_var(self.data, 1)
+
+
+class TombstoneAdev():
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.tombstone = Tombstone(_samples(n), rate=1)
+
+    def time_construct(self, n):
+        Tombstone(self.tombstone.values, rate=1, start=1.7e9)
+
+    def time_slice(self, n):
+        self.tombstone[n // 4:n // 2]
+
+    def time_adev(self, n):
+        self.tombstone._allan_cache = None
+        self.tombstone.adev
+
+    def peakmem_adev(self, n):
+        self.tombstone._allan_cache = None
+        self.tombstone.adev
+
+
+class SigmaDeviation():
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.data = _samples(n)
+
+    def time_sigma_deviation(self, n):
+        sigma_deviation(self.data, 1)
+
+    def peakmem_sigma_deviation(self, n):
+        sigma_deviation(self.data, 1)
+
+
+class SimulateTombstone():
+    params = sizes
+    param_names = ['n']
+
+    def time_simulate_tombstone(self, n):
+        simulate_tombstone(rate=1, seconds=n, arw=.04, drift=1, rng=0)
+
+    def time_simulate_power_law(self, n):
+        simulate_tombstone(rate=1, seconds=n, arw=.04, rng=0,
+                           power_law={-2: 1e-6, -1: 1e-3})
+
+    def peakmem_simulate_tombstone(self, n):
+        simulate_tombstone(rate=1, seconds=n, arw=.04, drift=1, rng=0)
+
+
+class Sweep():
+    """A 100 point sweep, to compare with a single simulation."""
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.sweep = SimulationSweep(rate=1, seconds=n,
+                                     arw=np.linspace(.01, .05, 10),
+                                     drift=np.linspace(1, 2, 10), rng=0)
+
+    def time_sweep_adev(self, n):
+        for point in self.sweep.adev():
+            pass
+
+    def time_sweep_cross_track_error(self, n):
+        for point in self.sweep.cross_track_error():
+            pass
+
+
+class CrossTrackError():
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.data = _samples(n)
+
+    def time_cross_track_error(self, n):
+        get_cross_track_error(self.data, 1, 900)
+
+    def peakmem_cross_track_error(self, n):
+        get_cross_track_error(self.data, 1, 900)
+
+    def time_final_cross_track_error(self, n):
+        get_cross_track_error(self.data, 1, 900, final_only=True)
+
+
+class NavigationError():
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.data = _samples(n)
+        self.plan = [Leg(n / 2, 800), Leg(n / 10, 700, turn_rate=.5),
+                     Leg(n, 900)]
+
+    def time_navigation_error(self, n):
+        get_navigation_error(self.data, 1, 900)
+
+    def peakmem_navigation_error(self, n):
+        get_navigation_error(self.data, 1, 900)
+
+    def time_final_navigation_error(self, n):
+        get_navigation_error(self.data, 1, 900, final_only=True)
+
+    def time_flight_plan(self, n):
+        get_navigation_error(self.data, 1, self.plan)
+
+
+class SquarePulse():
+    params = sizes
+    param_names = ['n']
+
+    def time_square_pulse(self, n):
+        _cached_square_pulse.cache_clear()
+        square_pulse(n, .5, .1, .1)
+
+    def time_cached_square_pulse(self, n):
+        square_pulse(n, .5, .1, .1)
+
+    def peakmem_square_pulse(self, n):
+        _cached_square_pulse.cache_clear()
+        square_pulse(n, .5, .1, .1)
+
+
+class ExperimentIO():
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.directory = tempfile.mkdtemp()
+        self.tombstone = Tombstone(_samples(n), rate=1)
+        self.experiment = Experiment(os.path.join(self.directory, 'bench.h5'))
+        self.experiment['stored'] = self.tombstone
+
+    def teardown(self, n):
+        self.experiment.close()
+        shutil.rmtree(self.directory)
+
+    def time_write(self, n):
+        self.experiment['written'] = self.tombstone
+
+    def time_append(self, n):
+        self.experiment.append('appended', self.tombstone.values, rate=1)
+
+    def time_read(self, n):
+        np.asarray(self.experiment['stored'])
+
+    def peakmem_read(self, n):
+        np.asarray(self.experiment['stored'])
+
+
+class Storage():
+    """Eight producers appending 100 chunks each, directly to an open
+    Experiment and through a StorageService."""
+    params = sizes
+    param_names = ['n']
+
+    def setup(self, n):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'bench.h5')
+        self.chunk = _samples(max(n // 800, 1))
+
+    def teardown(self, n):
+        shutil.rmtree(self.directory)
+
+    def time_append_direct(self, n):
+        experiment = Experiment(self.filename)
+        for i in range(100):
+            for producer in range(8):
+                experiment.append('run_%i' % producer, self.chunk, rate=1)
+        experiment.close()
+
+    def time_append_service(self, n):
+        with StorageService() as service:
+            for i in range(100):
+                for producer in range(8):
+                    service.append(self.filename, 'run_%i' % producer,
+                                   self.chunk, rate=1)
+
+
+class Import():
+
+    def timeraw_import_pyfog(self):
+        return 'import pyfog'
+
+    def timeraw_import_flight_simulator(self):
+        return 'from pyfog import simulate_tombstone'
+
+    def timeraw_import_signal_processing(self):
+        return 'import pyfog.signal_processing'
+
+    def timeraw_import_experiment(self):
+        return 'from pyfog import Experiment'
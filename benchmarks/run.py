@@ -0,0 +1,219 @@
+# coding: utf-8
+"""Runs the benchmarks, records the results, and compares them
+
+Run from the root of the repository::
+
+    python benchmarks/run.py                      # sizes up to 10^6
+    python benchmarks/run.py --max-size 1e8       # the full range
+    python benchmarks/run.py -k Allan             # only matching benchmarks
+    python benchmarks/run.py --compare benchmarks/results/0123abcd.json
+    python benchmarks/run.py --check-imports      # enforce the import budget
+
+The wall time of ``time_*`` benchmarks is the best of `--repeat` runs, and
+the peak memory of ``peakmem_*`` benchmarks is the peak of the allocations
+traced by `tracemalloc`, which include numpy arrays. Each benchmark is set up
+afresh for every run. The results are written to ``results/<commit>.json``.
+``timeraw_*`` benchmarks are timed in a fresh interpreter. When compared with
+earlier results, any benchmark that got slower or larger by more than
+`--factor` is reported as a regression, and the exit status is 1, as it is
+when `--check-imports` finds an import over its budget.
+"""
+
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import numpy as np  # noqa: E402
+
+from benchmarks import benchmarks  # noqa: E402
+from pyfog import _heavy_modules as heavy_modules  # noqa: E402
+from pyfog import _import_budget as import_budget  # noqa: E402
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _benchmarks(pattern=None):
+    """Yields the name, class and method name of every benchmark."""
+    for class_name, cls in inspect.getmembers(benchmarks, inspect.isclass):
+        if cls.__module__ != benchmarks.__name__:
+            continue
+        for name in sorted(vars(cls)):
+            if not name.startswith(('time_', 'peakmem_', 'timeraw_')):
+                continue
+            full_name = '%s.%s' % (class_name, name)
+            if pattern is None or pattern in full_name:
+                yield full_name, cls, name
+
+
+def _import_time(code):
+    """Runs `code` in a fresh interpreter, and returns the time it took and
+    the heavy modules it imported."""
+    script = ('import sys, time\n'
+              't = time.perf_counter()\n'
+              '%s\n'
+              't = time.perf_counter() - t\n'
+              'print(t, *[m for m in %r if m in sys.modules])'
+              % (code, heavy_modules))
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=os.path.dirname(here)).split()
+    return float(output[0]), [m.decode() for m in output[1:]]
+
+
+def check_imports():
+    """Prints the import time of every entry of the import budget, and
+    returns those that are over budget or import heavy modules."""
+    failures = []
+    for code, budget in import_budget.items():
+        seconds, heavy = _import_time(code)
+        problem = ''
+        if seconds > budget:
+            problem = '  over the budget of %g s' % budget
+        if heavy:
+            problem += '  imports %s' % ', '.join(heavy)
+        if problem:
+            failures.append(code)
+        print('%-55s %10.3f ms%s' % (code, seconds * 1e3, problem))
+    return failures
+
+
+def _measure(cls, name, param, repeat):
+    """Returns the best wall time in seconds, or the peak memory in bytes,
+    of one benchmark."""
+    measurements = []
+    if name.startswith('timeraw_'):
+        code = getattr(cls(), name)()
+        return min(_import_time(code)[0] for i in range(repeat))
+
+    for i in range(repeat if name.startswith('time_') else 1):
+        instance = cls()
+        if hasattr(instance, 'setup'):
+            instance.setup(param)
+        try:
+            method = getattr(instance, name)
+            if name.startswith('time_'):
+                start = time.perf_counter()
+                method(param)
+                measurements.append(time.perf_counter() - start)
+            else:
+                tracemalloc.start()
+                try:
+                    method(param)
+                    measurements.append(tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+        finally:
+            if hasattr(instance, 'teardown'):
+                instance.teardown(param)
+    return min(measurements)
+
+
+def run(pattern=None, max_size=10 ** 6, repeat=3):
+    """Runs the benchmarks up to `max_size` samples, printing and returning
+    the results keyed by ``Class.method(n)``."""
+    results = {}
+    for full_name, cls, name in _benchmarks(pattern):
+        for param in getattr(cls, 'params', [None]):
+            if param is not None and param > max_size:
+                continue
+            label = '%s(%s)' % (full_name, param)
+            try:
+                value = _measure(cls, name, param, repeat)
+            except MemoryError:
+                print('%-55s out of memory' % label)
+                continue
+            results[label] = value
+            print('%-55s %s' % (label, _format(name, value)))
+            sys.stdout.flush()
+    return results
+
+
+def _format(name, value):
+    if name.split('.')[-1].startswith('peakmem_'):
+        return '%10.3f MB' % (value / 2 ** 20)
+    return '%10.3f ms' % (value * 1e3)
+
+
+def compare(old, new, factor=1.2):
+    """Prints the change of every benchmark in both `old` and `new`, and
+    returns the names of those that regressed by more than `factor`."""
+    regressions = []
+    for label in sorted(set(old) & set(new)):
+        ratio = new[label] / old[label] if old[label] else np.inf
+        flag = ''
+        if ratio > factor:
+            flag = '  REGRESSION'
+            regressions.append(label)
+        elif ratio < 1 / factor:
+            flag = '  improved'
+        print('%-55s %8.2fx%s' % (label, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the numerical hot paths of pyfog.')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--max-size', type=float, default=1e6,
+                        help='largest number of samples (default 1e6, '
+                             'at most 1e8)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs of each benchmark')
+    parser.add_argument('--compare', default=None,
+                        help='earlier results to compare against')
+    parser.add_argument('--factor', type=float, default=1.2,
+                        help='slowdown that counts as a regression')
+    parser.add_argument('--check-imports', action='store_true',
+                        help='only check the import budget')
+    parser.add_argument('--output', default=None,
+                        help='where to write the results (default '
+                             'results/<commit>.json)')
+    args = parser.parse_args(argv)
+
+    if args.check_imports:
+        return 1 if check_imports() else 0
+
+    commit = _commit()
+    results = run(args.pattern, int(args.max_size), args.repeat)
+
+    output = args.output or os.path.join(here, 'results', commit + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'date': datetime.datetime.now().isoformat(),
+            'machine': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print('Results written to %s' % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print('\nCompared with %s:' % previous.get('commit', args.compare))
+        if compare(previous['results'], results, args.factor):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
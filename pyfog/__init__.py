@@ -5,7 +5,55 @@
 
 Lots of things go in here...
 
+The submodules, and the names below, are only imported when first used, so
+that ``import pyfog`` does not pull in pandas, PyTables or matplotlib.
+
 """
 
-from .experiment import *
-from .flight_simulator import *
\ No newline at end of file
+import importlib
+
+_submodules = ['allan_variance', 'analyze', 'experiment', 'flight_simulator',
+               'instruments', 'signal_processing', 'simulated_instruments',
+               'storage', 'waveforms']
+
+# Names available from the top level, and the submodule defining each
+_attributes = {
+    'Tombstone': 'experiment',
+    'LazyTombstone': 'experiment',
+    'Experiment': 'experiment',
+    'simulate_tombstone': 'flight_simulator',
+    'simulate_tombstone_chunks': 'flight_simulator',
+    'get_cross_track_error': 'flight_simulator',
+    'monte_carlo_cross_track_error': 'flight_simulator',
+    'Leg': 'flight_simulator',
+    'get_navigation_error': 'flight_simulator',
+}
+
+__all__ = list(_attributes)
+
+# Modules that must not be imported until the feature needing them is used,
+# and the longest each of these imports may take in a fresh interpreter, in
+# seconds. Checked by the tests and the import benchmarks.
+_heavy_modules = ['pandas', 'tables', 'matplotlib', 'scipy', 'allantools']
+_import_budget = {
+    'import pyfog': .5,
+    'from pyfog import simulate_tombstone': .5,
+    'import pyfog.signal_processing': .5,
+    'from pyfog import Tombstone': .5,
+    'from pyfog import Experiment': .5,
+}
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name in _attributes:
+        module = importlib.import_module('.' + _attributes[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules) | set(__all__))
@@ -1,176 +1,323 @@
-from math import log, floor, sqrt, ceil
-from scipy.signal import lfilter, filtfilt
+from math import log
 import numpy as np
-import matplotlib.pyplot as plt
 
+from .instruments import InstrumentProxy, calibrate_scale_factor, run
 
 
-
-# Rotate at a known speed in one direction,
-# and at a known speed in the opposite direction
-
 def get_scale_factor(instruments,_dither_angle=5, _dither_velocity=1,
-                     _padding=1,
+                     _padding=1, **polling
                      ):
-    import time
-    # Guess at the variables
-    rot = instruments['rotation_platform']
-    lia = instruments['lock_in_amplifier']
-    daq = instruments['data_acquisition_unit']
-
-    """Return scale factor in terms of volts per (degree per hour)"""
-    rot.velocity = _dither_velocity
-
-    read_time = _dither_angle / _dither_velocity - _padding
-
-    # Clear out a funky buffer...
-    for i in range(5):
-        freq = 1 / lia.time_constant
-
-    rot.cw(.5*_dither_angle, background=True)
-    time.sleep(.5)
-    #lia.autogain()
-    lia.sensitivity = 0.1
-    while not rot.is_stationary():
-        pass
-
-    rot.ccw(.5*_dither_angle, background=True)
-    time.sleep(0.5)
-    lia.autophase()
-    while not rot.is_stationary():
-        pass
-
-    rot.cw(_dither_angle, background=True)
-    while True:
-        if rot.is_constant_speed(): break
-    cw_data = daq.read(seconds=read_time, frequency=freq,
-                       max_voltage=lia.sensitivity)
+    """Return scale factor in terms of degrees per hour per volt
 
-    while not rot.is_stationary():
-        pass
-
-    rot.ccw(_dither_angle, background=True)
-    while True:
-        if rot.is_constant_speed(): break
-    ccw_data = daq.read(seconds=_dither_angle / _dither_velocity - _padding,
-                        frequency=freq, max_voltage=lia.sensitivity)
-
-    while not rot.is_stationary():
-        pass
-
-    #rot.angle = 0
-
-    # volts per degree per second
-    vpdps = (abs(np.mean(cw_data)) + abs(np.mean(cw_data))) / (2 *
-                                                            _dither_velocity)
-    # compensate for stage pitch
-    vpdps /= np.cos(37.4/180*np.pi)
-
-    # degree per hour per volt
-    dphpv = 1 / vpdps * 60 ** 2
-    return dphpv
+    This runs `pyfog.instruments.calibrate_scale_factor`, which waits for the
+    rotation platform without busy polling. The keyword arguments
+    `poll_interval`, `max_interval` and `timeout` are passed on to it.
+    """
+    return run(calibrate_scale_factor(
+        instruments, _dither_angle=_dither_angle,
+        _dither_velocity=_dither_velocity, _padding=_padding, **polling))
 
-def allan_var(x, dt):
+def allan_var(x, dt, tau=None, min_overlap=None):
     """Computes the allan variance of signal x acquired with sampling rate 1/dt where dt is in seconds
 
+    All of the overlapping Allan variances are computed from a single
+    cumulative sum of the data, so each tau costs O(N) regardless of the
+    number of samples being averaged. If `x` is two dimensional, each row is
+    treated as a separate run and the curves for every run are returned at
+    once. `x` may also be a `pyfog.signal_processing.Pyramid` of a run.
+
     Paramters
     ---------
-    x : array
-        The data
+    x : array or Pyramid
+        The data. Either a single run, a 2-D array with one run per row, or
+        the pyramid of a run sampled every `dt`.
     dt : float
         sampling rate 1/dt in seconds
+    tau : array of int, optional
+        The numbers of samples to average. Defaults to logarithmically spaced
+        values up to 1/9 of the number of samples.
+    min_overlap : int, optional
+        Only used if `x` is a Pyramid, to evaluate long taus at its coarse
+        levels, see `Pyramid.allan_deviation`. This changes the estimator.
+        By default the result is the same as for the run itself.
 
     Returns
     -------
     tau : array
         Vector containing allan variance averaging times in units of [s]
     sig : array
-        Vector containing allan deviations in units of [x] corresponding to averaging times in tau
+        Vector containing allan deviations in units of [x] corresponding to
+        averaging times in tau. If `x` is 2-D, this has one row per run.
     """
 
+    from .signal_processing import Pyramid
+    pyramid = x if isinstance(x, Pyramid) else None
+    if pyramid is None:
+        x = np.asarray(x, dtype=float)
+
     # Get number of samples
-    n = len(x)
-
-    # set increment in tau to dB
-    dTau = 3
-    dTau = 10 ** (dTau / 10)
-    dTau = 1.1  # 2
-
-    # set the maximum value of tau to be 1/9 of the total number of samples
-    # as per the IEEE FOG test document
-    tauMax = n / 9
-
-    # define tau to be an integer number of timesteps with logarithmic spacing
-    # dTauIncrements
-    #
-    # (unique required because tau tends to be of form [1 1 2 ....])
-    #tau = np.unique(
-    #    dTau ** np.arange(
-    #        ceil(log(len(x) / 9) / log(dTau))
-    #    )
-    #)
-
-    tau = np.unique(
-        np.ceil(dTau ** np.arange(
-            np.ceil(log(len(x) / 9) / log(dTau))
-        ))
-    )
-
-    sig = np.zeros_like(tau, dtype=float)
+    n = pyramid.n if pyramid is not None else x.shape[-1]
+
+    if tau is None:
+        # set increment in tau to dB
+        dTau = 1.1  # 2
+
+        # define tau to be an integer number of timesteps with logarithmic
+        # spacing dTauIncrements. The maximum value of tau is 1/9 of the total
+        # number of samples as per the IEEE FOG test document.
+        #
+        # (unique required because tau tends to be of form [1 1 2 ....])
+        tau = np.unique(
+            np.ceil(dTau ** np.arange(
+                np.ceil(log(n / 9) / log(dTau))
+            ))
+        )
+    tau = np.asarray(tau)
+
+    if pyramid is not None:
+        return pyramid.allan_deviation(tau * dt, min_overlap=min_overlap)
+
+    # Running sums of x, with a leading zero so that the sum of the m samples
+    # starting at k is c[k + m] - c[k]. Removing the mean first keeps the
+    # cumulative sum small, which preserves precision on long runs.
+    c = np.zeros(x.shape[:-1] + (n + 1,))
+    np.cumsum(x - np.mean(x, axis=-1, keepdims=True), axis=-1, out=c[..., 1:])
+
+    sig = np.zeros(x.shape[:-1] + tau.shape)
 
     for j in range(len(tau)):
         # define number of samples to average
         m = int(tau[j])
+        sig[..., j] = np.sqrt(_overlapping_allan_var(c, m))
 
-        # compute the running average of x with a window size m
-        b = np.ones(m) / m
-        y = lfilter(b, 1, x)
+    return tau * dt, sig
 
-        # construct the delY(k) = y(k) - y(k-m)
-        bp = np.zeros(m + 1)
-        bp[0] = 1
-        bp[-1] = -1
-        delY = lfilter(bp, 1, y[m:-1])
 
-        # the allan variance sig**2 is 1/2 the average value of delY**2
-        # sig[j] = sqrt(0.5 * mean(delY[m+1:m:end])**2)
+def _overlapping_allan_var(c, m):
+    """Returns the maximally overlapping allan variance for averages of `m`
+    samples, given the cumulative sum `c` of the data (with a leading zero)
+    along the last axis.
+    """
+    # delY(k) = y(k + m) - y(k), where y(k) is the average of the m samples
+    # starting at k, expressed in terms of the cumulative sum
+    delY = c[..., 2 * m:] - 2 * c[..., m:-m] + c[..., :-2 * m]
+    delY /= m
+
+    # the allan variance sig**2 is 1/2 the average value of delY**2
+    return 0.5 * np.mean(delY ** 2, axis=-1)
+
+class AllanAccumulator():
+    """Keeps octave spaced overlapping Allan variance estimates up to date as
+    chunks of samples arrive, e.g. during a long acquisition.
+
+    By default every averaging time is evaluated at full rate, and, once all
+    of the data has been passed to `update`, `allan_var` returns the same
+    curve as the module level `allan_var` at the same averaging times. This
+    needs the cumulative sums of the last ``2 * max_m`` samples, so memory
+    use and the cost of each update grow with `max_m`.
+
+    With `min_overlap`, the samples are instead averaged in pairs into a
+    cascade of octave levels as they arrive, as in
+    `pyfog.signal_processing.Pyramid`, and each averaging time is evaluated
+    at the coarsest level that still leaves `min_overlap` windows per
+    averaging time. No level keeps more than ``4 * min_overlap`` sums, so
+    the state is O(min_overlap * log(max_m)), and `allan_var` returns the
+    same curve as ``Pyramid.allan_deviation`` with the same `min_overlap`.
+
+    Parameters
+    ----------
+    dt : float
+        sampling rate 1/dt in seconds
+    max_m : int, optional
+        The largest number of samples averaged. Averaging times are the
+        powers of two up to this value.
+    min_overlap : int, optional
+        The smallest number of overlapping windows per averaging time, or
+        None to evaluate every averaging time at full rate
+
+    Attributes
+    ----------
+    n : int
+        The number of samples seen so far
+    """
 
-        # use this to compute maximally overlapping allan variance
-        sig[j] = sqrt(0.5 * np.mean(delY[m + 1:-1] ** 2))
+    def __init__(self, dt, max_m=2 ** 20, min_overlap=None):
+        self.dt = dt
+        self.m = 2 ** np.arange(int(log(max_m, 2)) + 1)
+        self.min_overlap = min_overlap
+        self.n = 0
 
-    return tau * dt, sig
+        # The level of the cascade each averaging time is evaluated at
+        if min_overlap is None:
+            self._levels = np.zeros(len(self.m), dtype=int)
+        else:
+            self._levels = np.maximum(np.floor(
+                np.arange(len(self.m)) - np.log2(min_overlap)), 0).astype(int)
+
+        # Reference level removed from the data to keep the sums small
+        self._offset = None
+        # For each level, the cumulative sums of its most recent samples,
+        # relative to the first, and the sample waiting for its pair
+        self._tails = [np.zeros(1) for _ in range(self._levels[-1] + 1)]
+        self._carries = [np.zeros(0) for _ in self._tails]
+        # Running totals of delY**2 and the number of terms, for each m
+        self._sums = np.zeros(len(self.m))
+        self._counts = np.zeros(len(self.m), dtype=np.int64)
+
+    def update(self, chunk):
+        """Adds a chunk of samples to the running estimates."""
+        chunk = np.asarray(chunk, dtype=float).ravel()
+        if not len(chunk):
+            return
+        if self._offset is None:
+            self._offset = np.mean(chunk)
+        self.n += len(chunk)
+
+        block = chunk - self._offset
+        for level in range(len(self._tails)):
+            self._update_level(level, block)
+            if level + 1 == len(self._tails):
+                break
+            # Average the samples in pairs for the next level
+            block = np.concatenate((self._carries[level], block))
+            pairs = len(block) // 2 * 2
+            self._carries[level] = block[pairs:]
+            block = (block[0:pairs:2] + block[1:pairs:2]) / 2
+            if not len(block):
+                break
+
+    def _update_level(self, level, block):
+        tail = self._tails[level]
+        c = np.concatenate((tail, tail[-1] + np.cumsum(block)))
+        first_new = len(tail)
+
+        # Only the differences that end inside the new block are added, the
+        # others were already counted by previous updates
+        js = np.flatnonzero(self._levels == level)
+        for j in js:
+            m = self.m[j] >> level
+            start = max(2 * m, first_new)
+            if start >= len(c):
+                continue
+            delY = (c[start:]
+                    - 2 * c[start - m:len(c) - m]
+                    + c[start - 2 * m:len(c) - 2 * m]) / m
+            self._sums[j] += np.dot(delY, delY)
+            self._counts[j] += len(delY)
+
+        # Rebase the tail so that the sums do not grow over long runs
+        tail = c[-(2 * (self.m[js[-1]] >> level) + 1):]
+        self._tails[level] = tail - tail[0]
+
+    def allan_var(self):
+        """Returns the current estimates, as from the module level
+        `allan_var`.
+
+        Only averaging times of up to 1/9 of the samples seen so far are
+        included.
+
+        Returns
+        -------
+        tau : array
+            Vector containing allan variance averaging times in units of [s]
+        sig : array
+            Vector containing allan deviations in units of [x] corresponding
+            to averaging times in tau
+        """
+        valid = (self._counts > 0) & (self.m <= self.n / 9)
+        sig = np.sqrt(0.5 * self._sums[valid] / self._counts[valid])
+        return self.m[valid] * self.dt, sig
+
+    def state(self):
+        """Returns the accumulator state as a dictionary of arrays, suitable
+        for checkpointing to an HDF5 file."""
+        return {
+            'dt': self.dt,
+            'm': self.m,
+            'min_overlap': self.min_overlap or 0,
+            'n': self.n,
+            'offset': np.nan if self._offset is None else self._offset,
+            'tails': np.concatenate(self._tails),
+            'tail_lengths': [len(tail) for tail in self._tails],
+            'carries': [carry[0] if len(carry) else np.nan
+                        for carry in self._carries],
+            'sums': self._sums,
+            'counts': self._counts,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Recreates an accumulator from the output of `state`."""
+        accumulator = cls(state['dt'], max_m=state['m'][-1],
+                          min_overlap=int(state['min_overlap']) or None)
+        accumulator.n = int(state['n'])
+        if not np.isnan(state['offset']):
+            accumulator._offset = float(state['offset'])
+        ends = np.cumsum(state['tail_lengths'])
+        accumulator._tails = np.split(
+            np.array(state['tails'], dtype=float), ends[:-1])
+        accumulator._carries = [np.zeros(0) if np.isnan(carry)
+                                else np.array([carry], dtype=float)
+                                for carry in state['carries']]
+        accumulator._sums = np.array(state['sums'], dtype=float)
+        accumulator._counts = np.array(state['counts'], dtype=np.int64)
+        return accumulator
+
+def save_to_h5(filename, prefix, results_dict,instruments,overwrite=False,
+               service=None):
+    """Saves the Allan deviation of a run and its settings under `prefix`.
+
+    The settings of the function generator are read before the file is
+    opened, so the instruments are never queried while it is held. If a
+    `pyfog.storage.StorageService` is given, the write is queued to it and
+    this returns at once; errors are then raised by the service.
+    """
+    from .storage import save
+    awg = instruments['function_generator']
+    datasets = {'tau': results_dict['taus'], 'sigma': results_dict['sigmas']}
+    attrs = {
+        'start_time': results_dict['start_time'],
+        'modulation_frequency': awg.freq,
+        'modulation_voltage': awg.voltage,
+        'modulation_waveform': awg.waveform,
+        'duration': results_dict['duration'],
+        'scale_factor': results_dict['scale_factor'],
+        'sensitivity': results_dict['sensitivity'],
+        'time_constant': results_dict['time_constant'],
+        'source_temperature': 20,
+        'source_current': 162.63,
+    }
+    if service is not None:
+        service.save(filename, prefix, datasets, attrs, overwrite=overwrite)
+        return
 
-def save_to_h5(filename, prefix, results_dict,instruments,overwrite=False):
     import h5py
-    awg = instruments['function_generator']
-    with  h5py.File(filename) as hdf5_file:
+    with h5py.File(filename, 'a') as hdf5_file:
         try:
-            hdf5_file.create_dataset(prefix + '/tau', data=results_dict['taus'])
-            hdf5_file.create_dataset(prefix + '/sigma', data=results_dict['sigmas'])
-        except Exception as err:
-            if not overwrite:
-                print(err)
-                return
-            if overwrite:
-                print("Overwriting...\r")
-                hdf5_file[prefix + '/tau'][...] = results_dict['taus']
-                hdf5_file[prefix + '/sigma'][...] = results_dict['sigmas']
-        hdf5_file[prefix].attrs['start_time'] = results_dict['start_time']
-        hdf5_file[prefix].attrs['modulation_frequency'] = awg.freq
-        hdf5_file[prefix].attrs['modulation_voltage'] = awg.voltage
-        hdf5_file[prefix].attrs['modulation_waveform'] = awg.waveform
-        hdf5_file[prefix].attrs['duration'] = results_dict['duration']
-        hdf5_file[prefix].attrs['scale_factor'] = results_dict['scale_factor']
-        hdf5_file[prefix].attrs['sensitivity'] = results_dict['sensitivity']
-        hdf5_file[prefix].attrs['time_constant'] = results_dict['time_constant']
-        hdf5_file[prefix].attrs['source_temperature'] = 20
-        hdf5_file[prefix].attrs['source_current'] = 162.63
+            save(hdf5_file, prefix, datasets, attrs, overwrite=overwrite)
+        except ValueError as err:
+            print(err)
 
 
 def acquire_allan_variance(instruments,h5_file_name=None,h5_prefix=None,
-        seconds=0,minutes=0,hours=0,show_plot=False):
+        seconds=0,minutes=0,hours=0,show_plot=False,
+        experiment=None,key=None,chunk_seconds=10,service=None):
+    """Acquires an Allan variance run.
+
+    The data acquisition unit is read in chunks of `chunk_seconds` on a
+    background thread. Each chunk is folded into an `AllanAccumulator`, and,
+    if an `experiment` and `key` are given, appended to the run stored under
+    `key` as soon as it arrives, so memory use does not grow with the length
+    of the run. The accumulator evaluates long averaging times at coarse
+    octave levels with at least 128 overlapping windows each, so its state
+    stays small too; the curve is within a few percent of the full-rate
+    estimate. If the run already exists in `experiment`, the acquisition
+    resumes from the last committed chunk, reusing its scale factor. If a
+    `pyfog.storage.StorageService` is given as `service`, the results are
+    saved to `h5_file_name` through it.
+    """
     rot = instruments['rotation_platform']
-    lia = instruments['lock_in_amplifier']
+    lia = InstrumentProxy(instruments['lock_in_amplifier'], flush_reads=5)
     daq = instruments['data_acquisition_unit']
     awg = instruments['function_generator']
 
@@ -180,20 +327,13 @@ def acquire_allan_variance(instruments,h5_file_name=None,h5_prefix=None,
                         'specify `seconds`, `minutes`, `hours`?')
 
     import time
+    import queue
     import threading
     from ipywidgets import FloatProgress, Label
     from IPython.display import display
 
-    def update_progress(update_interval, progress_bar):
-        time_passed = time.time() - start_time
-        if time_passed < duration:
-            # schedule another event
-            threading.Timer(update_interval, update_progress,
-                            [update_interval, progress_bar]).start()
-            progress_bar.value = time_passed
-        else:
-            progress_bar.value = duration
-            is_progress_updating = False
+    def update_progress(progress_bar):
+        progress_bar.value = min(accumulator.n / rate, duration)
         m, s = divmod(int(progress_bar.value), 60)
         h, m = divmod(m, 60)
         l.value = "%d:%02d:%02d/%s" % (h, m, s, formatted_duration)
@@ -202,17 +342,42 @@ def acquire_allan_variance(instruments,h5_file_name=None,h5_prefix=None,
 
     display(l)
 
-    l.value = 'Calibrating and acquiring scale factor...'
-    scale_factor = get_scale_factor(instruments)
-    l.value = 'Setting sensitivity'
-    lia.sensitivity = 0.001
-    #lia.autogain()
-    for i in range(5, 0, -1):
-        l.value = 'Beginning acquisition in %i seconds...' % i
-        time.sleep(1)
+    resuming = experiment is not None and key is not None \
+        and key in experiment.keys()
+
+    if resuming:
+        l.value = 'Resuming %s...' % key
+        arr = experiment.h5file.get_node('/%s' % key)
+        scale_factor = arr.attrs.scale_factor
+        start_time = arr.attrs.start
+        rate = arr.attrs.rate
+        tc = 1 / rate
+        lia.sensitivity = 0.001
+    else:
+        l.value = 'Calibrating and acquiring scale factor...'
+        scale_factor = get_scale_factor(instruments)
+        l.value = 'Setting sensitivity'
+        lia.sensitivity = 0.001
+        #lia.autogain()
+        for i in range(5, 0, -1):
+            l.value = 'Beginning acquisition in %i seconds...' % i
+            time.sleep(1)
+
+        start_time = time.time()
+        tc = lia.time_constant
+        rate = 1 / tc
+
+    sensitivity = lia.sensitivity
 
-    start_time = time.time()
-    end_time = start_time + duration
+    accumulator = AllanAccumulator(
+        1 / rate, max_m=max(2 ** int(log(max(duration * rate / 9, 1), 2)), 1),
+        min_overlap=128)
+
+    if resuming:
+        # Replay the committed samples without loading them all at once
+        chunk_size = max(int(chunk_seconds * rate), 1)
+        for i in range(0, arr.nrows, chunk_size):
+            accumulator.update(scale_factor * arr[i:i + chunk_size])
 
     m, s = divmod(duration, 60)
     h, m = divmod(m, 60)
@@ -221,29 +386,59 @@ def acquire_allan_variance(instruments,h5_file_name=None,h5_prefix=None,
     progress_bar = FloatProgress(max=duration)
 
     display(progress_bar)
-    update_progress(duration / 100, progress_bar)
+    update_progress(progress_bar)
 
-    global voltage
-    for i in range(5):
-        tc = lia.time_constant
-    voltage = daq.read(seconds=duration, frequency=1 / tc,
-                       max_voltage=lia.sensitivity)
-    global rotation
-    rotation = scale_factor * voltage
+    # The producer only talks to the DAQ; the chunks are stored and analyzed
+    # on this thread, so that disk writes never delay the next read.
+    chunks = queue.Queue()
+    stop = threading.Event()
 
-    rate = len(rotation) / (duration)
-    tau, sig = allan_var(rotation, 1 / rate)
+    def produce(remaining):
+        try:
+            while remaining > 0 and not stop.is_set():
+                read_time = min(chunk_seconds, remaining)
+                chunks.put(daq.read(seconds=read_time, frequency=1 / tc,
+                                    max_voltage=sensitivity))
+                remaining -= read_time
+        except Exception as err:
+            chunks.put(err)
+        finally:
+            chunks.put(None)
+
+    producer = threading.Thread(
+        target=produce, args=(duration - accumulator.n / rate,), daemon=True)
+    producer.start()
+
+    voltage = []
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            chunk = np.asarray(chunk, dtype=float)
+            accumulator.update(scale_factor * chunk)
+            if experiment is not None and key is not None:
+                experiment.append(key, chunk, rate=rate, start=start_time,
+                                  scale_factor=scale_factor)
+            else:
+                voltage.append(chunk)
+            update_progress(progress_bar)
+    finally:
+        stop.set()
+        producer.join()
+
+    tau, sig = accumulator.allan_var()
 
     if show_plot:
+        import matplotlib.pyplot as plt
         plt.loglog(tau, sig)
         plt.grid(ls=':', which='both')
         plt.title('Allan Variance')
         plt.ylabel(r'$\sigma$ ($^\circ$/hr)')
         plt.xlabel(r'$\tau$ (s)')
 
-    for i in range(5): # Mysterious buffer precautionary measure
-        sensitivity = lia.sensitivity
-
     acquisition_dict = {
         "start_time" : start_time,
         "time_constant" : tc,
@@ -251,13 +446,15 @@ def acquire_allan_variance(instruments,h5_file_name=None,h5_prefix=None,
         "taus" : tau,
         "sigmas" : sig,
         "scale_factor" : scale_factor,
-        "sensitivity" : lia.sensitivity,
-        "raw_voltage" : voltage
+        "sensitivity" : sensitivity,
+        "raw_voltage" : (np.concatenate(voltage) if voltage
+                         else experiment[key])
     }
 
     if h5_file_name and h5_prefix:
         try:
-            save_to_h5(h5_file_name, h5_prefix, acquisition_dict, instruments)
+            save_to_h5(h5_file_name, h5_prefix, acquisition_dict, instruments,
+                       service=service)
         except Exception as err:
             print(err)
 
@@ -0,0 +1,164 @@
+# coding: utf-8
+"""Batch analysis of Experiment files
+
+Computes the Allan deviation summary of every run in one or more HDF5
+`Experiment` files across a pool of processes, and writes it to a summary
+table. For example::
+
+    python -m pyfog.analyze archive.h5 runs/*.h5 -o summary.csv -j 8
+
+Each worker opens the files itself and reads only the runs it analyzes, so no
+samples pass through the parent process. The summary table is a CSV, Parquet
+or HDF5 file, chosen by the extension of the output. If it already exists,
+runs that it lists are skipped and the new results are added to it, so that
+an interrupted or growing archive can be analyzed incrementally.
+
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from .experiment import Experiment
+
+
+columns = ['file', 'key', 'rate', 'start', 'length', 'scale_factor',
+           'arw', 'drift', 'drift_tau']
+
+
+def analyze_run(filename, key):
+    """Returns the Allan deviation summary of one run as a dictionary.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the Experiment file
+    key : str
+        The name of the run
+
+    Returns
+    -------
+    dict
+        The values of each of the summary `columns`
+    """
+    experiment = Experiment(filename, read_only=True)
+    try:
+        run = experiment[key].load()
+        tau, dev = run.adev
+        return {
+            'file': os.path.abspath(filename),
+            'key': key,
+            'rate': run.rate,
+            'start': run.start if run.start else np.nan,
+            'length': len(run),
+            'scale_factor': run.scale_factor if run.scale_factor else np.nan,
+            'arw': run.arw,
+            'drift': run.drift,
+            'drift_tau': tau[np.argmin(dev)],
+        }
+    finally:
+        experiment.close()
+
+
+def read_summary(filename):
+    """Reads a summary table, returning an empty one if it does not exist."""
+    if not os.path.exists(filename):
+        return pd.DataFrame(columns=columns)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return pd.read_csv(filename)
+    if extension == '.parquet':
+        return pd.read_parquet(filename)
+    return pd.read_hdf(filename, 'summary')
+
+
+def write_summary(summary, filename):
+    """Writes a summary table, in the format given by the extension of
+    `filename`."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        summary.to_csv(filename, index=False)
+    elif extension == '.parquet':
+        summary.to_parquet(filename, index=False)
+    else:
+        summary.to_hdf(filename, key='summary', mode='w', format='table')
+
+
+def analyze(filenames, output, jobs=None):
+    """Analyzes every run of `filenames` that is not yet in the summary table
+    `output`, and adds the results to it.
+
+    Parameters
+    ----------
+    filenames : list of str
+        The Experiment files to analyze
+    output : str
+        The summary table, with a ``.csv``, ``.parquet``, ``.h5`` or ``.hdf5``
+        extension
+    jobs : int, optional
+        The number of worker processes. Defaults to the number of processors.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The updated summary table
+    """
+    summary = read_summary(output)
+    done = set(zip(summary['file'], summary['key'].astype(str)))
+
+    tasks = []
+    for filename in filenames:
+        experiment = Experiment(filename, read_only=True)
+        try:
+            keys = experiment.keys()
+        finally:
+            experiment.close()
+        tasks += [(filename, key) for key in keys
+                  if (os.path.abspath(filename), key) not in done]
+
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(analyze_run, *task): task
+                       for task in tasks}
+            for future in as_completed(futures):
+                filename, key = futures[future]
+                try:
+                    results.append(future.result())
+                except Exception as err:
+                    print('%s[%s]: %s' % (filename, key, err),
+                          file=sys.stderr)
+    finally:
+        # Keep whatever was finished, even if interrupted
+        if results:
+            summary = pd.concat([summary, pd.DataFrame(results)],
+                                ignore_index=True).infer_objects()
+            write_summary(summary[columns], output)
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pyfog.analyze',
+        description='Computes the ADEV, ARW and drift of every run in '
+                    'Experiment files.')
+    parser.add_argument('files', nargs='+', help='Experiment HDF5 files')
+    parser.add_argument('-o', '--output', default='summary.csv',
+                        help='summary table (.csv, .parquet, .h5 or .hdf5); '
+                             'runs already in it are skipped')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes')
+    args = parser.parse_args(argv)
+
+    summary = analyze(args.files, args.output, jobs=args.jobs)
+    print('%i runs in %s' % (len(summary), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,16 +5,25 @@ A wrapper for a PyTables file that contains Gyro runs
 
 """
 
-import tables as pt
-import pandas as pd
 import numpy as np
-from allantools import oadev
 import warnings
+from numpy.lib.mixins import NDArrayOperatorsMixin
 
+from .signal_processing import (
+    overlapping_allan_deviation, Pyramid, _decimate)
 
-class Tombstone(pd.Series):
-    """An extension of ``pandas.Series``, which contains raw data from a
-    tombstone test.
+
+class Tombstone(NDArrayOperatorsMixin):
+    """Raw data from a tombstone test, held in a NumPy array along with the
+    rate, start and scale factor of the run.
+
+    The time axis is implicit, and only built by `time`, `index` or
+    `to_series`. Slicing with sample numbers, e.g. ``run[:60 * run.rate]``,
+    returns a `Tombstone` viewing the same buffer, whose `start` and `rate`
+    follow the slice, which cannot have a negative step. Arithmetic, NumPy
+    functions and the `sum`, `mean`, `median`, `min`, `max`, `std` and `var`
+    methods operate on the samples. Any other ``pandas.Series`` attribute is
+    served from `to_series`, which builds the index on every call.
 
     Parameters
     ----------
@@ -50,36 +59,118 @@ class Tombstone(pd.Series):
         The minimum allan deviation in units of °/h.
     """
 
-    def __init__(self, data, rate, start=None, scale_factor=None,
-                 *args, **kwargs):
+    __slots__ = ('_values', 'rate', 'start', 'scale_factor', '_allan_cache')
 
-        if start:
-            date_index = pd.date_range(
-                start=start*1e9, periods=len(data),
-                freq='%.3g ms' % (1000/rate), tz='UTC')
-            date_index = date_index.tz_convert('America/Los_Angeles')\
-                    .tz_localize(None)
-        else:
-            date_index = np.arange(len(data))/60/60/rate
-        super().__init__(data, date_index, *args, **kwargs)
-        if scale_factor:
-            self.name = 'voltage'
-        else:
-            self.name = 'rotation'
+    def __init__(self, data, rate, start=None, scale_factor=None):
+        self.values = np.asarray(data)
         self.rate = rate
-        self.scale_factor = scale_factor
         self.start = start
+        self.scale_factor = scale_factor
+
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self, data):
+        self._values = data
+        self._allan_cache = None
+
+    @property
+    def name(self):
+        return 'voltage' if self.scale_factor else 'rotation'
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.values, dtype=dtype)
+        return np.asarray(self.values, dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        result = getattr(ufunc, method)(*_values(inputs), **_values(kwargs))
+        # Results that are still one value per sample keep the time axis
+        if isinstance(result, np.ndarray) and result.shape == self.shape:
+            return Tombstone(result, self.rate, self.start,
+                             self.scale_factor)
+        return result
+
+    def __array_function__(self, func, types, args, kwargs):
+        return func(*_values(args), **_values(kwargs))
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self.values[key]
+        start, _, step = _forward_indices(key, len(self))
+        return Tombstone(
+            self.values[key],
+            rate=self.rate / step,
+            start=self.start + start / self.rate if self.start else None,
+            scale_factor=self.scale_factor)
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+        self._allan_cache = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.to_series(), name)
+
+    def __repr__(self):
+        return '<Tombstone %s: %i samples at %g Hz>' % (
+            self.name, len(self), self.rate)
 
-    def __finalize__(self, other, method=None, **kwargs):
-        return self
+    @property
+    def shape(self):
+        return self.values.shape
 
     @property
-    def _constructor(self):
-        return Tombstone
+    def dtype(self):
+        return self.values.dtype
 
     @property
-    def _constructor_sliced(self):
-        return Tombstone
+    def time(self):
+        """The time of every sample in seconds since the start of the run."""
+        return np.arange(len(self)) / self.rate
+
+    @property
+    def index(self):
+        return _time_index(self.start, self.rate, len(self))
+
+    def to_series(self):
+        """Returns the run as a ``pandas.Series``, indexed by local time if
+        `start` is set and by hours since the start otherwise."""
+        import pandas as pd
+        return pd.Series(self.values, index=self.index, name=self.name)
+
+    # The usual reductions, computed from the samples without building the
+    # index. As with pandas, missing samples are skipped.
+
+    def sum(self):
+        return _skip_nan(np.sum, np.nansum, self.values)
+
+    def mean(self):
+        return _skip_nan(np.mean, np.nanmean, self.values)
+
+    def median(self):
+        return _skip_nan(np.median, np.nanmedian, self.values)
+
+    def min(self):
+        return _skip_nan(np.min, np.nanmin, self.values)
+
+    def max(self):
+        return _skip_nan(np.max, np.nanmax, self.values)
+
+    def std(self, ddof=1):
+        return _skip_nan(np.std, np.nanstd, self.values, ddof=ddof)
+
+    def var(self, ddof=1):
+        return _skip_nan(np.var, np.nanvar, self.values, ddof=ddof)
 
     @property
     def voltage(self):
@@ -117,15 +208,40 @@ class Tombstone(pd.Series):
         else:
             return np.array(self)
 
+    def _allan(self):
+        """Returns the overlapping Allan deviation of the rotation data as a
+        ``(tau, dev)`` tuple.
+
+        The result is memoized, so that `adev`, `noise` and `drift` can all be
+        served from a single pass. It is recomputed once `rate` or
+        `scale_factor` have changed, or the samples have been replaced or
+        assigned to through the `Tombstone`. Changes made in place to its
+        `values` array, or through a slice sharing it, are not seen.
+        """
+        key = (self.rate, self.scale_factor)
+        cache = self._allan_cache
+        if cache is None or cache[0] != key:
+            values = np.asarray(self.values, dtype=float)
+            rotation = values * self.scale_factor if self.scale_factor \
+                else values
+            tau, dev, _, _ = overlapping_allan_deviation(rotation, self.rate)
+            cache = self._allan_cache = (key, (tau, dev))
+        return cache[1]
+
     @property
     def adev(self):
-        tau, dev, _, _ = oadev(self.rotation, rate=self.rate,
-                               data_type='freq')
-        return tau, dev
+        return self._allan()
+
+    def pyramid(self):
+        """Returns a `pyfog.signal_processing.Pyramid` of the rotation data,
+        for fast Allan and sigma deviations at long taus. `adev` is the same
+        as ``allan_deviation(run.pyramid(), run.rate)``. See also
+        `Experiment.pyramid`, which stores the pyramid next to a run."""
+        return Pyramid.build(self.rotation, self.rate)
 
     @property
     def noise(self):
-        _, dev, _, _ = oadev(self.rotation, rate=self.rate, data_type='freq')
+        _, dev = self._allan()
         return dev[0]/60
 
     # alias
@@ -133,75 +249,480 @@ class Tombstone(pd.Series):
 
     @property
     def drift(self):
-        tau, dev, _, _ = oadev(self.rotation, rate=self.rate,
-                               data_type='freq')
+        _, dev = self._allan()
         return min(dev)
 
 
+def _skip_nan(reduce, nan_reduce, values, **kwargs):
+    """Returns ``reduce(values)``, or ``nan_reduce(values)`` if the samples
+    include NaNs, without the copy the latter makes otherwise."""
+    result = reduce(values, **kwargs)
+    if np.isnan(result):
+        result = nan_reduce(values, **kwargs)
+    return result
+
+
+def _values(x):
+    """Replaces every `Tombstone` or `LazyTombstone` in `x`, or in a list,
+    tuple or dictionary `x`, with its samples."""
+    if isinstance(x, Tombstone):
+        return x.values
+    if isinstance(x, LazyTombstone):
+        return x.load().values
+    if isinstance(x, (list, tuple)):
+        return type(x)(_values(item) for item in x)
+    if isinstance(x, dict):
+        return {key: _values(value) for key, value in x.items()}
+    return x
+
+
+class LazyTombstone(NDArrayOperatorsMixin):
+    """A run stored in an `Experiment` file, whose samples are only read from
+    disk when they are needed.
+
+    Slicing with sample numbers, e.g. ``run[:60 * run.rate]``, or with index
+    labels through `loc`, e.g. ``run.loc[start:stop]``, reads only the chunks
+    of the file holding those samples and returns a `Tombstone`. The index is
+    only built when `index` is accessed. Any other `Tombstone` attribute,
+    arithmetic, or NumPy function loads the whole run once, and is served
+    from the loaded `Tombstone`.
+
+    Parameters
+    ----------
+    node : tables.Array
+        The PyTables node holding the run
+    """
+
+    def __init__(self, node):
+        self._node = node
+        self._tombstone = None
+        self.rate = node.attrs.rate
+        self.start = node.attrs.start
+        self.scale_factor = node.attrs.scale_factor
+
+    def __len__(self):
+        return self._node.nrows
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.load(), dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        return self.load().__array_ufunc__(ufunc, method, *inputs, **kwargs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        return self.load().__array_function__(func, types, args, kwargs)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return _read_samples(self._node, key)
+        start, stop, step = _forward_indices(key, len(self))
+        return Tombstone(
+            _read_samples(self._node, slice(start, stop, step)),
+            rate=self.rate / step,
+            start=self.start + start / self.rate if self.start else None,
+            scale_factor=self.scale_factor)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<LazyTombstone %s: %i samples at %g Hz>' % (
+            self._node._v_pathname, len(self), self.rate)
+
+    @property
+    def index(self):
+        return _time_index(self.start, self.rate, len(self))
+
+    @property
+    def loc(self):
+        return _LabelSlicer(self)
+
+    def _position(self, label):
+        """Returns the fractional sample number of an index label."""
+        if self.start:
+            import pandas as pd
+            timestamp = pd.Timestamp(label).tz_localize('America/Los_Angeles')
+            return (timestamp.timestamp() - self.start) * self.rate
+        return label * 60 * 60 * self.rate
+
+    def load(self):
+        """Reads the whole run, and returns it as a `Tombstone`."""
+        if self._tombstone is None:
+            self._tombstone = self[:]
+        return self._tombstone
+
+
+class _LabelSlicer():
+    """Implements `LazyTombstone.loc`. As with pandas, both ends of the slice
+    are included."""
+
+    def __init__(self, run):
+        self._run = run
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('Only label slices without a step are supported')
+        start = stop = None
+        if key.start is not None:
+            start = max(int(np.ceil(self._run._position(key.start))), 0)
+        if key.stop is not None:
+            stop = max(int(np.floor(self._run._position(key.stop))) + 1, 0)
+        return self._run[start:stop]
+
+
+def _forward_indices(key, length):
+    """Returns ``key.indices(length)`` for the slice `key` of a run. Slices
+    must run forward in time, as the samples of a run follow its start."""
+    start, stop, step = key.indices(length)
+    if step < 0:
+        raise ValueError('Slices of a run cannot have a negative step')
+    return start, stop, step
+
+
+class _Rotation():
+    """The rotation data of a `LazyTombstone` in °/h, read on slicing, for
+    level 0 of its pyramid."""
+
+    def __init__(self, run):
+        self._run = run
+
+    def __len__(self):
+        return len(self._run)
+
+    def __getitem__(self, key):
+        return self._run[key].rotation
+
+
+def _time_index(start, rate, length):
+    """Returns the index of a run, in local time if it has a `start` time
+    stamp and in hours since the start otherwise."""
+    import pandas as pd
+    if start:
+        index = pd.date_range(
+            start=start*1e9, periods=length,
+            freq='%.3g ms' % (1000/rate), tz='UTC')
+        return index.tz_convert('America/Los_Angeles').tz_localize(None)
+    return pd.Index(np.arange(length)/60/60/rate)
+
+
+_NON_FINITE = np.array([np.nan, -np.inf, np.inf])
+
+
+def _quantize(data, dtype):
+    """Maps the range of `data` onto the full range of the integer `dtype`.
+
+    NaN, -inf and +inf are stored as the three lowest integers, and the
+    finite samples are scaled to fill the rest.
+
+    Returns
+    -------
+    quantized : array of ints
+    scale, offset : float
+        The quantized samples are restored by ``quantized * scale + offset``
+    sentinel : int
+        The integer standing for NaN. The next two stand for -inf and +inf.
+    """
+    info = np.iinfo(dtype)
+    finite = np.isfinite(data)
+    if finite.any():
+        low = np.min(data, where=finite, initial=np.inf)
+        high = np.max(data, where=finite, initial=-np.inf)
+    else:
+        low = high = 0.
+    offset = (high + low) / 2
+    scale = (high - low) / 2 / (info.max - 2) or 1.
+    if finite.all():
+        quantized = np.round((data - offset) / scale).astype(dtype)
+    else:
+        quantized = np.round(
+            np.where(finite, data - offset, 0) / scale).astype(dtype)
+        quantized[np.isnan(data)] = info.min
+        quantized[data == -np.inf] = info.min + 1
+        quantized[data == np.inf] = info.min + 2
+    return quantized, scale, offset, int(info.min)
+
+
+def _read_samples(node, key):
+    """Reads the samples `key` from a run, undoing any quantization applied
+    by `Experiment`."""
+    data = node[key]
+    if 'quantization_scale' in node.attrs:
+        quantized = data
+        data = data * node.attrs.quantization_scale \
+            + node.attrs.quantization_offset
+        if 'quantization_sentinel' in node.attrs:
+            sentinel = node.attrs.quantization_sentinel
+            missing = quantized <= sentinel + 2
+            if np.any(missing):
+                kind = np.clip(quantized, sentinel, sentinel + 2) - sentinel
+                data = np.where(missing, _NON_FINITE[kind], data)[()]
+    return data
+
+
+def _run_description():
+    """Returns the columns of the metadata table kept in every `Experiment`
+    file."""
+    import tables as pt
+    return {
+        'key': pt.StringCol(255, pos=0),
+        'rate': pt.Float64Col(pos=1),
+        'start': pt.Float64Col(dflt=np.nan, pos=2),
+        'scale_factor': pt.Float64Col(dflt=np.nan, pos=3),
+        'length': pt.Int64Col(pos=4),
+        'arw': pt.Float64Col(dflt=np.nan, pos=5),
+        'drift': pt.Float64Col(dflt=np.nan, pos=6),
+    }
+
+
 class Experiment():
     """ A thin wrapper around an h5 file used for storing Allan Deviation runs
 
+    Runs are written as chunked, compressed arrays. The compression and
+    chunk size can be chosen when the file is opened, as can quantizing the
+    samples to integers, which stores each sample in 2 or 4 bytes along with
+    the scale needed to recover it. Files written with other settings, or by
+    older versions of pyfog, are read transparently.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the HDF5 file
+    read_only : bool, optional
+        Open the file without write access
+    complib : str, optional
+        The compression library, e.g. ``'blosc'``, ``'blosc:lz4'`` or
+        ``'zlib'``. ``'blosc'`` falls back to ``'zlib'`` if it is not
+        available.
+    complevel : int, optional
+        The compression level between 0 (no compression) and 9
+    shuffle : bool, optional
+        Apply the byte shuffle filter before compressing, which helps with
+        slowly varying data
+    chunk_size : int, optional
+        The number of samples per chunk. Reading any time slice of a run
+        reads only the chunks that overlap it.
+    quantize : str, optional
+        Either ``'int16'`` or ``'int32'`` to store runs as integers scaled to
+        span the range of each run, or None to store them as floats. NaN and
+        infinite samples are kept as such. Appended runs are always stored
+        as floats, as their range is not known in advance.
+
+    Alongside the runs, the file holds a small metadata table with the rate,
+    start, scale factor, length and Allan deviation summary of every run.
+    `keys`, `has_key`, `in`, `len` and the `where` and `between` queries are
+    answered from this table, without reading any samples. Files written
+    without the table get one the first time they are opened for writing.
     """
-    def __init__(self, filename, read_only=False):
+
+    _index_name = '_index'
+    _pyramid_name = '_pyramids'
+
+    def __init__(self, filename, read_only=False, complib='blosc',
+                 complevel=5, shuffle=True, chunk_size=2**16, quantize=None):
+        import tables as pt
 
         mode = 'a'  # append
         if read_only:
             mode = 'r'
 
+        if quantize not in (None, 'int16', 'int32'):
+            raise ValueError('quantize must be None, int16 or int32')
+        if complib.startswith('blosc') \
+                and not pt.which_lib_version(complib.split(':')[0]):
+            complib = 'zlib'
+        self.filters = pt.Filters(complevel=complevel, complib=complib,
+                                  shuffle=shuffle)
+        self.chunk_size = chunk_size
+        self.quantize = quantize
+
         self.h5file = pt.open_file(filename, mode=mode)
+        self._load_index()
+
+    def _load_index(self):
+        """Reads the metadata table, and reconciles it with the runs in the
+        file: entries of runs that were removed without updating the table
+        are dropped, and entries are added for runs that are missing from it.
+
+        Only the names of the runs are compared, so no run is opened unless
+        it is missing from the table.
+        """
+        import tables as pt
+        self._index = {}
+        if self._index_name in self.h5file.root:
+            for row in self.h5file.get_node('/', self._index_name).read():
+                entry = dict(zip(row.dtype.names, row.tolist()))
+                self._index[entry.pop('key').decode()] = entry
+
+        leaves = self.h5file.root._v_leaves
+        for key in [key for key in self._index if key not in leaves]:
+            self._remove_from_index(key)
+        for key in leaves:
+            if key not in self._index and key != self._index_name:
+                node = leaves[key]
+                if isinstance(node, pt.Array):
+                    self._update_index(key, node)
+
+    def _update_index(self, key, node=None, **summary):
+        """Updates the metadata of the run `key` in memory and, if the file is
+        writable, in the metadata table."""
+        if node is None:
+            node = self.h5file.get_node('/%s' % key)
+        entry = self._index.get(key, {'arw': np.nan, 'drift': np.nan})
+        entry.update(
+            rate=node.attrs.rate,
+            start=node.attrs.start or np.nan,
+            scale_factor=node.attrs.scale_factor or np.nan,
+            length=node.nrows,
+            **summary)
+        self._index[key] = entry
+
+        if self.h5file.mode == 'r':
+            return
+        table = self._index_table()
+        row = tuple([key.encode()] + [entry[name]
+                                      for name in table.colnames[1:]])
+        rows = table.get_where_list('key == k', condvars={'k': key.encode()})
+        if len(rows):
+            table.modify_rows(rows[0], rows[0] + 1, rows=[row])
+        else:
+            table.append([row])
+        table.flush()
+
+    def _remove_from_index(self, key):
+        self._index.pop(key, None)
+        if self.h5file.mode == 'r':
+            return
+        table = self._index_table()
+        for row in table.get_where_list('key == k',
+                                        condvars={'k': key.encode()})[::-1]:
+            table.remove_rows(row, row + 1)
+        table.flush()
+
+    def _index_table(self):
+        if self._index_name in self.h5file.root:
+            return self.h5file.get_node('/', self._index_name)
+        return self.h5file.create_table(
+            '/', self._index_name, _run_description(), 'Run metadata')
 
     def __setitem__(self, key, item):
         key = str(key)
         if 'Tombstone' not in str(type(item)):
             raise ValueError('Object must be type pyfog.Tombstone')
         
+        data = np.asarray(item, dtype=float)
+        if self.quantize:
+            data, scale, offset, sentinel = _quantize(data, self.quantize)
+
         with warnings.catch_warnings(record=False) as w:
             warnings.simplefilter("ignore")
-            arr = self.h5file.create_array(self.h5file.root, key, np.array(item))
+            if len(data):
+                arr = self.h5file.create_carray(
+                    self.h5file.root, key, obj=data, filters=self.filters,
+                    chunkshape=(min(self.chunk_size, len(data)),))
+            else:
+                # HDF5 has no chunked arrays without any samples
+                arr = self.h5file.create_earray(
+                    self.h5file.root, key, obj=data, filters=self.filters,
+                    chunkshape=(self.chunk_size,))
         arr.attrs.rate = item.rate
         arr.attrs.start = item.start
         arr.attrs.scale_factor = item.scale_factor
+        if self.quantize:
+            arr.attrs.quantization_scale = scale
+            arr.attrs.quantization_offset = offset
+            arr.attrs.quantization_sentinel = sentinel
         arr.flush()
 
+        # Keep the Allan deviation summary if it has already been computed
+        summary = {}
+        if getattr(item, '_allan_cache', None) is not None:
+            summary = {'arw': item.arw, 'drift': item.drift}
+        self._update_index(key, arr, **summary)
+
+    def append(self, key, data, rate=None, start=None, scale_factor=None):
+        """Appends samples to the run stored under `key`, creating it as an
+        extendable array if it does not exist yet. The file is flushed after
+        every call, so that the samples survive if the process dies.
+
+        Parameters
+        ----------
+        key : str
+            The name of the run
+        data : array-like of floats
+            The samples to append
+        rate : float, optional
+            The sampling rate in Hz. Only used when the run is created.
+        start : float, optional
+            The unix time stamp of the start of the run. Only used when the
+            run is created.
+        scale_factor : float, optional
+            The conversion factor between volts and deg/h. Only used when the
+            run is created.
+
+        Returns
+        -------
+        int
+            The number of samples stored under `key`
+        """
+        import tables as pt
+        key = str(key)
+        if '/%s' % key in self.h5file:
+            arr = self.h5file.get_node('/%s' % key)
+            if not isinstance(arr, pt.EArray) \
+                    or 'quantization_scale' in arr.attrs:
+                raise ValueError('Run %s cannot be extended' % key)
+        else:
+            arr = self.h5file.create_earray(
+                self.h5file.root, key, pt.Float64Atom(), shape=(0,),
+                filters=self.filters, chunkshape=(self.chunk_size,))
+            arr.attrs.rate = rate
+            arr.attrs.start = start
+            arr.attrs.scale_factor = scale_factor
+        arr.append(np.asarray(data, dtype=float).ravel())
+        self._update_index(key, arr)
+        self.h5file.flush()
+        return arr.nrows
+
     def __getitem__(self, key):
         key = str(key)
-        arr = self.h5file.get_node('/%s' % key)
-        return Tombstone(
-            np.array(arr),
-            rate=arr.attrs.rate,
-            scale_factor=arr.attrs.scale_factor,
-            start=arr.attrs.start)
+        return LazyTombstone(self.h5file.get_node('/%s' % key))
 
     def __repr__(self):
         return repr(self.__dict__)
 
     def __len__(self):
-        return len(self.keys())
+        return len(self._index)
 
     def __delitem__(self, key):
+        key = str(key)
         self.h5file.remove_node('/%s' % key)
+        if '/%s/%s' % (self._pyramid_name, key) in self.h5file:
+            self.h5file.remove_node('/%s' % self._pyramid_name, key,
+                                    recursive=True)
+        self._remove_from_index(key)
 
     def clear(self):
         for key in self.keys():
-            self.h5file.remove_node('/%s' % key)
+            del self[key]
 
     # TODO
     # def copy(self):
     #    return self.__dict__.copy()
 
     def has_key(self, k):
-        return k in self.keys()
+        return str(k) in self._index
 
     # TODO
     # def update(self, *args, **kwargs):
     #    return self.__dict__.update(*args, **kwargs)
 
     def keys(self):
-        return [k.name for k in self.h5file.walk_nodes('/', classname='Array')]
+        return list(self._index)
 
     def values(self):
-        return [self.__getitem__(k.name) for k in
-                self.h5file.walk_nodes('/', classname='Array')]
+        return [self.__getitem__(k) for k in self.keys()]
 
     def items(self):
         return zip(self.keys(), self.values())
@@ -211,10 +732,133 @@ class Experiment():
     #    return self.__cmp__(self.__dict__, dict_)
 
     def __contains__(self, item):
-        return item in self.items()
+        return self.has_key(item)
 
     def __iter__(self):
         return iter(self.items())
 
+    def metadata(self, key):
+        """Returns the metadata of the run `key` as a dictionary, with the
+        keys ``rate``, ``start``, ``scale_factor``, ``length``, ``arw`` and
+        ``drift``. Missing values are NaN."""
+        return dict(self._index[str(key)])
+
+    def summarize(self, key):
+        """Computes the Allan deviation summary of the run `key`, stores it in
+        the metadata table, and returns it as a dictionary with the keys
+        ``arw`` and ``drift``."""
+        key = str(key)
+        run = self[key].load()
+        summary = {'arw': run.arw, 'drift': run.drift}
+        self._update_index(key, **summary)
+        return summary
+
+    def pyramid(self, key):
+        """Returns a `pyfog.signal_processing.Pyramid` of the run `key`, for
+        fast Allan and sigma deviations at long taus.
+
+        As with `Tombstone.pyramid`, the pyramid holds the rotation data in
+        °/h. It is stored next to the run the first time it is built, if the
+        file is writable, and rebuilt if the run has grown or its scale
+        factor has changed since. It is built one chunk at a time, and each
+        level is written as it is built. Level 0 is the lazily loaded run,
+        and the other levels are read from the file when they are first
+        needed.
+
+        ``Pyramid.allan_deviation`` evaluates every tau at level 0 unless
+        `min_overlap` is given, in which case long taus are read from the
+        stored levels. Only `sigma_deviation` uses them by default.
+        """
+        import tables as pt
+        key = str(key)
+        run = self[key]
+        scale_factor = run.scale_factor or 1.
+        path = '/%s/%s' % (self._pyramid_name, key)
+
+        if path in self.h5file:
+            group = self.h5file.get_node(path)
+            if group._v_attrs.length == len(run) and getattr(
+                    group._v_attrs, 'scale_factor', None) == scale_factor:
+                return Pyramid(
+                    [_Rotation(run)] + [
+                        group._f_get_child('level%i' % k)
+                        for k in range(1, group._v_attrs.levels)],
+                    run.rate)
+            if self.h5file.mode != 'r':
+                self.h5file.remove_node(path, recursive=True)
+
+        chunks = (scale_factor
+                  * _read_samples(run._node, slice(i, i + self.chunk_size))
+                  for i in range(0, len(run), self.chunk_size))
+        if self.h5file.mode == 'r':
+            return Pyramid.from_chunks(chunks, run.rate, run=_Rotation(run))
+
+        group = self.h5file.create_group(
+            '/%s' % self._pyramid_name, key, createparents=True)
+        levels = [_Rotation(run)]
+        for k, block in _decimate(chunks):
+            if k == 0:
+                continue
+            if len(levels) <= k:
+                levels.append(self.h5file.create_earray(
+                    group, 'level%i' % k, pt.Float64Atom(), shape=(0,),
+                    filters=self.filters, chunkshape=(self.chunk_size,)))
+            levels[k].append(block)
+
+        # As in Pyramid.from_chunks, levels shorter than two samples are
+        # dropped
+        while len(levels) > 1 and levels[-1].nrows < 2:
+            levels.pop().remove()
+        group._v_attrs.length = len(run)
+        group._v_attrs.scale_factor = scale_factor
+        group._v_attrs.levels = len(levels)
+        self.h5file.flush()
+
+        return Pyramid(levels, run.rate)
+
+    def where(self, condition):
+        """Returns the keys of the runs whose metadata satisfy `condition`.
+
+        The condition is evaluated on the metadata table with the PyTables
+        condition syntax, using the column names ``rate``, ``start``,
+        ``scale_factor``, ``length``, ``arw`` and ``drift``. For example,
+        ``experiment.where('(rate > 100) & (drift < 0.1)')``. Comparisons
+        with missing values are false.
+        """
+        import numexpr
+        keys = self.keys()
+        if not keys:
+            return []
+        columns = {name: np.array([self._index[k][name] for k in keys])
+                   for name in _run_description() if name != 'key'}
+        matches = numexpr.evaluate(condition, local_dict=columns)
+        return [k for k, match in zip(keys, matches) if match]
+
+    def between(self, start=None, stop=None):
+        """Returns the keys of the runs that started between `start` and
+        `stop`, inclusive.
+
+        Both ends are either unix time stamps, or anything accepted by
+        ``pandas.Timestamp``. Times without a timezone are taken to be in the
+        same local time as the index of a `Tombstone`.
+        """
+        def to_unix(time):
+            if isinstance(time, (int, float)):
+                return time
+            import pandas as pd
+            time = pd.Timestamp(time)
+            if time.tzinfo is None:
+                time = time.tz_localize('America/Los_Angeles')
+            return time.timestamp()
+
+        condition = []
+        if start is not None:
+            condition.append('(start >= %r)' % to_unix(start))
+        if stop is not None:
+            condition.append('(start <= %r)' % to_unix(stop))
+        if not condition:
+            return self.keys()
+        return self.where(' & '.join(condition))
+
     def close(self):
         return self.h5file.close()
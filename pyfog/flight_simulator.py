@@ -3,8 +3,9 @@
 accelerometers.
 """
 
+from collections import namedtuple
+
 import numpy as np
-from .experiment import Tombstone
 
 
 def simulate_tombstone(
@@ -14,7 +15,9 @@ def simulate_tombstone(
         hours=0,
         arw=0,
         drift=0,
-        correlation_time=1800
+        correlation_time=1800,
+        rng=None,
+        power_law=None
         ):
     """Generates a stochastic error simulation based on performance indicators.
     Note that this method uses a definition of bias stability that takes the
@@ -27,9 +30,28 @@ def simulate_tombstone(
     >>> data = simulate_fog_single(rate=50, hours=4, arw=.0413,
     ...      drift=.944, correlation_time=3600)
 
+    Other noise types, such as flicker noise (bias instability) or rate
+    random walk, can be added with `power_law`, a mix of power law noises
+    whose one-sided power spectral density is ``sum(h * f**alpha)`` for
+    every ``alpha: h`` pair, in (°/h)²/Hz at 1 Hz. They are synthesized by
+    filtering white noise with the fractional differencing filters of
+    [#Kasdin]_, applied with FFTs. The filters span `2**20` samples at most,
+    so below ``rate / 2**20`` the spectrum of the flicker and random walk
+    noises levels off. The expected Allan deviation is given by
+    `power_law_allan_deviation`. For example, to add a rate random walk and
+    a bias instability of 0.05 °/h:
+
+    >>> data = simulate_tombstone(rate=10, hours=10, arw=.04,
+    ...      power_law={-2: 1e-4, -1: .05**2 / (2 * np.log(2))})
+
     For more information on the algorithm, refer to [#Lv]_.
 
 
+    .. [#Kasdin] Kasdin, N. J. (1995). Discrete simulation of colored noise
+       and stochastic processes and 1/f^α power law noise generation.
+       Proceedings of the IEEE, 83(5), 802–827.
+       http://doi.org/10.1109/5.381848
+
     .. [#Lv] Lv, P., Lai, J., Liu, J., & Qin, G. (2014). Stochastic error
        simulation method of fiber optic gyros based on performance indicators.
        Journal of the Franklin Institute, 351(3), 1501–1516.
@@ -57,6 +79,14 @@ def simulate_tombstone(
         error  simulation method of fiber optic gyros based on performance
         indicators" by Lv et al. They recommend a value between 1800 and 3600
         seconds.
+    rng: numpy.random.Generator or int, optional
+        The random number generator, or a seed for one. Passing the same seed
+        reproduces the same data. By default, the generator is seeded from
+        NumPy's global random state, so that ``np.random.seed`` makes runs
+        repeatable as it did before generators were supported.
+    power_law: dict, optional
+        The coefficients h of the power law noises to add, keyed by the
+        exponent alpha of the frequency, an integer between -2 and 2.
 
     Returns
     -------
@@ -80,6 +110,87 @@ def simulate_tombstone(
 
     arr_size = int(rate * time)
 
+    white_rng, markov_rng, power_rng = _noise_streams(rng)
+    blocks = _lv_noise((white_rng, markov_rng), arr_size, max(arr_size, 1),
+                       *_lv_parameters(rate, time, arw, drift,
+                                       correlation_time))
+    if power_law:
+        blocks = _add_power_law(blocks, power_rng, power_law, rate,
+                                arr_size, max(arr_size, 1))
+    data = next(blocks, np.zeros(0))
+    from .experiment import Tombstone
+    return Tombstone(data=data, rate=rate)
+
+
+def simulate_tombstone_chunks(
+        rate=1,  # Hz
+        seconds=0,
+        minutes=0,
+        hours=0,
+        arw=0,
+        drift=0,
+        correlation_time=1800,
+        rng=None,
+        chunk_size=2**20,
+        power_law=None
+        ):
+    """Generates the same data as `simulate_tombstone`, but yields it in
+    blocks of `chunk_size` samples, so that arbitrarily long runs can be
+    simulated in bounded memory. The state of the Markov process is carried
+    from one block to the next, and for a given seed the concatenated blocks
+    are identical to the output of `simulate_tombstone`.
+
+    Parameters
+    ----------
+    chunk_size: int, optional
+        The number of samples in each block. The last block may be shorter.
+
+    All other parameters are the same as for `simulate_tombstone`.
+
+    Yields
+    ------
+    ndarray.float
+        Consecutive blocks of data in degrees per hour.
+
+    Raises
+    ------
+    ValueError
+        If the seconds, minutes, and hours do not add up to a positive time.
+    """
+
+    time = (hours * 60 * 60
+            + minutes * 60
+            + seconds)
+    if time <= 0:
+        raise ValueError('Time must be greater than zero')
+
+    arr_size = int(rate * time)
+
+    white_rng, markov_rng, power_rng = _noise_streams(rng)
+    blocks = _lv_noise((white_rng, markov_rng), arr_size, chunk_size,
+                       *_lv_parameters(rate, time, arw, drift,
+                                       correlation_time))
+    if power_law:
+        blocks = _add_power_law(blocks, power_rng, power_law, rate,
+                                arr_size, chunk_size)
+    yield from blocks
+
+
+def _noise_streams(rng):
+    """Returns the white noise, Markov innovation and power law streams of a
+    run, all spawned from `rng` at once and in this order, so that each
+    stream is the same whichever noises are simulated. If `rng` is None, the
+    seed is drawn from the legacy global random state."""
+    if rng is None:
+        rng = np.random.randint(2**32, size=4, dtype=np.uint32)
+    return np.random.default_rng(rng).spawn(3)
+
+
+def _lv_parameters(rate, time, arw, drift, correlation_time):
+    """Returns the white noise and Markov innovation standard deviations, and
+    the Markov feedback coefficient, of the model of Lv et al.
+    """
+
     # Set the parameters used by Lv et al
     Ta = 10  # 10 seconds
     ΔT = 1/rate  # sampling time, user-defined
@@ -100,20 +211,367 @@ def simulate_tombstone(
     else:
         qmw = 0
 
-    # Equation 3 in Lv
-    markov = np.zeros(arr_size)
-    for i in range(1, arr_size):
-        markov[i] = (np.exp(-ΔT/Tm) * markov[i-1]
-                     + np.random.randn() * qmw)
+    return qw, qmw, np.exp(-ΔT/Tm)
+
+
+def _lv_noise(streams, size, chunk_size, qw, qmw, a, shape=()):
+    """Yields blocks of white noise plus a first order Gauss-Markov process,
+    with `shape` independent series along the leading axes.
+
+    The white noise and the Markov innovations are drawn from the two
+    separate `streams`, as returned by `_noise_streams`, so the output of a
+    single series does not depend on `chunk_size`. With several series, it
+    does, as each block draws the samples of every series in turn.
+    """
+    from scipy.signal import lfilter
+
+    white_rng, markov_rng = streams
+
+    # Equation 3 in Lv, markov[i] = a * markov[i-1] + qmw * randn, evaluated
+    # as an IIR filter whose state is carried between blocks
+    zi = np.zeros(shape + (1,))
+    for start in range(0, size, chunk_size):
+        n = min(chunk_size, size - start)
+
+        data = white_rng.standard_normal(shape + (n,))
+        data *= qw
+
+        if qmw:
+            innovations = markov_rng.standard_normal(shape + (n,))
+            innovations *= qmw
+            if start == 0:
+                innovations[..., 0] = 0  # the process starts at zero
+            markov, zi = lfilter([1], [1, -a], innovations, axis=-1, zi=zi)
+
+            # Equation 2 in Lv
+            data += markov
+
+        yield data
+
+
+def _add_power_law(blocks, power_rng, power_law, rate, size, chunk_size,
+                   max_kernel_size=2**20):
+    """Adds the power law noise mix `power_law` to every block yielded by
+    `blocks`, which must be `chunk_size` samples long, drawing from the
+    stream `power_rng`."""
+    kernels = _power_law_kernels(power_law, rate,
+                                 max(min(size, max_kernel_size), 1))
+    colored = _filtered_noise(power_rng, size, chunk_size, kernels)
+    for data, noise in zip(blocks, colored):
+        data += noise
+        yield data
+
+
+def _power_law_kernels(power_law, rate, size):
+    """Returns, for each power law, a causal filter of `size` taps which,
+    applied to unit white noise, gives the one-sided power spectral density
+    ``h * f**alpha``.
+
+    Each filter is the fractional differencing filter ``(1 - 1/z) **
+    (alpha / 2)`` of Kasdin, eqn (116), scaled by the variance of eqn (115)
+    and truncated to `size` taps.
+    """
+    τ0 = 1 / rate
+    k = np.arange(1, size)
+    kernels = []
+    for α, h in sorted(_check_power_law(power_law).items()):
+        if not h:
+            continue
+        kernel = np.concatenate(([1.], np.cumprod((k - 1 - α / 2) / k)))
+        kernel *= np.sqrt(h * (2 * np.pi * τ0) ** -α / (2 * τ0))
+        kernels.append(kernel)
+    return np.array(kernels).reshape(-1, size)
+
+
+def _filtered_noise(rng, size, chunk_size, kernels):
+    """Yields blocks of the sum of independent unit white noises, each
+    filtered by one of `kernels`.
+
+    The filtering is an overlap-add convolution: the noises of a block are
+    transformed together, their spectra are filtered and summed, and a
+    single inverse FFT gives the block, whose overlap is added onto the
+    next one.
+    """
+    from scipy import fft
+
+    rngs = rng.spawn(len(kernels))
+    overlap = kernels.shape[-1] - 1
+    nfft = fft.next_fast_len(chunk_size + overlap, real=True)
+    responses = fft.rfft(kernels, nfft)
+    tail = np.zeros(overlap)
+
+    for start in range(0, size, chunk_size):
+        n = min(chunk_size, size - start)
+        white = np.array([r.standard_normal(n) for r in rngs]).reshape(-1, n)
+        spectrum = np.einsum('ij,ij->j', fft.rfft(white, nfft), responses)
+        data = fft.irfft(spectrum, nfft)[:n + overlap]
+        data[:overlap] += tail
+        tail = data[n:]
+        yield data[:n]
+
+
+def _check_power_law(power_law):
+    """Returns `power_law`, raising a ValueError if any exponent is not an
+    integer between -2 and 2."""
+    for α in power_law:
+        if α not in (-2, -1, 0, 1, 2):
+            raise ValueError('Power law exponents must be integers between '
+                             '-2 and 2, not %r' % (α,))
+    return power_law
+
+
+def power_law_allan_deviation(tau, power_law, rate):
+    """Returns the expected Allan deviation of the power law noise mix
+    `power_law`, as passed to `simulate_tombstone`.
+
+    Each power law contributes its Allan variance from NIST SP1065 table 5,
+    with the high frequency cutoff at half the sample `rate`. These hold for
+    taus of a few samples or more:
+
+    ========  ===============  ===================================
+    alpha     noise            Allan variance
+    ========  ===============  ===================================
+    -2        rate random walk ``(2 π**2 / 3) h τ``
+    -1        flicker          ``2 ln(2) h``
+    0         white            ``h / (2 τ)``
+    1         flicker phase    ``(1.038 + 3 ln(2 π fh τ)) h / (4 π**2 τ**2)``
+    2         white phase      ``3 fh h / (4 π**2 τ**2)``
+    ========  ===============  ===================================
+
+    Parameters
+    ----------
+    tau: array_like(float)
+        The taus in seconds
+    power_law: dict
+        The coefficients h, keyed by the exponent alpha
+    rate: float
+        The number of samples per second
+
+    Returns
+    -------
+    ndarray.float
+        The Allan deviation at each tau, in degrees per hour
+
+    Raises
+    ------
+    ValueError
+        If an exponent is not an integer between -2 and 2
+    """
+
+    tau = np.asarray(tau, dtype=float)
+    fh = rate / 2
+    terms = {
+        -2: lambda h: 2 * np.pi**2 / 3 * h * tau,
+        -1: lambda h: 2 * np.log(2) * h * np.ones_like(tau),
+        0: lambda h: h / (2 * tau),
+        1: lambda h: (1.038 + 3 * np.log(2 * np.pi * fh * tau)) * h
+        / (4 * np.pi**2 * tau**2),
+        2: lambda h: 3 * fh * h / (4 * np.pi**2 * tau**2),
+    }
+    return np.sqrt(sum(terms[α](h)
+                       for α, h in _check_power_law(power_law).items()))
+
+
+def allan_deviation_model(tau, arw=0, drift=0, correlation_time=1800,
+                          duration=None, ramp=0, quantization=0):
+    """Returns the expected Allan deviation of the noise simulated by
+    `simulate_tombstone`, optionally with a rate ramp and quantization noise,
+    without simulating it.
+
+    The Allan variance is the sum of the terms of each noise source
+
+    * angle random walk, ``N**2 / τ`` with ``N = 60 * arw``
+    * first order Gauss-Markov bias, ``(2 σm**2 Tc / τ) (1 - (Tc / 2 τ)
+      (3 - 4 exp(-τ / Tc) + exp(-2 τ / Tc)))``
+    * rate ramp, ``R**2 τ**2 / 2``
+    * angle quantization, ``3 Q**2 / τ**2``
+
+    where the variance σm**2 of the Markov process follows from `drift` by
+    the definition of Lv et al, ``drift**2 = σm**2 (2 / π) (arctan(π Tc /
+    Ta) - arctan(π Tc / T)) + N**2 / Ta``, with Ta = 10 s and T the
+    `duration`.
+
+    Parameters
+    ----------
+    tau: array_like(float)
+        The taus in seconds
+    arw: float, optional
+        The angular random walk, specified in degrees per root hour
+    drift: float, optional
+        The bias drift, specified in degrees per hour
+    correlation_time: float, optional
+        The correlation time Tc in seconds. See `simulate_tombstone`.
+    duration: float, optional
+        The length of the run in seconds, which enters the definition of the
+        drift. Defaults to an infinitely long run.
+    ramp: float, optional
+        The rate ramp R, in degrees per hour per hour
+    quantization: float, optional
+        The angle quantization Q, in degrees
+
+    Returns
+    -------
+    ndarray.float
+        The Allan deviation at each tau, in degrees per hour
+    """
+
+    tau = np.asarray(tau, dtype=float)
+    N2 = (arw * 60)**2
+    coefficients = (N2,
+                    _markov_variance(drift, N2, correlation_time, duration),
+                    (ramp / 3600)**2,
+                    (quantization * 3600)**2)
+    basis = _allan_variance_basis(tau, correlation_time)
+    return np.sqrt(np.dot(basis, coefficients))
+
+
+def fit_allan_deviation(tau, dev, correlation_times=None, duration=None,
+                        ramp=False, quantization=False):
+    """Fits the model of `allan_deviation_model` to measured Allan deviation
+    curves, returning the noise parameters.
+
+    For each candidate correlation time the model is linear in the variance
+    of each noise source, which is found by least squares on the relative
+    error of the Allan variance. The correlation time with the smallest
+    residual is kept. Many curves are fit at once, as every step is
+    vectorized across them.
 
-    noise = np.random.randn(arr_size) * qw
+    Parameters
+    ----------
+    tau: array_like(float)
+        The taus in seconds, shared by all curves
+    dev: array_like(float)
+        The Allan deviations in degrees per hour, either one curve or one
+        curve per row. Non-finite values are ignored.
+    correlation_times: array_like(float), optional
+        The candidate correlation times in seconds. Defaults to 61 values
+        spaced logarithmically between 10 s and 10^5 s.
+    duration: float, optional
+        The length of the runs in seconds, see `allan_deviation_model`
+    ramp: bool, optional
+        Also fit a rate ramp
+    quantization: bool, optional
+        Also fit angle quantization
+
+    Returns
+    -------
+    dict
+        The ``arw``, ``drift``, ``correlation_time``, ``ramp`` and
+        ``quantization`` of each curve, in the units of
+        `allan_deviation_model`, and the ``residual``, the root mean square
+        relative error of the fitted Allan variance. Each is a float for a
+        single curve, or an array with one value per row of `dev`.
+    """
+
+    tau = np.asarray(tau, dtype=float)
+    dev = np.asarray(dev, dtype=float)
+    curves = np.atleast_2d(dev)
+    if correlation_times is None:
+        correlation_times = np.logspace(1, 5, 61)
+
+    valid = np.isfinite(curves) & (curves > 0)
+    weights = np.where(valid, 1 / np.where(valid, curves, 1)**2, 0)
+    terms = np.array([True, True, ramp, quantization])
+
+    best = None
+    for Tc in np.atleast_1d(correlation_times).astype(float):
+        # Each row of the design matrix is divided by the measured variance,
+        # so that the target is 1 wherever the curve is valid
+        basis = _allan_variance_basis(tau, Tc)[:, terms]
+        X = weights[:, :, np.newaxis] * basis
+        coefficients = _nonnegative_least_squares(X)
+
+        residual = np.einsum('rti,ri->rt', X, coefficients) - valid
+        residual = np.sqrt(np.sum(residual**2, axis=1)
+                           / np.maximum(valid.sum(axis=1), 1))
+
+        if best is None:
+            best = residual, coefficients, np.full(len(curves), Tc)
+        else:
+            better = residual < best[0]
+            best[0][better] = residual[better]
+            best[1][better] = coefficients[better]
+            best[2][better] = Tc
+
+    residual, coefficients, Tc = best
+    full = np.zeros((len(curves), 4))
+    full[:, terms] = coefficients
+    N2, σm2, R2, Q2 = full.T
+
+    results = {
+        'arw': np.sqrt(N2) / 60,
+        'drift': np.sqrt(_drift_variance(σm2, N2, Tc, duration)),
+        'correlation_time': Tc,
+        'ramp': np.sqrt(R2) * 3600,
+        'quantization': np.sqrt(Q2) / 3600,
+        'residual': residual,
+    }
+    if dev.ndim == 1:
+        results = {key: value[0] for key, value in results.items()}
+    return results
+
+
+def _nonnegative_least_squares(X):
+    """Returns the nonnegative coefficients c minimizing ``|X c - 1|`` for
+    every stack of rows of `X`, ignoring rows of zeros.
+
+    The unconstrained solution is found from the normal equations, and
+    sources with a negative coefficient are dropped and the rest refit,
+    until all coefficients are nonnegative.
+    """
+    # The sources differ by orders of magnitude, so the columns are
+    # normalized, and a tiny ridge keeps the normal equations solvable
+    scale = np.sqrt(np.einsum('rti,rti->ri', X, X))
+    scale[scale == 0] = 1
+    X = X / scale[:, np.newaxis, :]
+    k = X.shape[-1]
+    gram = np.einsum('rti,rtj->rij', X, X) + 1e-12 * np.eye(k)
+    target = X.sum(axis=1)
+
+    active = np.ones(target.shape, dtype=bool)
+    for i in range(k):
+        mask = active[:, :, np.newaxis] & active[:, np.newaxis, :]
+        coefficients = np.linalg.solve(
+            np.where(mask, gram, np.eye(k)),
+            np.where(active, target, 0)[..., np.newaxis])[..., 0]
+        negative = coefficients < 0
+        if not negative.any():
+            break
+        active &= ~negative
+    return np.maximum(coefficients, 0) / scale
 
-    # Equation 2 in Lv
-    data = noise + markov 
-    return Tombstone(data=data, rate=rate) 
 
+def _allan_variance_basis(tau, Tc):
+    """Returns the Allan variance of each noise source of the model, per unit
+    of its coefficient, with one column per source."""
+    r = tau / Tc
+    markov = 2 * Tc / tau * (1 - (3 - 4 * np.exp(-r) + np.exp(-2 * r))
+                             / (2 * r))
+    return np.stack([1 / tau, markov, tau**2 / 2, 3 / tau**2], axis=-1)
 
-def get_cross_track_error(data, rate, velocity):
+
+def _drift_scale(Tc, duration):
+    """Returns the ratio of the squared drift to the variance of the Markov
+    process, in the definition of Lv et al."""
+    Ta = 10
+    T = np.inf if duration is None else duration
+    return 2 / np.pi * (np.arctan(np.pi * Tc / Ta) - np.arctan(np.pi * Tc / T))
+
+
+def _markov_variance(drift, N2, Tc, duration):
+    """Returns the variance of the Markov process of Lv et al for a drift."""
+    Ta = 10
+    return (drift**2 - N2 / Ta) / _drift_scale(Tc, duration) if drift else 0
+
+
+def _drift_variance(σm2, N2, Tc, duration):
+    """Returns the squared drift of Lv et al for a Markov process variance."""
+    Ta = 10
+    return σm2 * _drift_scale(Tc, duration) + N2 / Ta
+
+
+def get_cross_track_error(data, rate, velocity, final_only=False,
+                          dtype=np.float64, overwrite_data=False):
     """Returns the final cross-track position (in nautical miles)
 
     The algorithm simulates an aircraft traveling on a straight trajectory who
@@ -137,23 +595,661 @@ def get_cross_track_error(data, rate, velocity):
     Parameters
     ----------
     data: ndarray.float
-        An array of rotation rates, in deg/h
+        An array of rotation rates, in deg/h. If `data` has more than one
+        dimension, e.g. ``(n_trials, n_samples)``, each row along the last
+        axis is a separate trajectory.
     rate: float
         The sampling rate of data in Hz
-    velocity: float
-        The velocity of the simulated aircraft in kph
+    velocity: float or ndarray.float
+        The velocity of the simulated aircraft in kph, either shared by all
+        trajectories or one per trajectory.
+    final_only: bool, optional
+        If True, only the cross-track error at the end of each trajectory is
+        computed, without storing the trajectories.
+    dtype: numpy.dtype, optional
+        The type used for the accumulation. ``np.float32`` halves the memory
+        used, at the cost of precision.
+    overwrite_data: bool, optional
+        If True, `data` is used as the working buffer and is overwritten,
+        avoiding a copy. It must already be of type `dtype`.
 
     Returns
     -------
-    float
-        The cross track error from this FOG signal.
+    ndarray.float
+        The cross track error from this FOG signal, along the last axis. If
+        `final_only` is True, only the final cross-track error of each
+        trajectory.
     """
 
-    Δθ = data * np.pi/180/3600/rate  # radians
+    data = np.asarray(data)
+    velocity = np.asarray(velocity, dtype=dtype)[..., np.newaxis]
+    n = data.shape[-1]
 
-    heading = np.cumsum(Δθ)
+    # radians per sample per (deg/h), and meters per sample per radian
+    Δθ_scale = np.pi/180/3600/rate
+    Δy_scale = velocity * 1000 / 3600 / rate
 
-    Δy = velocity * 1000 / 3600 / rate * heading  # m
-    xtk = np.cumsum(Δy) / 1852  # nmi
+    if final_only:
+        # The heading after sample j is flown for the n - j remaining
+        # samples, so the final position is a weighted sum of the rotations
+        weights = np.arange(n, 0, -1, dtype=dtype)
+        xtk = (data.astype(dtype, copy=False) @ weights)[..., np.newaxis]
+        xtk *= Δθ_scale * Δy_scale / 1852  # nmi
+        return xtk[..., 0]
+
+    if overwrite_data and data.dtype == dtype:
+        xtk = data
+    else:
+        xtk = data.astype(dtype)
+
+    xtk *= Δθ_scale  # Δθ, radians
+    np.cumsum(xtk, axis=-1, out=xtk)  # heading
+    xtk *= Δy_scale  # Δy, m
+    np.cumsum(xtk, axis=-1, out=xtk)
+    xtk /= 1852  # nmi
 
     return xtk
+
+
+Leg = namedtuple('Leg', ['seconds', 'velocity', 'turn_rate'])
+Leg.__new__.__defaults__ = (0,)
+Leg.__doc__ = """A leg of a flight plan, flown for `seconds` at `velocity` in
+kph, turning at `turn_rate` in degrees per second, counterclockwise when
+positive as are the gyro rates."""
+
+
+def _grouped(a, r):
+    """Returns `a`, padded with zeros to ``8 * r`` samples along its last
+    axis, as `r` groups of 8 samples of shape ``(..., r, 8)``."""
+    m = a.shape[-1]
+    if 8 * r != m:
+        a = np.concatenate(
+            (a, np.zeros(a.shape[:-1] + (8 * r - m,), a.dtype)), axis=-1)
+    return a.reshape(a.shape[:-1] + (r, 8))
+
+
+def _offsets(totals, initial):
+    """Returns `initial` plus the sum of the groups before each one, given
+    their `totals` along the last axis, in double precision, with the total
+    of all the groups last."""
+    offsets = np.empty(totals.shape[:-1] + (totals.shape[-1] + 1,))
+    offsets[..., 0] = 0
+    np.cumsum(totals, axis=-1, dtype=np.float64, out=offsets[..., 1:])
+    offsets += initial
+    return offsets
+
+
+def _triangle(scale, dtype):
+    """Returns the matrix by which `_running_sum` adds up `scale` times the
+    samples within each group of 8, and their offset in its last row. Its
+    other rows, transposed, do the same in `_cumulative`."""
+    triangle = np.vstack((np.triu(np.full((8, 8), scale)), np.ones(8)))
+    return triangle.astype(dtype)
+
+
+def _cumulative(groups, initial, triangle):
+    """Returns `initial` plus the running sum of the samples in `groups`,
+    scaled by `triangle` from `_triangle`, and their total.
+
+    The samples of each group are along the second to last axis of
+    `groups`, of shape ``(..., 8, r)``. The sums within each group are taken
+    by one matrix product, in the type of `groups`, and only the totals of
+    the groups are added up one after the other, in double precision, which
+    is several times faster than `np.cumsum`.
+    """
+    sums = triangle[:8].T @ groups
+    offsets = _offsets(sums[..., -1, :], initial)
+    sums += offsets[..., np.newaxis, :-1].astype(groups.dtype)
+    return sums, offsets[..., -1:]
+
+
+def _running_sum(groups, initial, out, triangle):
+    """Writes `initial` plus the running sum of the samples in `groups`,
+    scaled by `triangle` from `_triangle`, to `out`, and returns their
+    total.
+
+    As `_cumulative`, but `groups` has a shape ``(..., 9, r)`` with the
+    samples in its first 8 rows, and its last row is overwritten with the
+    offset of each group, so that a single matrix product adds up the
+    samples within each group, offsets them and puts them back in order in
+    `out`, of shape ``(..., r, 8)``.
+    """
+    totals = triangle[:8, -1] @ groups[..., :8, :]
+    offsets = _offsets(totals, initial)
+    groups[..., 8, :] = offsets[..., :-1]
+    np.matmul(groups.swapaxes(-1, -2), triangle, out=out)
+    return offsets[..., -1:]
+
+
+def _dot(a, b):
+    """Returns the sum of ``a * b`` over the last two axes, adding up the
+    groups along the second to last axis in the type of `a`, and the totals
+    of the groups in double precision."""
+    totals = np.ones(8, a.dtype) @ (a * b)
+    return totals.sum(axis=-1, keepdims=True, dtype=np.float64)
+
+
+def get_navigation_error(data, rate, flight_plan, final_only=False,
+                         chunk_size=2**16, dtype=np.float32):
+    """Returns the along-track and cross-track position error (in nautical
+    miles) of an aircraft navigating with the gyro errors in `data`.
+
+    Unlike `get_cross_track_error`, the heading and position are integrated
+    without the paraxial approximation, along a flight plan of straight and
+    turning legs flown at different speeds. As there, the accelerometers are
+    perfect, and the heading error is updated by Ω * Δt at each timestep
+    before moving. The error is resolved along and across the true track at
+    each sample.
+
+    The trigonometry is evaluated on half the heading error θ, as
+    ``1 - cos θ = 2 sin²(θ/2)`` and ``sin θ = 2 sin(θ/2) cos(θ/2)``, so that
+    small errors keep their relative precision in single precision, the
+    default. The heading and position errors are carried from one sample to
+    the next in double precision, so that rounding does not build up along
+    the flight, and the errors are accurate to about 1e-6 relative.
+
+    The data is processed in blocks of `chunk_size` samples, carrying the
+    heading and position error from one block to the next, so the working
+    memory does not grow with the length of the flight. `data` can also be
+    given as consecutive blocks, such as the output of
+    `simulate_tombstone_chunks`, so that with `final_only`, flights longer
+    than memory can be flown:
+
+    >>> plan = [Leg(1800, 800), Leg(60, 700, turn_rate=1.5),
+    ...         Leg(9.5 * 3600, 900)]
+    >>> along, cross = get_navigation_error(
+    ...      simulate_tombstone_chunks(rate=10, seconds=10 * 3600, arw=.0413,
+    ...                                drift=.944), 10, plan, final_only=True)
+
+    Parameters
+    ----------
+    data: ndarray.float or iterable of ndarray.float
+        The gyro errors, in deg/h. If `data` has more than one dimension,
+        e.g. ``(n_trials, n_samples)``, each row along the last axis is a
+        separate trial flying the same flight plan. An iterator, or a list
+        or tuple of NumPy arrays, holds consecutive blocks of the data along
+        the last axis. Any other list or tuple is converted to an array, so
+        several trials given as arrays must be stacked first.
+    rate: float
+        The sampling rate of data in Hz
+    flight_plan: sequence of Leg, or float
+        The legs of the flight, or the velocity in kph of a straight flight
+        at constant speed lasting as long as the data.
+    final_only: bool, optional
+        If True, only the errors at the end of the flight are returned.
+    chunk_size: int, optional
+        The number of samples processed at once
+    dtype: numpy.dtype, optional
+        The type of the trigonometry and of the returned errors.
+        ``np.float64`` is exact to rounding, but two to three times slower.
+
+    Returns
+    -------
+    along: ndarray.float
+        The along-track error, positive ahead of the true position, along
+        the last axis, or only at the end if `final_only` is True
+    cross: ndarray.float
+        The cross-track error, positive to the left of the true track
+
+    Raises
+    ------
+    ValueError
+        If the data lasts longer than the flight plan.
+    """
+
+    if np.ndim(flight_plan) == 0:
+        flight_plan = [Leg(np.inf, flight_plan)]
+    legs = iter(flight_plan)
+
+    # Lists and tuples of arrays hold blocks, as iterators do, while other
+    # lists and tuples hold the data itself
+    if isinstance(data, (list, tuple)):
+        given_blocks = all(isinstance(block, np.ndarray) for block in data)
+    else:
+        given_blocks = not hasattr(data, 'shape')
+    if not given_blocks:
+        data = np.asarray(data)
+        n = data.shape[-1]
+        blocks = (data[..., start:start + chunk_size]
+                  for start in range(0, n, chunk_size))
+        if not final_only:
+            out_along = np.empty(data.shape, dtype)
+            out_cross = np.empty(data.shape, dtype)
+    else:
+        n = None
+        blocks = iter(data)
+    results = []
+    done = 0
+
+    # Half the heading error, and the position error along and across the
+    # true track, at the end of the last segment
+    ε = A = C = 0.
+    leg_left = 0
+    heading = _triangle(np.pi / 180 / 3600 / rate / 2, dtype)
+    ones = _triangle(1, dtype)
+    for block in blocks:
+        block = np.asarray(block, dtype=float)
+        # Whole groups of 8 samples, see _running_sum
+        steps = max(chunk_size * block.shape[-1] // max(block.size, 1), 8)
+        steps -= steps % 8
+        start = 0
+        while start < block.shape[-1]:
+            while leg_left <= 0:
+                try:
+                    leg = Leg(*next(legs))
+                except StopIteration:
+                    raise ValueError('The data lasts longer than the flight '
+                                     'plan') from None
+                leg_left = np.round(leg.seconds * rate)
+                Δ = leg.velocity * 1000 / 3600 / rate / 1852  # nmi
+                along_track = _triangle(-2 * Δ, dtype)
+                cross_track = _triangle(2 * Δ, dtype)
+                rotations = {}
+            m = int(min(block.shape[-1] - start, leg_left, steps))
+            r = -(-m // 8)
+            segment = _grouped(block[..., start:start + m], r)
+            start += m
+            leg_left -= m
+
+            # Half the heading error, radians, with the samples of each
+            # group of 8 along the second to last axis
+            θ2 = segment.swapaxes(-1, -2).astype(dtype, order='C')
+            θ2, ε = _cumulative(θ2, ε, heading)
+            s = np.sin(θ2)
+            c = np.cos(θ2, out=θ2)
+            if 8 * r != m:
+                # Nothing moves in the padding
+                s[..., m - 8 * r:, -1] = 0
+
+            # The error of each step along and across its true heading is
+            # u = (cos θ - 1) Δ = -2 sin²(θ/2) Δ and v = sin θ Δ
+            if final_only and not leg.turn_rate:
+                # The track is straight, so the errors add up along it
+                A = A - 2 * Δ * _dot(s, s)
+                C = C + 2 * Δ * _dot(s, c)
+                continue
+
+            if not final_only:
+                if n is None or 8 * r != m:
+                    along = np.empty(segment.shape, dtype)
+                    cross = np.empty(segment.shape, dtype)
+                else:
+                    along = out_along[..., done:done + m].reshape(
+                        segment.shape)
+                    cross = out_cross[..., done:done + m].reshape(
+                        segment.shape)
+
+            groups = np.empty(s.shape[:-2] + (9, r), dtype)
+            if not leg.turn_rate:
+                np.multiply(s, s, out=groups[..., :8, :])
+                A = _running_sum(groups, A, along, along_track)
+                np.multiply(s, c, out=groups[..., :8, :])
+                C = _running_sum(groups, C, cross, cross_track)
+            else:
+                # On a turn, the errors are added up in a fixed frame, that
+                # of the heading at the start of the segment, then resolved
+                # along and across the track at each sample
+                φ = np.radians(leg.turn_rate) / rate
+                if m not in rotations:
+                    φs = φ * np.arange(1, 8 * r + 1).reshape(r, 8)
+                    rotations[m] = (np.cos(φs).astype(dtype),
+                                    np.sin(φs).astype(dtype))
+                cφ, sφ = rotations[m]
+                u = s * s
+                u *= -2 * Δ
+                v = np.multiply(s, c, out=s)
+                v *= 2 * Δ
+                x = np.subtract(cφ.T * u, sφ.T * v, out=groups[..., :8, :])
+                y = sφ.T * u + cφ.T * v
+                if final_only:
+                    x = A + x.sum(axis=(-2, -1), dtype=np.float64)[
+                        ..., np.newaxis]
+                    y = C + y.sum(axis=(-2, -1), dtype=np.float64)[
+                        ..., np.newaxis]
+                else:
+                    X = np.empty(segment.shape, dtype)
+                    x = _running_sum(groups, A, X, ones)
+                    groups[..., :8, :] = y
+                    Y = np.empty(segment.shape, dtype)
+                    y = _running_sum(groups, C, Y, ones)
+                    np.multiply(X, cφ, out=along)
+                    along += Y * sφ
+                    np.multiply(Y, cφ, out=cross)
+                    cross -= X * sφ
+                # The totals are carried in double precision
+                cφ, sφ = np.cos(φ * m), np.sin(φ * m)
+                A = x * cφ + y * sφ
+                C = y * cφ - x * sφ
+                if final_only:
+                    continue
+
+            along = along.reshape(s.shape[:-2] + (8 * r,))[..., :m]
+            cross = cross.reshape(s.shape[:-2] + (8 * r,))[..., :m]
+            if n is None:
+                results.append((along, cross))
+            elif 8 * r != m:
+                out_along[..., done:done + m] = along
+                out_cross[..., done:done + m] = cross
+            done += m
+
+    if final_only:
+        shape = np.shape(ε)[:-1] if np.ndim(ε) else ()
+        return np.reshape(A, shape), np.reshape(C, shape)
+
+    if n is not None:
+        return out_along, out_cross
+    if not results:
+        return np.zeros(0, dtype), np.zeros(0, dtype)
+    return (np.concatenate([along for along, cross in results], axis=-1),
+            np.concatenate([cross for along, cross in results], axis=-1))
+
+
+def monte_carlo_cross_track_error(
+        trials,
+        rate=1,  # Hz
+        seconds=0,
+        minutes=0,
+        hours=0,
+        arw=0,
+        drift=0,
+        correlation_time=1800,
+        velocity=900,  # kph
+        percentiles=(50, 95, 99),
+        batch_size=100,
+        workers=None,
+        seed=None
+        ):
+    """Returns the distribution of the final cross-track error over many
+    simulated flights.
+
+    Each trial simulates a FOG as in `simulate_tombstone` and flies it as in
+    `get_cross_track_error`. The trials are simulated together in batches
+    of `batch_size`, a block of about a million samples at a time, so memory
+    does not grow with the length of the flights, and the batches are spread
+    over a pool of `workers` processes. Every batch draws from its own
+    random stream spawned from `seed`, so the results for a given seed do
+    not depend on the number of workers.
+
+    To estimate the cross-track error of a transpacific flight, one could
+    run:
+
+    >>> xtk, (p50, p95) = monte_carlo_cross_track_error(
+    ...      1000, rate=1, hours=10, arw=.0413, drift=.944,
+    ...      correlation_time=3600, velocity=900, percentiles=(50, 95))
+
+    Parameters
+    ----------
+    trials: int
+        The number of simulated flights
+    rate: float, optional
+        The number of samples per second.
+    seconds: int, optional
+        The number of seconds of flight
+    minutes: int, optional
+        The number of minutes to be added to the seconds parameter
+    hours: int, optional
+        The number of hours to be added to the seconds parameter
+    arw: float, optional
+        The angular random walk, specified in degrees per root hour
+    drift: float, optional
+        The bias drift, specified in degrees per hour
+    correlation_time: float, optional
+        The correlation time in seconds. See `simulate_tombstone`.
+    velocity: float, optional
+        The velocity of the simulated aircraft in kph
+    percentiles: sequence of float, optional
+        The percentiles of the absolute final cross-track error to return,
+        between 0 and 100.
+    batch_size: int, optional
+        The number of trials simulated at once by each worker
+    workers: int, optional
+        The number of worker processes. If 1, everything runs in the calling
+        process. Defaults to the number of processors.
+    seed: int, optional
+        The seed from which the random stream of every batch is spawned.
+
+    Returns
+    -------
+    xtk: ndarray.float
+        The final cross-track error of every trial, in nautical miles
+    percentiles: ndarray.float
+        The requested percentiles of the absolute final cross-track error, in
+        nautical miles
+
+    Raises
+    ------
+    ValueError
+        If the seconds, minutes, and hours do not add up to a positive time.
+    """
+
+    time = (hours * 60 * 60
+            + minutes * 60
+            + seconds)
+    if time <= 0:
+        raise ValueError('Time must be greater than zero')
+
+    arr_size = int(rate * time)
+    parameters = _lv_parameters(rate, time, arw, drift, correlation_time)
+
+    sizes = [min(batch_size, trials - start)
+             for start in range(0, trials, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    batches = [(child, size, arr_size, parameters, rate, velocity)
+               for child, size in zip(seeds, sizes)]
+
+    if workers == 1:
+        results = list(map(_cross_track_batch, batches))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_cross_track_batch, batches))
+
+    xtk = np.concatenate(results) if results else np.zeros(0)
+    return xtk, np.percentile(np.abs(xtk), percentiles)
+
+
+def _cross_track_batch(batch, max_values=2**20):
+    """Simulates one batch of trials for `monte_carlo_cross_track_error` and
+    returns their final cross-track errors.
+
+    The trials are simulated over time in blocks of at most `max_values`
+    samples in all, carrying the heading and position of every trial from
+    one block to the next, so memory does not grow with the length of the
+    flights.
+    """
+    seed, size, arr_size, parameters, rate, velocity = batch
+    chunk_size = max(max_values // max(size, 1), 1)
+    heading = position = np.zeros(size)
+    for block in _lv_noise(_noise_streams(seed)[:2], arr_size, chunk_size,
+                           *parameters, shape=(size,)):
+        # The heading at the start of the block is flown for all of it, and
+        # the turn of each sample for the rest of the block
+        m = block.shape[-1]
+        position = position + heading * m \
+            + block @ np.arange(m, 0, -1, dtype=float)
+        heading = heading + block.sum(axis=-1)
+    # In nmi, as in get_cross_track_error
+    return position * (np.pi/180/3600/rate) \
+        * (np.asarray(velocity) * 1000/3600/rate) / 1852
+
+
+class SimulationSweep():
+    """Simulates a grid of `simulate_tombstone` runs from shared noise.
+
+    The simulated data is linear in the white noise and Markov innovation
+    standard deviations of Lv et al, so every point of the grid is a scaled
+    sum of the same unit white noise and unit Markov process. Both are drawn
+    once, the Markov process is filtered once per correlation time, and the
+    grid points are generated lazily from them. For a given seed, each point
+    is the same as `simulate_tombstone` with that seed, up to rounding.
+
+    The Allan deviation and the cross-track error are computed the same way,
+    from those of the unit sequences, without generating the grid points.
+
+    >>> sweep = SimulationSweep(rate=10, hours=2, arw=[.02, .04, .08],
+    ...                         drift=[.5, 1], correlation_time=3600, rng=0)
+    >>> for params, tau, dev in sweep.adev():
+    ...     print(params['arw'], params['drift'], dev.min())
+
+    Parameters
+    ----------
+    rate: float, optional
+        The number of samples per second.
+    seconds: int, optional
+        The number of seconds of data
+    minutes: int, optional
+        The number of minutes to be added to the seconds parameter
+    hours: int, optional
+        The number of hours to be added to the seconds parameter
+    arw: float or sequence of float, optional
+        The angular random walks, specified in degrees per root hour
+    drift: float or sequence of float, optional
+        The bias drifts, specified in degrees per hour
+    correlation_time: float or sequence of float, optional
+        The correlation times in seconds. See `simulate_tombstone`.
+    rng: numpy.random.Generator or int, optional
+        The random number generator, or a seed for one. By default, it is
+        seeded from NumPy's global random state, as in `simulate_tombstone`.
+
+    Attributes
+    ----------
+    grid: list of dict
+        The ``arw``, ``drift`` and ``correlation_time`` of every point, in
+        the order they are generated, with the correlation time varying
+        slowest.
+
+    Raises
+    ------
+    ValueError
+        If the seconds, minutes, and hours do not add up to a positive time.
+    """
+
+    def __init__(self, rate=1, seconds=0, minutes=0, hours=0, arw=0, drift=0,
+                 correlation_time=1800, rng=None):
+        self.time = (hours * 60 * 60
+                     + minutes * 60
+                     + seconds)
+        if self.time <= 0:
+            raise ValueError('Time must be greater than zero')
+
+        self.rate = rate
+        self.grid = [dict(arw=q, drift=d, correlation_time=Tm)
+                     for Tm in np.atleast_1d(correlation_time)
+                     for q in np.atleast_1d(arw)
+                     for d in np.atleast_1d(drift)]
+        self._rng = rng
+        self._white = self._innovations = None
+        self._markov = (None, None)
+
+    def __len__(self):
+        return len(self.grid)
+
+    def _unit_white(self):
+        """Draws the unit white noise and Markov innovations, once."""
+        if self._white is None:
+            n = int(self.rate * self.time)
+            # The same streams as simulate_tombstone
+            white_rng, markov_rng = _noise_streams(self._rng)[:2]
+            self._white = white_rng.standard_normal(n)
+            self._innovations = markov_rng.standard_normal(n)
+            if n:
+                self._innovations[0] = 0  # the process starts at zero
+        return self._white
+
+    def _unit_markov(self, correlation_time):
+        """Returns the unit Markov process for `correlation_time`, keeping
+        only the last one, as the grid is ordered by correlation time."""
+        if self._markov[0] != correlation_time:
+            from scipy.signal import lfilter
+
+            self._unit_white()
+            a = _lv_parameters(self.rate, self.time, 0, 0,
+                               correlation_time)[2]
+            self._markov = (correlation_time,
+                            lfilter([1], [1, -a], self._innovations))
+        return self._markov[1]
+
+    def _points(self):
+        """Yields every grid point with its white noise and Markov standard
+        deviations."""
+        for params in self.grid:
+            qw, qmw, _ = _lv_parameters(self.rate, self.time, **params)
+            yield params, qw, qmw
+
+    def __iter__(self):
+        """Yields the parameters and the simulated `Tombstone` of every grid
+        point, in deg/h."""
+        from .experiment import Tombstone
+
+        for params, qw, qmw in self._points():
+            data = qw * self._unit_white()
+            if qmw:
+                data += qmw * self._unit_markov(params['correlation_time'])
+            yield params, Tombstone(data=data, rate=self.rate)
+
+    def adev(self, taus=None):
+        """Yields the parameters, taus and overlapping Allan deviation of
+        every grid point.
+
+        The Allan variance of ``qw * white + qmw * markov`` is computed as
+        ``qw**2 * A_ww + qmw**2 * A_mm + 2 * qw * qmw * A_wm`` from the
+        Allan covariances of the unit sequences, which are computed once per
+        correlation time.
+
+        Parameters
+        ----------
+        taus: array_like(float), optional
+            The taus in seconds. Defaults to octave spacing.
+        """
+        from .signal_processing import Phase, overlapping_allan_covariance
+
+        white = Phase(self._unit_white(), self.rate)
+        tau, A_ww = overlapping_allan_covariance(white, white, taus=taus)
+        covariances = None
+
+        for params, qw, qmw in self._points():
+            variance = qw**2 * A_ww
+            if qmw:
+                Tm = params['correlation_time']
+                if covariances is None or covariances[0] != Tm:
+                    markov = Phase(self._unit_markov(Tm), self.rate)
+                    covariances = (
+                        Tm,
+                        overlapping_allan_covariance(markov, markov,
+                                                     taus=taus)[1],
+                        overlapping_allan_covariance(white, markov,
+                                                     taus=taus)[1])
+                _, A_mm, A_wm = covariances
+                variance = variance + qmw**2 * A_mm + 2 * qw * qmw * A_wm
+            yield params, tau, np.sqrt(np.maximum(variance, 0))
+
+    def cross_track_error(self, velocity=900, final_only=True):
+        """Yields the parameters and cross-track error of every grid point,
+        flown as in `get_cross_track_error`.
+
+        The cross-track error is linear in the rotation, so it is computed
+        once for the unit white noise and once per correlation time for the
+        unit Markov process, and scaled for every grid point.
+
+        Parameters
+        ----------
+        velocity: float, optional
+            The velocity of the simulated aircraft in kph
+        final_only: bool, optional
+            If True, only the final cross-track error is returned, otherwise
+            the whole trajectory.
+        """
+        white = get_cross_track_error(self._unit_white(), self.rate,
+                                      velocity, final_only=final_only)
+        markov = None
+
+        for params, qw, qmw in self._points():
+            xtk = qw * white
+            if qmw:
+                Tm = params['correlation_time']
+                if markov is None or markov[0] != Tm:
+                    markov = (Tm, get_cross_track_error(
+                        self._unit_markov(Tm), self.rate, velocity,
+                        final_only=final_only))
+                xtk = xtk + qmw * markov[1]
+            yield params, xtk
@@ -0,0 +1,214 @@
+# coding: utf-8
+"""Asynchronous coordination of the instruments used to test a gyro.
+
+Waiting for the rotation platform is expressed as awaitable events, which poll
+the instrument at an interval that backs off while nothing changes, instead of
+querying it in a tight loop. `InstrumentProxy` caches the state read from an
+instrument, so repeated reads of e.g. the lock-in time constant do not each
+go over the serial or GPIB link.
+
+Everything here only relies on the attributes and methods that pyfog already
+uses on the instruments, so simulated stand-ins can be used in their place.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class InstrumentProxy():
+    """Wraps an instrument, caching the values read from it.
+
+    The first read of an attribute queries the instrument, and later reads
+    return the cached value. Writing an attribute, or calling any method of
+    the instrument, invalidates the cache, since either may change the state
+    of the instrument.
+
+    Parameters
+    ----------
+    instrument : object
+        The instrument to wrap
+    flush_reads : int, optional
+        The number of times an attribute is read when it is not cached. Some
+        instruments return stale values from their buffers on the first few
+        queries after a change, and reading several times clears them out.
+    """
+
+    def __init__(self, instrument, flush_reads=1):
+        object.__setattr__(self, '_instrument', instrument)
+        object.__setattr__(self, '_flush_reads', flush_reads)
+        object.__setattr__(self, '_cache', {})
+
+    def __getattr__(self, name):
+        if name in self._cache:
+            return self._cache[name]
+
+        value = getattr(self._instrument, name)
+        if callable(value):
+            def call(*args, **kwargs):
+                self.invalidate()
+                return value(*args, **kwargs)
+            return call
+
+        for i in range(self._flush_reads - 1):
+            value = getattr(self._instrument, name)
+        self._cache[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self._instrument, name, value)
+        self.invalidate()
+
+    def invalidate(self, *names):
+        """Forgets the cached values of `names`, or of every attribute if no
+        names are given."""
+        if names:
+            for name in names:
+                self._cache.pop(name, None)
+        else:
+            self._cache.clear()
+
+
+async def wait_for(predicate, poll_interval=.05, max_interval=1, backoff=1.5,
+                   timeout=None):
+    """Waits until `predicate()` is true.
+
+    The predicate is evaluated on a worker thread, so that a slow instrument
+    query does not block the event loop. The time between evaluations starts
+    at `poll_interval` and grows by a factor of `backoff` every time, up to
+    `max_interval`.
+
+    Parameters
+    ----------
+    predicate : callable
+        A function without arguments, e.g. ``rot.is_stationary``
+    poll_interval : float, optional
+        The initial time between evaluations, in seconds
+    max_interval : float, optional
+        The longest time between evaluations, in seconds
+    backoff : float, optional
+        The factor by which the interval grows after each evaluation
+    timeout : float, optional
+        The longest time to wait, in seconds. Waits forever if None.
+
+    Raises
+    ------
+    TimeoutError
+        If the predicate is still false after `timeout` seconds
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    interval = poll_interval
+
+    while not await asyncio.to_thread(predicate):
+        sleep = interval
+        if deadline is not None:
+            # Evaluate the predicate one last time at the deadline
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError('Timed out after %g s waiting for %s'
+                                   % (timeout, getattr(predicate, '__name__',
+                                                       predicate)))
+            sleep = min(interval, remaining)
+        await asyncio.sleep(sleep)
+        interval = min(interval * backoff, max_interval)
+
+
+async def stationary(rot, **polling):
+    """Waits until the rotation platform `rot` has stopped. The keyword
+    arguments are passed on to `wait_for`."""
+    await wait_for(rot.is_stationary, **polling)
+
+
+async def constant_speed(rot, **polling):
+    """Waits until the rotation platform `rot` has reached a constant speed.
+    The keyword arguments are passed on to `wait_for`."""
+    await wait_for(rot.is_constant_speed, **polling)
+
+
+def run(coroutine):
+    """Runs `coroutine` to completion and returns its result.
+
+    This also works when an event loop is already running in this thread, as
+    in a Jupyter notebook, by running the coroutine on a separate thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+# Rotate at a known speed in one direction,
+# and at a known speed in the opposite direction
+
+async def calibrate_scale_factor(instruments, _dither_angle=5,
+                                 _dither_velocity=1, _padding=1,
+                                 poll_interval=.05, max_interval=.5,
+                                 timeout=None):
+    """Return scale factor in terms of degrees per hour per volt
+
+    The rotation platform is dithered back and forth, and the lock-in output
+    is read while the platform turns at a constant speed in each direction.
+
+    Parameters
+    ----------
+    instruments : dict
+        The ``'rotation_platform'``, ``'lock_in_amplifier'`` and
+        ``'data_acquisition_unit'``
+    poll_interval, max_interval : float, optional
+        The polling intervals used while waiting for the platform to stop,
+        see `wait_for`. The wait for constant speed polls every
+        `poll_interval` without backing off, so that the lock-in output is
+        read as soon as possible after the platform reaches speed, leaving
+        the `_padding` for the end of the move.
+    timeout : float, optional
+        The longest time to wait for each motion of the platform, in seconds
+    """
+    rot = instruments['rotation_platform']
+    lia = InstrumentProxy(instruments['lock_in_amplifier'], flush_reads=5)
+    daq = instruments['data_acquisition_unit']
+    polling = dict(poll_interval=poll_interval, max_interval=max_interval,
+                   timeout=timeout)
+
+    rot.velocity = _dither_velocity
+
+    read_time = _dither_angle / _dither_velocity - _padding
+
+    # Clear out a funky buffer...
+    freq = 1 / lia.time_constant
+
+    rot.cw(.5*_dither_angle, background=True)
+    await asyncio.sleep(.5)
+    #lia.autogain()
+    lia.sensitivity = 0.1
+    await stationary(rot, **polling)
+
+    rot.ccw(.5*_dither_angle, background=True)
+    await asyncio.sleep(.5)
+    lia.autophase()
+    await stationary(rot, **polling)
+
+    data = []
+    for turn in (rot.cw, rot.ccw):
+        turn(_dither_angle, background=True)
+        await constant_speed(rot, poll_interval=poll_interval,
+                             max_interval=poll_interval, timeout=timeout)
+        data.append(await asyncio.to_thread(
+            daq.read, seconds=read_time, frequency=freq,
+            max_voltage=lia.sensitivity))
+        await stationary(rot, **polling)
+
+    cw_data, ccw_data = data
+
+    # volts per degree per second
+    vpdps = (abs(np.mean(cw_data)) + abs(np.mean(ccw_data))) / (2 *
+                                                             _dither_velocity)
+    # compensate for stage pitch
+    vpdps /= np.cos(37.4/180*np.pi)
+
+    # degree per hour per volt
+    dphpv = 1 / vpdps * 60 ** 2
+    return dphpv
@@ -3,22 +3,102 @@
 """
 
 import numpy as np
-from allantools import oadev
 
 
-def allan_deviation(data, rate):
-    """Returns the Allan deviation. Makes use of `oadev` from the `allantools` 
-    repository
+class Phase():
+    """The phase (time integral) of a rate signal, shared by the deviation
+    estimators in this module.
+
+    The phase is computed with a single pass over the data. Passing the same
+    `Phase` to several estimators, or using `deviations`, avoids repeating
+    that pass for every statistic. The reflected phase needed by
+    `total_deviation` is only built when first used.
 
     Parameters
     ----------
 
     data: array_like(float)
+        The data to be processed, e.g. a rotation rate in °/h
+
+    rate: float
+        The sampling rate in Hz
+
+    Attributes
+    ----------
+
+    x: ndarray.float
+        The phase, with a leading zero, so that ``len(x) == len(data) + 1``
+    """
+
+    def __init__(self, data, rate):
+        data = np.asarray(data, dtype=float)
+        self.rate = rate
+
+        # Removing the mean keeps the phase small, preserving precision
+        self.x = np.zeros(len(data) + 1)
+        np.cumsum(data - np.mean(data), out=self.x[1:])
+        self.x /= rate
+
+        self._reflected = None
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def reflected(self):
+        """The phase extended by reflection at both ends, of length
+        ``3 * len(x) - 4``, as used by the total deviation."""
+        if self._reflected is None:
+            x = self.x
+            self._reflected = np.concatenate((
+                (2 * x[0] - x[1:-1])[::-1],
+                x,
+                2 * x[-1] - x[1:-1][::-1]))
+        return self._reflected
+
+    def averaging_factors(self, taus=None):
+        """Returns the numbers of samples averaged for `taus`, in seconds, or
+        for octave spaced taus if `taus` is None."""
+        if taus is None:
+            return 2 ** np.arange(int(np.log2(len(self))) + 1)
+        m = np.unique(np.round(np.asarray(taus) * self.rate).astype(int))
+        return m[(m > 0) & (m < len(self))]
+
+
+def _as_phase(data, rate):
+    return data if isinstance(data, Phase) else Phase(data, rate)
+
+
+def _results(phase, ms, devs, ns):
+    """Packs the deviations, with their errors, dropping those computed from
+    fewer than two terms."""
+    ms, devs, ns = np.asarray(ms), np.asarray(devs), np.asarray(ns)
+    valid = ns > 1
+    ms, devs, ns = ms[valid], devs[valid], ns[valid]
+    return ms / phase.rate, devs, devs / np.sqrt(ns), ns
+
+
+def allan_deviation(data, rate, min_overlap=None):
+    """Returns the overlapping Allan deviation, at octave spaced taus. See
+    `overlapping_allan_deviation`.
+
+    Parameters
+    ----------
+
+    data: array_like(float), Phase or Pyramid
         The data to be processed
 
     rate: float
         The sampling rate in Hz
 
+    min_overlap: int, optional
+        Only used if `data` is a `Pyramid`. If given, long taus are read from
+        coarse levels of the pyramid, with windows spaced by more than one
+        sample, as described in `Pyramid.allan_deviation`. This changes the
+        estimator, so the result differs from that of the full-rate data
+        within the confidence of the estimate. By default the result is the
+        same as for the data of level 0.
+
     Returns
     -------
 
@@ -30,17 +110,302 @@ def allan_deviation(data, rate):
     Examples
     --------
 
-        >>>foo()
+        >>> tau, dev = allan_deviation(simulate_tombstone(hours=1), 1)
     """
 
-    tau, dev, dev_error, N = oadev(data, rate=rate, data_type='freq')
+    if isinstance(data, Pyramid):
+        return data.allan_deviation(min_overlap=min_overlap)
+
+    tau, dev, dev_error, N = overlapping_allan_deviation(data, rate)
 
     return tau, dev
 
 
+def overlapping_allan_deviation(data, rate=None, taus=None):
+    """Returns the overlapping Allan deviation, NIST SP1065 eqn (11).
+
+    Parameters
+    ----------
+
+    data: array_like(float) or Phase
+        The data to be processed
+
+    rate: float
+        The sampling rate in Hz. Not needed if `data` is a `Phase`.
+
+    taus: array_like(float), optional
+        The taus in seconds. Defaults to octave spacing.
+
+    Returns
+    -------
+
+    tau: ndarray.float
+        The taus used
+    dev: ndarray.float
+        The deviations
+    dev_error: ndarray.float
+        A rough one sigma uncertainty of each deviation, ``dev / sqrt(n)``,
+        which ignores the correlation of overlapping terms. See
+        `confidence_interval` for chi-squared bounds.
+    n: ndarray.int
+        The number of terms averaged for each deviation
+    """
+
+    phase = _as_phase(data, rate)
+    x = phase.x
+    ms = phase.averaging_factors(taus)
+    devs, ns = [], []
+
+    for m in ms:
+        v = x[2 * m:] - 2 * x[m:-m] + x[:-2 * m]
+        n = len(v)
+        devs.append(np.sqrt(np.dot(v, v) / (2 * max(n, 1))) * phase.rate / m)
+        ns.append(n)
+
+    return _results(phase, ms, devs, ns)
+
+
+def modified_allan_deviation(data, rate=None, taus=None):
+    """Returns the modified Allan deviation, NIST SP1065 eqn (14). See
+    `overlapping_allan_deviation` for the parameters and return values."""
+
+    phase = _as_phase(data, rate)
+    x = phase.x
+    ms = phase.averaging_factors(taus)
+    devs, ns = [], []
+
+    for m in ms:
+        # Each term is a sum of m consecutive second differences, taken as a
+        # difference of their running sum
+        d = x[2 * m:] - 2 * x[m:-m] + x[:-2 * m]
+        c = np.zeros(len(d) + 1)
+        np.cumsum(d, out=c[1:])
+        v = c[m:] - c[:-m]
+        n = len(v)
+        τ = m / phase.rate
+        devs.append(np.sqrt(np.dot(v, v) / (2 * m**2 * τ**2 * max(n, 1))))
+        ns.append(n)
+
+    return _results(phase, ms, devs, ns)
+
+
+def hadamard_deviation(data, rate=None, taus=None):
+    """Returns the overlapping Hadamard deviation, NIST SP1065 eqn (20). See
+    `overlapping_allan_deviation` for the parameters and return values."""
+
+    phase = _as_phase(data, rate)
+    x = phase.x
+    ms = phase.averaging_factors(taus)
+    devs, ns = [], []
+
+    for m in ms:
+        v = x[3 * m:] - 3 * x[2 * m:-m] + 3 * x[m:-2 * m] - x[:-3 * m]
+        n = len(v)
+        devs.append(np.sqrt(np.dot(v, v) / (6 * max(n, 1))) * phase.rate / m)
+        ns.append(n)
+
+    return _results(phase, ms, devs, ns)
+
+
+def total_deviation(data, rate=None, taus=None):
+    """Returns the total deviation, NIST SP1065 eqn (25), which extends the
+    data by reflection to improve the confidence at long taus. See
+    `overlapping_allan_deviation` for the parameters and return values."""
+
+    phase = _as_phase(data, rate)
+    x = phase.reflected
+    N = len(phase)
+    mid = N - 2
+    ms = phase.averaging_factors(taus)
+    devs, ns = [], []
+
+    for m in ms:
+        # Centered second differences over the original data
+        k = mid + 1
+        count = min(mid, len(x) - k - m)
+        v = x[k - m:k - m + count] - 2 * x[k:k + count] \
+            + x[k + m:k + m + count]
+        τ = m / phase.rate
+        devs.append(np.sqrt(np.dot(v, v) / (2 * τ**2 * (N - 2))))
+        ns.append(mid)
+
+    return _results(phase, ms, devs, ns)
+
+
+_estimators = {
+    'oadev': overlapping_allan_deviation,
+    'mdev': modified_allan_deviation,
+    'hdev': hadamard_deviation,
+    'totdev': total_deviation,
+}
+
+
+def deviations(data, rate, kinds=('oadev', 'mdev', 'hdev', 'totdev'),
+               taus=None):
+    """Returns several deviations of the same data, computing the phase only
+    once.
+
+    Parameters
+    ----------
+
+    data: array_like(float) or Phase
+        The data to be processed
+
+    rate: float
+        The sampling rate in Hz
+
+    kinds: sequence of str, optional
+        Any of ``'oadev'``, ``'mdev'``, ``'hdev'`` and ``'totdev'``
+
+    taus: array_like(float), optional
+        The taus in seconds. Defaults to octave spacing.
+
+    Returns
+    -------
+
+    dict
+        The ``(tau, dev, dev_error, n)`` tuple of each kind, as returned by
+        `overlapping_allan_deviation`.
+    """
+
+    phase = _as_phase(data, rate)
+    return {kind: _estimators[kind](phase, taus=taus) for kind in kinds}
+
+
+def allan_edf(n, m, alpha=0):
+    """Returns the equivalent degrees of freedom of an overlapping Allan
+    variance, with Stein's approximations, NIST SP1065 table 2.
+
+    Parameters
+    ----------
+
+    n: int
+        The number of phase points, ``len(data) + 1``
+
+    m: array_like(int)
+        The numbers of samples averaged
+
+    alpha: int, optional
+        The exponent of the frequency noise spectrum, from 2 (white phase
+        modulation) to -2 (random walk), e.g. 0 for angular random walk
+
+    Returns
+    -------
+
+    edf: ndarray.float
+        The equivalent degrees of freedom for each `m`
+    """
+    m = np.asarray(m, dtype=float)
+    n = float(n)
+    if alpha == 2:
+        return (n + 1) * (n - 2 * m) / (2 * (n - m))
+    if alpha == 1:
+        return np.exp(np.sqrt(np.log((n - 1) / (2 * m))
+                              * np.log((2 * m + 1) * (n - 1) / 4)))
+    if alpha == 0:
+        return (3 * (n - 1) / (2 * m) - 2 * (n - 2) / n) \
+            * 4 * m**2 / (4 * m**2 + 5)
+    if alpha == -1:
+        return np.where(m == 1, 2 * (n - 2) / (2.3 * n - 4.9),
+                        5 * n**2 / (4 * m * (n + 3 * m)))
+    if alpha == -2:
+        return (n - 2) / (m * (n - 3)**2) \
+            * ((n - 1)**2 - 3 * m * (n - 1) + 4 * m**2)
+    raise ValueError('alpha must be an integer from -2 to 2')
+
+
+def confidence_interval(dev, edf, ci=0.6826894921370859):
+    """Returns the chi-squared confidence interval of deviations, NIST
+    SP1065 eqn (45).
+
+    Parameters
+    ----------
+
+    dev: array_like(float)
+        The deviations
+
+    edf: array_like(float)
+        Their equivalent degrees of freedom, e.g. from `allan_edf`
+
+    ci: float, optional
+        The confidence level. Defaults to one sigma.
+
+    Returns
+    -------
+
+    low, high: ndarray.float
+        The bounds of the interval
+
+    Examples
+    --------
+
+        >>> phase = Phase(data, rate)
+        >>> tau, dev, dev_error, n = overlapping_allan_deviation(phase)
+        >>> low, high = confidence_interval(
+        ...     dev, allan_edf(len(phase), tau * rate))
+    """
+    from scipy.stats import chi2
+    edf = np.asarray(edf, dtype=float)
+    tail = min(ci, 1 - ci) / 2
+    variance = np.asarray(dev, dtype=float) ** 2
+    return (np.sqrt(edf * variance / chi2.ppf(1 - tail, edf)),
+            np.sqrt(edf * variance / chi2.ppf(tail, edf)))
+
+
+def overlapping_allan_covariance(a, b, rate=None, taus=None):
+    """Returns the overlapping Allan covariance of two signals, the bilinear
+    form of which the overlapping Allan variance is the quadratic form.
+
+    As the Allan variance of ``p * a + q * b`` is ``p**2 * cov(a, a) +
+    q**2 * cov(b, b) + 2 * p * q * cov(a, b)``, the Allan deviation of any
+    linear combination of the same signals follows from three covariances.
+
+    Parameters
+    ----------
+
+    a, b: array_like(float) or Phase
+        The data to be processed, of the same length
+
+    rate: float
+        The sampling rate in Hz. Not needed if `a` and `b` are `Phase`.
+
+    taus: array_like(float), optional
+        The taus in seconds. Defaults to octave spacing.
+
+    Returns
+    -------
+
+    tau: ndarray.float
+        The taus used
+    cov: ndarray.float
+        The covariances
+    """
+
+    a, b = _as_phase(a, rate), _as_phase(b, rate)
+    x, y = a.x, b.x
+    ms = a.averaging_factors(taus)
+    covs, ns = [], []
+
+    for m in ms:
+        u = x[2 * m:] - 2 * x[m:-m] + x[:-2 * m]
+        v = u if y is x else y[2 * m:] - 2 * y[m:-m] + y[:-2 * m]
+        n = len(v)
+        covs.append(np.dot(u, v) / (2 * max(n, 1)) * (a.rate / m) ** 2)
+        ns.append(n)
+
+    ms, covs, ns = np.asarray(ms), np.asarray(covs), np.asarray(ns)
+    valid = ns > 1
+    return ms[valid] / a.rate, covs[valid]
+
+
 def sigma_deviation(data, rate):
     """Returns the sigma deviation. For more details, consult [#Matthews]_.
 
+    All of the block means, for every tau, are taken from a single cumulative
+    sum of the data. When the number of samples in a block, ``rate * tau``,
+    is not an integer, the samples straddling the block boundaries are split
+    between the neighbouring blocks in proportion.
+
     .. [#Matthews] Matthews, J.B., M.I. Gneses, D.S. Berg, "A high-resolution
        laser gyro,"
        Proc. IEEE NAECON, pp. 556-568, May 1978
@@ -48,8 +413,8 @@ def sigma_deviation(data, rate):
     Parameters
     ----------
 
-    data: array_like(float)
-        The data to be processed
+    data: array_like(float) or Pyramid
+        The data to be processed. If 2-D, each row is a separate run.
 
     rate: float
         The sampling rate in Hz
@@ -60,22 +425,247 @@ def sigma_deviation(data, rate):
     tau: list of float
         The taus used in the Allan deviation
     dev: list of float
-        The  Allan deviations.
+        The  Allan deviations. If `data` is 2-D, this has one row per run.
+        Taus longer than the data give NaN.
     """
 
-    τs = np.unique((np.logspace(0, np.log10(len(data)), 30).astype(int)))
-    σs = []
-
-    for τ in τs:
-        data_copy = data
+    if isinstance(data, Pyramid):
+        return data.sigma_deviation()
 
-        spacing = rate*τ
-        leftovers = len(data_copy) % spacing
-        if leftovers:
-            data_copy = data_copy[:-leftovers]
+    data = np.asarray(data, dtype=float)
+    n = data.shape[-1]
 
-        reshaped = np.mean(data_copy.reshape(-1, spacing), axis=1)
-        sigma = np.std(reshaped)
-        σs.append(sigma)
+    τs = np.unique((np.logspace(0, np.log10(n), 30).astype(int)))
+    σs = _block_deviation(data, rate*τs)
 
     return τs, σs
+
+
+def _block_deviation(data, spacings):
+    """Returns the standard deviation of the means of consecutive blocks of
+    each of the (possibly fractional) numbers of samples in `spacings`, along
+    the last axis of `data`. Spacings longer than the data give NaN."""
+
+    n = data.shape[-1]
+    σs = np.full(data.shape[:-1] + np.shape(spacings), np.nan)
+
+    # Cumulative sum with a leading zero, so that the sum of the first t
+    # samples is c[t]. Removing the mean keeps the sums small.
+    x = data - np.mean(data, axis=-1, keepdims=True)
+    c = np.zeros(data.shape[:-1] + (n + 1,))
+    np.cumsum(x, axis=-1, out=c[..., 1:])
+    x = np.concatenate((x, np.zeros(data.shape[:-1] + (1,))), axis=-1)
+
+    for j, spacing in enumerate(spacings):
+        blocks = int(n // spacing)
+        if not blocks:
+            continue
+
+        # The sum of the samples before the fractional position t
+        boundaries = np.arange(blocks + 1) * spacing
+        whole = np.minimum(np.floor(boundaries).astype(int), n)
+        sums = c[..., whole] + (boundaries - whole) * x[..., whole]
+
+        means = np.diff(sums, axis=-1) / spacing
+        σs[..., j] = np.std(means, axis=-1)
+
+    return σs
+
+
+def _decimate(chunks):
+    """Yields ``(k, block)`` for consecutive blocks of every level k of the
+    pyramid of a run given as consecutive `chunks`, starting with the chunks
+    themselves at level 0."""
+    carries = []
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=float).ravel()
+        yield 0, chunk
+        k = 0
+        while len(chunk):
+            if len(carries) <= k:
+                carries.append(np.zeros(0))
+            # Pair up samples, carrying an odd one over to the next chunk
+            chunk = np.concatenate((carries[k], chunk))
+            even = len(chunk) - len(chunk) % 2
+            carries[k] = chunk[even:]
+            chunk = (chunk[0:even:2] + chunk[1:even:2]) / 2
+            k += 1
+            yield k, chunk
+
+
+class Pyramid():
+    """Successively block averaged copies of a run, for fast analysis at long
+    taus.
+
+    Level 0 is the run itself, and each level above it holds the means of
+    pairs of samples of the level below, at half its rate. The phase of
+    level k is exactly the phase of the run sampled every 2**k samples, so
+    statistics that only need the phase at those points can be computed from
+    a fraction of the data:
+
+    * The block means used by `sigma_deviation` are exact at the coarsest
+      level whose block size divides the number of samples in a block.
+    * The overlapping Allan deviation needs the phase after every sample,
+      so it is only exact at level 0, where it is computed by default. With
+      `min_overlap`, the deviation at m samples is instead evaluated at the
+      coarsest level whose block size divides m and is at most
+      ``m / min_overlap``. Its windows are then spaced by that block size
+      rather than by one sample. Windows closer than a fraction of m are
+      strongly correlated, so this barely changes the confidence of the
+      estimate, while the cost at long taus falls by orders of magnitude,
+      but the values differ from the full-rate estimate by a few percent.
+
+    Samples left over at the end of a run that do not fill a block of a level
+    are not included in that level.
+
+    Parameters
+    ----------
+
+    levels: list of array_like(float)
+        The data of each level, starting with the run itself at level 0. Any
+        object whose samples are read with ``level[:]``, such as a lazily
+        loaded run or a PyTables array, may be used. Each level is only read
+        when a tau needs it.
+
+    rate: float
+        The sampling rate of level 0 in Hz
+    """
+
+    def __init__(self, levels, rate):
+        self.levels = list(levels)
+        self.rate = rate
+        self.n = len(self.levels[0])
+
+    @classmethod
+    def build(cls, data, rate, min_length=2):
+        """Builds a pyramid from the samples of a run, adding levels until
+        they would be shorter than `min_length`."""
+        return cls.from_chunks([data], rate, min_length=min_length,
+                               run=data)
+
+    @classmethod
+    def from_chunks(cls, chunks, rate, min_length=2, run=None):
+        """Builds a pyramid from consecutive chunks of a run, without holding
+        the run in memory.
+
+        Parameters
+        ----------
+
+        chunks: iterable of array_like(float)
+            Consecutive chunks of the run
+
+        rate: float
+            The sampling rate in Hz
+
+        min_length: int, optional
+            Levels shorter than this are not built
+
+        run: array_like(float), optional
+            The run itself, used as level 0. If None, level 0 is assembled
+            from the chunks.
+        """
+        levels, n = [[]], 0
+        for k, block in _decimate(chunks):
+            if k == 0:
+                n += len(block)
+                if run is not None:
+                    continue
+            if len(levels) <= k:
+                levels.append([])
+            levels[k].append(block)
+
+        levels = [np.concatenate(level) if level else np.zeros(0)
+                  for level in levels]
+        if run is not None:
+            levels[0] = run
+        levels = [levels[0]] + [level for level in levels[1:]
+                                if len(level) >= min_length]
+        pyramid = cls(levels, rate)
+        pyramid.n = n
+        return pyramid
+
+    def _level_data(self, k):
+        return np.asarray(self.levels[k][:], dtype=float)
+
+    def _coarsest_level(self, m, limit):
+        """Returns the coarsest level whose block size divides `m` and is at
+        most `limit`."""
+        k = 0
+        while (k + 1 < len(self.levels) and m % 2 ** (k + 1) == 0
+               and 2 ** (k + 1) <= limit):
+            k += 1
+        return k
+
+    def allan_deviation(self, taus=None, min_overlap=None):
+        """Returns the overlapping Allan deviation, as described above.
+
+        Parameters
+        ----------
+
+        taus: array_like(float), optional
+            The taus in seconds. Defaults to octave spacing.
+
+        min_overlap: int, optional
+            If None, the default, every tau is evaluated at level 0, which
+            gives the same result as `overlapping_allan_deviation` of the
+            run. Otherwise, the smallest number of overlapping windows per
+            averaging time, evaluating long taus at coarse levels. Use 1 to
+            always use non-overlapping windows of the coarsest exact level.
+
+        Returns
+        -------
+
+        tau: ndarray.float
+            The taus used
+        dev: ndarray.float
+            The deviations
+        """
+
+        if taus is None:
+            ms = 2 ** np.arange(int(np.log2(self.n + 1)) + 1)
+        else:
+            ms = np.unique(np.round(np.asarray(taus) * self.rate).astype(int))
+        ms = ms[(ms > 0) & (ms < self.n + 1)]
+
+        by_level = {}
+        for m in ms:
+            k = 0
+            if min_overlap is not None:
+                k = self._coarsest_level(m, m / min_overlap)
+            by_level.setdefault(k, []).append(m)
+
+        τs, devs = [], []
+        for k, level_ms in sorted(by_level.items()):
+            rate = self.rate / 2 ** k
+            phase = Phase(self._level_data(k), rate)
+            τ, dev, _, _ = overlapping_allan_deviation(
+                phase, taus=np.array(level_ms) / self.rate)
+            τs.append(τ)
+            devs.append(dev)
+
+        if not τs:
+            return np.zeros(0), np.zeros(0)
+        τs, devs = np.concatenate(τs), np.concatenate(devs)
+        order = np.argsort(τs)
+        return τs[order], devs[order]
+
+    def sigma_deviation(self):
+        """Returns the sigma deviation, at the same taus as
+        `sigma_deviation`, reading each from the coarsest exact level."""
+
+        τs = np.unique((np.logspace(0, np.log10(self.n), 30).astype(int)))
+        σs = np.full(τs.shape, np.nan)
+        spacings = self.rate * τs
+
+        by_level = {}
+        for j, spacing in enumerate(spacings):
+            k = 0
+            if spacing == int(spacing):
+                k = self._coarsest_level(int(spacing), spacing)
+            by_level.setdefault(k, []).append(j)
+
+        for k, js in sorted(by_level.items()):
+            σs[js] = _block_deviation(self._level_data(k),
+                                      spacings[js] / 2 ** k)
+
+        return τs, σs
@@ -0,0 +1,315 @@
+# coding: utf-8
+"""In-process stand-ins for the instruments used to test a gyro.
+
+The simulated instruments have the attributes and methods that pyfog uses on
+the real ones, so that the whole path from calibration and acquisition to
+storage can be run, benchmarked and load tested without hardware:
+
+>>> from pyfog.simulated_instruments import simulated_instruments
+>>> from pyfog.allan_variance import acquire_allan_variance
+>>> instruments = simulated_instruments(rate=1000, arw=.04, drift=.9,
+...                                     scale_factor=1e6, speedup=100)
+>>> results = acquire_allan_variance(instruments, hours=1)
+
+The gyro output follows the model of
+`pyfog.flight_simulator.simulate_tombstone` plus the rotation of the
+platform, seen through the pitch of the stage. Every query takes `latency`
+seconds, and reading the data acquisition unit takes as long as the data it
+returns, both divided by `speedup`. The platform alone moves in real time,
+as it is waited for in real time.
+
+The output is clipped to the sensitivity of the lock-in, as on the real
+instruments, which biases the measured noise low. With the 1 mV sensitivity
+used by `pyfog.allan_variance.acquire_allan_variance`, the output spans
++/- ``scale_factor / 1000`` °/h, while white noise with an angular random
+walk `arw` has a standard deviation of ``60 * arw * sqrt(rate)`` °/h. In the
+example above, that is 76 °/h against +/- 1000 °/h, whereas the default
+scale factor would clip a fifth of the samples. Clipped samples are counted,
+and a warning is issued when a read clips.
+"""
+
+import time
+import warnings
+
+import numpy as np
+
+from .flight_simulator import _lv_noise, _lv_parameters, _noise_streams
+
+
+class SimulatedClock():
+    """A clock running `speedup` times faster than the wall clock, shared by
+    a set of simulated instruments."""
+
+    def __init__(self, speedup=1.):
+        self.speedup = speedup
+        self._origin = time.monotonic()
+
+    def now(self):
+        """Returns the simulated time in seconds."""
+        return (time.monotonic() - self._origin) * self.speedup
+
+    def sleep(self, seconds):
+        """Sleeps for `seconds` of simulated time."""
+        if seconds > 0:
+            time.sleep(seconds / self.speedup)
+
+
+class _Instrument():
+    """Base class for the simulated instruments, delaying every query by the
+    latency of the link."""
+
+    def __init__(self, clock, latency):
+        self._clock = clock
+        self._latency = latency
+
+    def _query(self):
+        self._clock.sleep(self._latency)
+
+
+class SimulatedRotationPlatform(_Instrument):
+    """A rotation stage that accelerates to `velocity` in `ramp_time`,
+    turns by the requested angle, and stops.
+
+    Parameters
+    ----------
+    clock : SimulatedClock
+        The clock shared with the other instruments
+    latency : float, optional
+        The time taken by each query, in seconds
+    ramp_time : float, optional
+        The time taken to reach full speed, and to stop, in seconds
+    """
+
+    def __init__(self, clock, latency=0, ramp_time=.2):
+        super().__init__(clock, latency)
+        self.velocity = 1  # deg/s
+        self.ramp_time = ramp_time
+        self._move = None  # start, duration, signed velocity
+
+    def _turn(self, angle, sign):
+        self._query()
+        duration = abs(angle) / self.velocity + self.ramp_time
+        self._move = (self._clock.now(), duration, sign * self.velocity)
+
+    def cw(self, angle, background=False):
+        self._turn(angle, 1)
+        if not background:
+            self._clock.sleep(self._move[1])
+
+    def ccw(self, angle, background=False):
+        self._turn(angle, -1)
+        if not background:
+            self._clock.sleep(self._move[1])
+
+    def rate(self, t):
+        """Returns the angular rate in deg/s at the simulated times `t`."""
+        t = np.asarray(t, dtype=float)
+        if self._move is None:
+            return np.zeros_like(t)
+        start, duration, velocity = self._move
+        elapsed = t - start
+        # Trapezoidal velocity profile
+        profile = np.clip(np.minimum(elapsed, duration - elapsed)
+                          / self.ramp_time, 0, 1) if self.ramp_time else \
+            ((elapsed >= 0) & (elapsed < duration)).astype(float)
+        return velocity * profile
+
+    def is_stationary(self):
+        self._query()
+        return self.rate(self._clock.now()) == 0
+
+    def is_constant_speed(self):
+        self._query()
+        now = self._clock.now()
+        return self._move is not None and \
+            abs(self.rate(now)) == self.velocity
+
+
+class SimulatedLockInAmplifier(_Instrument):
+    """A lock-in amplifier whose time constant sets the sample rate of the
+    simulated gyro output."""
+
+    def __init__(self, clock, latency=0, time_constant=.001,
+                 sensitivity=.001):
+        super().__init__(clock, latency)
+        self._time_constant = time_constant
+        self._sensitivity = sensitivity
+
+    @property
+    def time_constant(self):
+        self._query()
+        return self._time_constant
+
+    @time_constant.setter
+    def time_constant(self, value):
+        self._query()
+        self._time_constant = value
+
+    @property
+    def sensitivity(self):
+        self._query()
+        return self._sensitivity
+
+    @sensitivity.setter
+    def sensitivity(self, value):
+        self._query()
+        self._sensitivity = value
+
+    def autophase(self):
+        self._query()
+
+    def autogain(self):
+        self._query()
+
+
+class SimulatedDataAcquisitionUnit(_Instrument):
+    """A data acquisition unit digitizing the lock-in output of a simulated
+    gyro mounted on a `SimulatedRotationPlatform`.
+
+    Parameters
+    ----------
+    clock : SimulatedClock
+        The clock shared with the other instruments
+    platform : SimulatedRotationPlatform
+        The platform the gyro is mounted on
+    latency : float, optional
+        The time taken by each read, on top of the duration of the data
+    scale_factor : float, optional
+        The scale factor of the gyro, in deg/h/V
+    pitch : float, optional
+        The pitch of the stage in degrees
+    arw, drift, correlation_time : float, optional
+        The noise of the gyro, as in `simulate_tombstone`
+    rng : numpy.random.Generator or int, optional
+        The random number generator, or a seed for one
+
+    Attributes
+    ----------
+    clipped : int
+        The number of samples clipped to the input range so far
+    """
+
+    def __init__(self, clock, platform, latency=0, scale_factor=1e5,
+                 pitch=37.4, arw=0, drift=0, correlation_time=1800,
+                 rng=None):
+        super().__init__(clock, latency)
+        self.platform = platform
+        self.scale_factor = scale_factor
+        self.pitch = pitch
+        self.noise = dict(arw=arw, drift=drift,
+                          correlation_time=correlation_time)
+        self._rng = np.random.default_rng(rng)
+        self._stream = None
+        self.clipped = 0
+
+    def _noise(self, n, frequency):
+        """Returns the next `n` samples of gyro noise in deg/h, continuing
+        the same process from one read to the next."""
+        if self._stream is None or self._stream[0] != frequency:
+            # The duration only enters the drift definition of Lv et al,
+            # take it to be a day.
+            parameters = _lv_parameters(frequency, 86400, **self.noise)
+            chunk_size = max(int(frequency), 1)
+            blocks = _lv_noise(_noise_streams(self._rng)[:2],
+                               np.iinfo(np.int64).max, chunk_size,
+                               *parameters)
+            self._stream = [frequency, blocks, np.zeros(0)]
+
+        _, blocks, buffered = self._stream
+        pieces, have = [buffered], len(buffered)
+        while have < n:
+            block = next(blocks)
+            pieces.append(block)
+            have += len(block)
+        samples = np.concatenate(pieces)
+        self._stream[2] = samples[n:]
+        return samples[:n]
+
+    def read(self, seconds, frequency, max_voltage):
+        """Returns `seconds` of lock-in output sampled at `frequency`, in
+        volts, clipped to +/- `max_voltage`."""
+        n = int(seconds * frequency)
+        # The times of the samples on the clock of the platform, which may
+        # run at a different speed
+        platform_clock = self.platform._clock
+        start = platform_clock.now()
+        self._clock.sleep(self._latency + seconds)
+
+        t = start + np.arange(n) / frequency \
+            * platform_clock.speedup / self._clock.speedup
+        rotation = self.platform.rate(t) * 3600 \
+            * np.cos(self.pitch / 180 * np.pi)  # deg/h
+        rotation += self._noise(n, frequency)
+        voltage = rotation / self.scale_factor
+        clipped = np.count_nonzero(np.abs(voltage) > max_voltage)
+        if clipped:
+            self.clipped += clipped
+            warnings.warn('%i of %i samples clipped to +/- %g V'
+                          % (clipped, n, max_voltage), RuntimeWarning)
+        return np.clip(voltage, -max_voltage, max_voltage)
+
+
+class SimulatedFunctionGenerator(_Instrument):
+    """A function generator providing the phase modulation."""
+
+    def __init__(self, clock, latency=0, freq=1e5, voltage=1.,
+                 waveform='square'):
+        super().__init__(clock, latency)
+        self.freq = freq
+        self.voltage = voltage
+        self.waveform = waveform
+
+
+def simulated_instruments(rate=1000, arw=0, drift=0, correlation_time=1800,
+                          scale_factor=1e5, latency=.01, speedup=1.,
+                          rng=None):
+    """Returns a dictionary of simulated instruments, in the form expected by
+    `pyfog.allan_variance`.
+
+    Parameters
+    ----------
+    rate : float, optional
+        The sample rate in Hz, set through the lock-in time constant
+    arw : float, optional
+        The angular random walk of the gyro, in degrees per root hour
+    drift : float, optional
+        The bias drift of the gyro, in degrees per hour
+    correlation_time : float, optional
+        The correlation time of the bias drift, in seconds
+    scale_factor : float, optional
+        The scale factor of the gyro, in deg/h/V
+    latency : float, optional
+        The time taken by each query of an instrument, in seconds
+    speedup : float, optional
+        How much faster than real time the instruments, other than the
+        rotation platform, run
+    rng : numpy.random.Generator or int, optional
+        The random number generator, or a seed for one
+
+    Returns
+    -------
+    dict
+        The ``'rotation_platform'``, ``'lock_in_amplifier'``,
+        ``'data_acquisition_unit'`` and ``'function_generator'``
+
+    Notes
+    -----
+    The platform is polled in real time while the scale factor is
+    calibrated, so it keeps its own clock running in real time. Otherwise,
+    with a large `speedup`, the dither moves would end before they are seen
+    at constant speed. Calibrating therefore takes about 15 s whatever the
+    `speedup`, while the acquisition that follows is sped up.
+    """
+    clock = SimulatedClock(speedup)
+    platform = SimulatedRotationPlatform(SimulatedClock(), latency=latency)
+    return {
+        'rotation_platform': platform,
+        'lock_in_amplifier': SimulatedLockInAmplifier(
+            clock, latency=latency, time_constant=1 / rate),
+        'data_acquisition_unit': SimulatedDataAcquisitionUnit(
+            clock, platform, latency=latency, scale_factor=scale_factor,
+            arw=arw, drift=drift, correlation_time=correlation_time,
+            rng=rng),
+        'function_generator': SimulatedFunctionGenerator(
+            clock, latency=latency),
+    }
@@ -0,0 +1,271 @@
+# coding: utf-8
+"""A single writer for the HDF5 files shared by many producers.
+
+Acquisition and simulation workers that save to the same files would collide
+if each opened them, since neither HDF5 nor PyTables supports concurrent
+writers. Instead, they send write requests over a queue to a
+`StorageService`, whose one writer thread owns every file:
+
+>>> from pyfog.storage import StorageService
+>>> with StorageService() as service:
+...     service.append('runs.h5', 'run_1', chunk, rate=1000)
+...     service.save('results.h5', 'run_1', {'tau': tau, 'sigma': sig},
+...                  {'duration': 3600})
+
+Sending a request copies its data and returns at once, so producers never
+wait on the disk. The writer takes every request waiting in the queue in one
+go, opens each file once for all of them, merges the appends to each run
+into a single write, and flushes each file once.
+
+Worker processes are supported with ``StorageService(processes=True)``, and
+by passing `StorageService.client` to them, which has the same `save`,
+`store` and `append` methods. In that mode the queue lives in a
+``multiprocessing`` manager process, so the client can be pickled and sent
+to any worker, including those of a ``concurrent.futures`` pool.
+"""
+
+import queue
+import threading
+
+import numpy as np
+
+
+class StorageClient():
+    """Sends write requests to a `StorageService`.
+
+    Parameters
+    ----------
+    requests : queue.Queue or a proxy of one
+        The queue read by the service
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def save(self, filename, prefix, datasets, attrs=None, overwrite=False):
+        """Writes datasets and attributes under `prefix` with h5py, as
+        `pyfog.allan_variance.save_to_h5` does.
+
+        Parameters
+        ----------
+        filename : str
+            The path of the HDF5 file
+        prefix : str
+            The group holding the datasets and attributes
+        datasets : dict
+            The arrays to write, by name within the group
+        attrs : dict, optional
+            The attributes of the group
+        overwrite : bool, optional
+            Replace datasets that already exist. Otherwise the request fails
+            and nothing is written if they do.
+        """
+        datasets = {name: np.array(data) for name, data in datasets.items()}
+        self.requests.put(('save', filename, prefix,
+                           (datasets, dict(attrs or {}), overwrite)))
+
+    def store(self, filename, key, tombstone):
+        """Stores a `pyfog.Tombstone` under `key` in the `Experiment` saved
+        as `filename`, as ``experiment[key] = tombstone`` does."""
+        self.requests.put(('store', filename, str(key), (
+            np.array(tombstone, dtype=float), tombstone.rate,
+            tombstone.start, tombstone.scale_factor)))
+
+    def append(self, filename, key, data, rate=None, start=None,
+               scale_factor=None):
+        """Appends samples to the run `key` in the `Experiment` saved as
+        `filename`, as `pyfog.Experiment.append` does."""
+        self.requests.put(('append', filename, str(key), (
+            np.array(data, dtype=float).ravel(), rate, start, scale_factor)))
+
+
+class StorageService(StorageClient):
+    """Owns a set of HDF5 files, writing the requests of any number of
+    producers from a single background thread.
+
+    Errors raised while writing do not stop the service. They are kept, and
+    the first of them is raised by the next `flush` or `close`.
+
+    Parameters
+    ----------
+    processes : bool, optional
+        Keep the queue in a ``multiprocessing`` manager, so that `client`
+        can be pickled and used by other processes. Otherwise only threads
+        of this process may send requests.
+    max_batch : int, optional
+        The largest number of requests written in one go
+    **options
+        Passed on to `pyfog.Experiment` when the runs of `store` and
+        `append` requests are opened, e.g. ``complib`` or ``chunk_size``
+
+    Attributes
+    ----------
+    client : StorageClient
+        A picklable handle for sending requests to this service
+    errors : list of Exception
+        The errors raised by requests since the last `flush`
+    """
+
+    def __init__(self, processes=False, max_batch=1024, **options):
+        self._manager = None
+        if processes:
+            import multiprocessing
+            self._manager = multiprocessing.Manager()
+            requests = self._manager.Queue()
+        else:
+            requests = queue.Queue()
+        super().__init__(requests)
+        self.client = StorageClient(requests)
+        self.max_batch = max_batch
+        self.options = options
+        self.errors = []
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self):
+        while True:
+            batch = [self.requests.get()]
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            try:
+                for filename, requests in _by_file(batch):
+                    try:
+                        _write_file(filename, requests, self.options)
+                    except Exception as err:
+                        self.errors.append(err)
+            finally:
+                for i in range(len(batch) + stop):
+                    self.requests.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Waits until every request sent so far is written, and raises the
+        first error any of them met."""
+        self.requests.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise errors[0]
+
+    def close(self):
+        """Writes the remaining requests, stops the writer thread, and raises
+        the first error any request met."""
+        if not self._writer.is_alive():
+            return
+        self.requests.put(None)
+        self._writer.join()
+        try:
+            self.flush()
+        finally:
+            if self._manager is not None:
+                self._manager.shutdown()
+
+
+def _by_file(batch):
+    """Groups a batch of requests by file, keeping the order of the requests
+    to each file."""
+    files = {}
+    for kind, filename, key, payload in batch:
+        files.setdefault(filename, []).append((kind, key, payload))
+    return files.items()
+
+
+def _write_file(filename, requests, options):
+    """Writes the requests to one file, opening it with h5py for `save`
+    requests and as an `Experiment` for the others."""
+    import h5py
+    from .experiment import Experiment, Tombstone
+
+    # The two libraries cannot have the file open at once, so consecutive
+    # requests of the same library share one opening of the file.
+    i = 0
+    while i < len(requests):
+        j = i + 1
+        uses_h5py = requests[i][0] == 'save'
+        while j < len(requests) and (requests[j][0] == 'save') == uses_h5py:
+            j += 1
+
+        if uses_h5py:
+            with h5py.File(filename, 'a') as hdf5_file:
+                for kind, prefix, payload in requests[i:j]:
+                    save(hdf5_file, prefix, *payload)
+        else:
+            experiment = Experiment(filename, **options)
+            try:
+                for kind, key, payload in _coalesce(requests[i:j]):
+                    data, rate, start, scale_factor = payload
+                    if kind == 'store':
+                        experiment[key] = Tombstone(data, rate, start,
+                                                    scale_factor)
+                    else:
+                        experiment.append(key, data, rate=rate, start=start,
+                                          scale_factor=scale_factor)
+            finally:
+                experiment.close()
+        i = j
+
+
+def _coalesce(requests):
+    """Merges the appends to each run into one request, so that they are
+    written and flushed once. Appends to different runs commute, so only a
+    `store` to the same run keeps appends around it apart."""
+    merged, pending = [], {}
+    for kind, key, payload in requests:
+        if kind == 'append' and key in pending:
+            merged[pending[key]][2][0].append(payload[0])
+            continue
+        if kind == 'append':
+            pending[key] = len(merged)
+        else:
+            pending.pop(key, None)
+        merged.append((kind, key, ([payload[0]],) + payload[1:]))
+    return [(kind, key, (np.concatenate(payload[0]),) + payload[1:])
+            for kind, key, payload in merged]
+
+
+def save(hdf5_file, prefix, datasets, attrs, overwrite=False):
+    """Writes datasets and attributes under `prefix` of an open h5py file.
+
+    Parameters
+    ----------
+    hdf5_file : h5py.File
+        The file, open for writing
+    prefix : str
+        The group holding the datasets and attributes
+    datasets : dict
+        The arrays to write, by name within the group
+    attrs : dict
+        The attributes of the group
+    overwrite : bool, optional
+        Replace datasets that already exist
+
+    Raises
+    ------
+    ValueError
+        If a dataset already exists and `overwrite` is False. Nothing is
+        written in that case.
+    """
+    existing = [name for name in datasets
+                if prefix + '/' + name in hdf5_file]
+    if existing and not overwrite:
+        raise ValueError('%s already exists in %s' % (
+            ', '.join(prefix + '/' + name for name in existing),
+            hdf5_file.filename))
+    for name, data in datasets.items():
+        path = prefix + '/' + name
+        if path in hdf5_file:
+            del hdf5_file[path]
+        hdf5_file.create_dataset(path, data=data)
+    hdf5_file[prefix].attrs.update(attrs)
@@ -4,6 +4,8 @@ accelerometers.
 """
 
 
+from functools import lru_cache
+
 import numpy as np
 
 
@@ -16,12 +18,9 @@ def square_pulse(points,
     -1, then rising back to 0 again. The falling slew passes through zero at
     index = duty_cycle * points.
 
-    .. note:: While this cycle runs in O(n) time, the constant is quite large
-       due to all the `if`, `elif` and `else` statements the program has to
-       execute.
-       Better runtimes should be
-       possible. If you are using this in an inner loop,
-       you may consider optimizing the algithm.
+    The cycle is evaluated as a piecewise linear function of the whole time
+    vector at once, and repeated shapes are memoized, so this is cheap enough
+    to use in an inner loop.
 
     Parameters
     ----------
@@ -47,37 +46,128 @@ def square_pulse(points,
 
     """
 
-    time = np.linspace(0, 1, points, endpoint=False)
-
-    def get_height_at_progress(ratio):
-        if ratio == 0:
-            return .5 if rise_time_over_cycle_time else 1
-        elif ratio == duty_cycle:
-            return .5 if fall_time_over_cycle_time else 0
-        elif ratio > 0 and ratio <= rise_time_over_cycle_time / 2:
-            return ratio / rise_time_over_cycle_time + .5
-        elif (ratio > rise_time_over_cycle_time / 2
-              and ratio <= duty_cycle - fall_time_over_cycle_time / 2):
-            return 1
-        elif (ratio > duty_cycle - fall_time_over_cycle_time / 2
-              and ratio <= duty_cycle + fall_time_over_cycle_time / 2):
-            return 1 - (
-                       ratio - duty_cycle + fall_time_over_cycle_time / 2) / \
-                       fall_time_over_cycle_time
-        elif (ratio > duty_cycle + fall_time_over_cycle_time / 2
-              and ratio <= 1 - rise_time_over_cycle_time / 2):
-            return 0
-        else:
-            return ((
-                   ratio - 1 + rise_time_over_cycle_time / 2)
-                   / rise_time_over_cycle_time)
-
-    def normalize(ratio):
-        v = 2 * get_height_at_progress(ratio) - 1
-        if v > 1:
-            return 1
-        if v < -1:
-            return -1
-        return v
-
-    return np.array([normalize(t) for t in time])
+    return _cached_square_pulse(
+        int(points), float(duty_cycle), float(rise_time_over_cycle_time),
+        float(fall_time_over_cycle_time)).copy()
+
+
+def square_wave(points,
+                cycles=1,
+                duty_cycle=.5,
+                rise_time_over_cycle_time=0,
+                fall_time_over_cycle_time=0):
+    """
+    Generates a train of `cycles` identical square wave cycles, as described
+    in `square_pulse`.
+
+    Parameters
+    ----------
+
+    points: int
+        The number of points in each cycle
+    cycles: int
+        The number of cycles in the train
+
+    The remaining parameters are the same as for `square_pulse`.
+
+    Returns
+    -------
+
+    ndarray.float
+        An array of ``points * cycles`` values between -1 and 1.
+    """
+
+    return np.tile(_cached_square_pulse(
+        int(points), float(duty_cycle), float(rise_time_over_cycle_time),
+        float(fall_time_over_cycle_time)), cycles)
+
+
+def square_wave_batch(points,
+                      cycles=1,
+                      duty_cycle=.5,
+                      rise_time_over_cycle_time=0,
+                      fall_time_over_cycle_time=0):
+    """
+    Generates a batch of square wave trains, one for every combination of
+    parameters, as a 2-D array. This is useful when sweeping modulation shapes
+    for the function generator.
+
+    The shape parameters are broadcast against each other, and each distinct
+    shape is only computed once.
+
+    >>> waves = square_wave_batch(1000, duty_cycle=[.4, .5, .6],
+    ...                           rise_time_over_cycle_time=.01,
+    ...                           fall_time_over_cycle_time=.01)
+    >>> waves.shape
+    (3, 1000)
+
+    Parameters
+    ----------
+
+    points: int
+        The number of points in each cycle
+    cycles: int
+        The number of cycles in each train
+    duty_cycle: array_like(float)
+        The duty cycles of the variants
+    rise_time_over_cycle_time: array_like(float)
+        The rise times of the variants, as fractions of the cycle time
+    fall_time_over_cycle_time: array_like(float)
+        The fall times of the variants, as fractions of the cycle time
+
+    Returns
+    -------
+
+    ndarray.float
+        An array with one row of ``points * cycles`` values for every variant.
+    """
+
+    parameters = np.broadcast_arrays(
+        np.ravel(duty_cycle), np.ravel(rise_time_over_cycle_time),
+        np.ravel(fall_time_over_cycle_time))
+    variants = np.stack(parameters, axis=-1).astype(float)
+    shapes, inverse = np.unique(variants, axis=0, return_inverse=True)
+
+    pulses = np.stack([
+        _cached_square_pulse(int(points), *shape) for shape in shapes.tolist()
+    ]) if len(shapes) else np.zeros((0, int(points)))
+    return np.tile(pulses[np.ravel(inverse)], cycles)
+
+
+@lru_cache(maxsize=128)
+def _cached_square_pulse(points, duty_cycle, rise_time_over_cycle_time,
+                         fall_time_over_cycle_time):
+    """Returns a read-only cycle of `square_pulse`, memoized."""
+    pulse = _square_pulse(np.linspace(0, 1, points, endpoint=False),
+                          duty_cycle, rise_time_over_cycle_time,
+                          fall_time_over_cycle_time)
+    pulse.setflags(write=False)
+    return pulse
+
+
+def _square_pulse(ratio, duty_cycle, rise, fall):
+    """Evaluates the square pulse at the fractions `ratio` of the cycle. The
+    pieces are tested in order, and the first that applies is used."""
+    conditions = [
+        ratio == 0,
+        ratio == duty_cycle,
+        (ratio > 0) & (ratio <= rise / 2),
+        (ratio > rise / 2) & (ratio <= duty_cycle - fall / 2),
+        (ratio > duty_cycle - fall / 2) & (ratio <= duty_cycle + fall / 2),
+        (ratio > duty_cycle + fall / 2) & (ratio <= 1 - rise / 2),
+    ]
+
+    # The slews divide by zero where they do not apply
+    with np.errstate(divide='ignore', invalid='ignore'):
+        heights = [
+            .5 if rise else 1,
+            .5 if fall else 0,
+            ratio / rise + .5,
+            1,
+            1 - (ratio - duty_cycle + fall / 2) / fall,
+            0,
+        ]
+        height = np.select(conditions, heights,
+                           default=(ratio - 1 + rise / 2) / rise)
+
+    return np.clip(2 * height - 1, -1, 1)
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from pyfog.allan_variance import AllanAccumulator, allan_var
+from pyfog.signal_processing import Pyramid
+
+
+def _naive_allan_deviation(x, m):
+    """The overlapping Allan deviation from the means of every window of m
+    samples, computed directly."""
+    means = np.convolve(x, np.ones(m) / m, mode='valid')
+    return np.sqrt(0.5 * np.mean((means[m:] - means[:-m]) ** 2))
+
+
+def test_allan_var_matches_direct_averaging():
+    x = 5 + np.random.default_rng(4).standard_normal(3000)
+    tau, sig = allan_var(x, 0.01)
+    # Log spaced number of samples up to 1/9 of the run
+    assert tau[0] == 0.01 and tau[-1] <= 0.01 * 3000 / 9
+    for t, s in zip(tau, sig):
+        assert s == pytest.approx(
+            _naive_allan_deviation(x, int(round(t / 0.01))), rel=1e-9)
+
+
+def test_allan_var_of_a_batch_of_runs():
+    x = np.random.default_rng(5).standard_normal((3, 2000))
+    x[1] *= 10
+    tau, sig = allan_var(x, 1, tau=[1, 4, 30])
+    assert sig.shape == (3, 3)
+    for run, curve in zip(x, sig):
+        np.testing.assert_allclose(curve, allan_var(run, 1, tau=[1, 4, 30])[1])
+        np.testing.assert_allclose(
+            curve, [_naive_allan_deviation(run, m) for m in (1, 4, 30)])
+
+
+def _stream(accumulator, x, sizes):
+    bounds = np.cumsum([0] + list(sizes))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        accumulator.update(x[start:stop])
+    accumulator.update(x[bounds[-1]:])
+    return accumulator
+
+
+def test_accumulator_matches_allan_var():
+    x = np.cumsum(np.random.default_rng(0).standard_normal(5000)) * 1e-2 \
+        + np.random.default_rng(1).standard_normal(5000)
+    accumulator = _stream(AllanAccumulator(0.1, max_m=512), x,
+                          [1, 700, 3, 1500, 999])
+    tau, sig = accumulator.allan_var()
+
+    expected_tau, expected_sig = allan_var(x, 0.1, tau=2 ** np.arange(10))
+    np.testing.assert_allclose(tau, expected_tau)
+    np.testing.assert_allclose(sig, expected_sig, rtol=1e-10)
+
+
+@pytest.mark.parametrize('min_overlap', [1, 3, 8])
+def test_cascade_matches_pyramid(min_overlap):
+    x = np.random.default_rng(2).standard_normal(20001)
+    accumulator = _stream(
+        AllanAccumulator(0.5, max_m=2 ** 14, min_overlap=min_overlap), x,
+        [5, 4096, 1, 777, 10000])
+    tau, sig = accumulator.allan_var()
+
+    expected_tau, expected_sig = Pyramid.build(x, 2).allan_deviation(
+        tau, min_overlap=min_overlap)
+    np.testing.assert_allclose(tau, expected_tau)
+    np.testing.assert_allclose(sig, expected_sig, rtol=1e-10)
+    # Every level keeps at most 4 * min_overlap sums, whatever max_m is
+    assert max(len(tail) for tail in accumulator._tails) \
+        <= 4 * min_overlap + 1
+
+
+def test_accumulator_state_round_trip():
+    x = np.random.default_rng(3).standard_normal(3001)
+    accumulator = AllanAccumulator(1, max_m=256, min_overlap=4)
+    accumulator.update(x[:1001])
+    restored = AllanAccumulator.from_state(accumulator.state())
+    for streamed in (accumulator, restored):
+        streamed.update(x[1001:])
+    np.testing.assert_array_equal(restored.allan_var()[1],
+                                  accumulator.allan_var()[1])
+
+
+def test_acquisition_resumes_from_committed_chunks(tmp_path):
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('IPython')
+    pytest.importorskip('tables')
+    from pyfog.allan_variance import acquire_allan_variance
+    from pyfog.experiment import Experiment
+    from pyfog.simulated_instruments import simulated_instruments
+
+    instruments = simulated_instruments(rate=100, arw=.04, scale_factor=1e6,
+                                        latency=0, speedup=1e4, rng=0)
+    daq = instruments['data_acquisition_unit']
+    experiment = Experiment(str(tmp_path / 'runs.h5'))
+    # The first two minutes of a run that was interrupted
+    committed = daq.read(seconds=120, frequency=100, max_voltage=.001)
+    experiment.append('run', committed, rate=100, start=1.7e9,
+                      scale_factor=1e6)
+
+    read, reads = daq.read, []
+
+    def read_then_fail(**kwargs):
+        if len(reads) == 3:
+            raise IOError('DAQ disconnected')
+        reads.append(kwargs['seconds'])
+        return read(**kwargs)
+
+    daq.read = read_then_fail
+    with pytest.raises(IOError):
+        acquire_allan_variance(instruments, minutes=10, experiment=experiment,
+                               key='run', chunk_seconds=30)
+    assert len(experiment['run']) == (120 + 3 * 30) * 100
+
+    daq.read = read
+    results = acquire_allan_variance(instruments, minutes=10,
+                                     experiment=experiment, key='run',
+                                     chunk_seconds=30)
+    voltage = experiment['run'][:].values
+    assert len(voltage) == 600 * 100
+    np.testing.assert_array_equal(voltage[:len(committed)], committed)
+    assert results['scale_factor'] == 1e6 and results['start_time'] == 1.7e9
+
+    # The curve accumulated over both sessions, at coarse levels
+    tau, sig = Pyramid.build(1e6 * voltage, 100).allan_deviation(
+        results['taus'], min_overlap=128)
+    np.testing.assert_allclose(results['taus'], tau)
+    np.testing.assert_allclose(results['sigmas'], sig, rtol=1e-9)
+    experiment.close()
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from pyfog.experiment import Experiment, Tombstone
+
+pytest.importorskip('tables')
+pytest.importorskip('pandas')
+
+
+def _store(filename, runs):
+    experiment = Experiment(filename)
+    for key, values in runs.items():
+        if key in experiment:
+            del experiment[key]
+        experiment[key] = Tombstone(values, rate=10, scale_factor=2.)
+    experiment.close()
+
+
+def test_analyze_is_incremental(tmp_path):
+    from pyfog.analyze import main, read_summary
+    rng = np.random.default_rng(0)
+    first, second = str(tmp_path / 'first.h5'), str(tmp_path / 'second.h5')
+    output = str(tmp_path / 'summary.csv')
+    runs = {'a': rng.standard_normal(2000), 'b': rng.standard_normal(3000)}
+    _store(first, runs)
+    _store(second, {'a': rng.standard_normal(1000)})
+
+    assert main([first, second, '-o', output, '-j', '2']) == 0
+    summary = read_summary(output)
+    assert sorted(zip(summary['file'], summary['key'])) == [
+        (first, 'a'), (first, 'b'), (second, 'a')]
+    row = summary[(summary['file'] == first) & (summary['key'] == 'a')]
+    run = Tombstone(runs['a'], rate=10, scale_factor=2.)
+    assert row['arw'].item() == pytest.approx(run.arw)
+    assert row['drift'].item() == pytest.approx(run.drift)
+    assert row['length'].item() == 2000
+
+    # Runs already in the summary are not analyzed again, even if changed
+    _store(first, {'a': 10 * runs['a'], 'c': rng.standard_normal(1500)})
+    main([first, second, '-o', output, '-j', '2'])
+    rerun = read_summary(output)
+    assert len(rerun) == 4
+    assert sorted(rerun['key'][rerun['file'] == first]) == ['a', 'b', 'c']
+    row = rerun[(rerun['file'] == first) & (rerun['key'] == 'a')]
+    assert row['arw'].item() == pytest.approx(run.arw)
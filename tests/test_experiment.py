@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+
+from pyfog.experiment import Experiment, LazyTombstone, Tombstone
+
+pytest.importorskip('tables')
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    experiment = Experiment(str(tmp_path / 'experiment.h5'))
+    experiment['run'] = Tombstone(np.arange(10.), rate=2, start=1.7e9,
+                                  scale_factor=3.)
+    yield experiment
+    experiment.close()
+
+
+def test_lazy_run_arithmetic(experiment):
+    run = experiment['run']
+    assert isinstance(run, LazyTombstone)
+
+    doubled = run * 2
+    assert isinstance(doubled, Tombstone)
+    assert (doubled.rate, doubled.start, doubled.scale_factor) == \
+        (2, 1.7e9, 3.)
+    np.testing.assert_array_equal(doubled.values, np.arange(10.) * 2)
+    np.testing.assert_array_equal((1 - run).values, 1 - np.arange(10.))
+    np.testing.assert_array_equal(
+        (run + Tombstone(np.ones(10), rate=2)).values, np.arange(10.) + 1)
+
+
+def test_lazy_run_numpy_functions(experiment):
+    run = experiment['run']
+    assert np.mean(run) == 4.5
+    assert np.sqrt(run).rate == 2
+    np.testing.assert_array_equal(np.asarray(run), np.arange(10.))
+
+
+@pytest.mark.parametrize('reduction', ['sum', 'mean', 'median', 'min',
+                                       'max', 'std', 'var'])
+def test_reductions_match_pandas(reduction):
+    values = np.random.default_rng(0).standard_normal(1000)
+    values[10] = np.nan
+    run = Tombstone(values, rate=10, start=1.7e9)
+    expected = getattr(run.to_series(), reduction)()
+    assert getattr(run, reduction)() == pytest.approx(expected)
+    assert getattr(run[20:], reduction)() == \
+        pytest.approx(getattr(run.to_series()[20:], reduction)())
+
+
+def test_stored_pyramid(experiment):
+    values = np.random.default_rng(1).standard_normal(10001)
+    experiment.chunk_size = 1000
+    experiment['long'] = Tombstone(values, rate=10)
+    built = experiment.pyramid('long')
+    stored = experiment.pyramid('long')
+    expected = Tombstone(values, rate=10).pyramid()
+
+    assert len(stored.levels) == len(expected.levels)
+    for level, expected_level in zip(stored.levels[1:],
+                                     expected.levels[1:]):
+        # Read from the file, not held in memory
+        assert not isinstance(level, np.ndarray)
+        np.testing.assert_allclose(level[:], expected_level)
+    for pyramid in (built, stored):
+        np.testing.assert_allclose(pyramid.allan_deviation()[1],
+                                   experiment['long'].adev[1])
+
+
+@pytest.mark.parametrize('quantize', ['int16', 'int32'])
+def test_quantized_non_finite_samples(tmp_path, quantize):
+    values = np.linspace(-1, 1, 101)
+    values[[3, 50, 70]] = [np.nan, np.inf, -np.inf]
+    experiment = Experiment(str(tmp_path / 'quantized.h5'),
+                            quantize=quantize)
+    experiment['run'] = Tombstone(values, rate=10)
+    stored = experiment['run']
+
+    np.testing.assert_allclose(stored[:].values, values,
+                               atol=2 / np.iinfo(quantize).max)
+    assert np.isnan(stored[3]) and stored[50] == np.inf
+    assert stored[60:80].values[10] == -np.inf
+    experiment.close()
+
+
+@pytest.mark.parametrize('quantize', [None, 'int16'])
+def test_empty_run(tmp_path, quantize):
+    experiment = Experiment(str(tmp_path / 'empty.h5'), quantize=quantize)
+    experiment['empty'] = Tombstone([], rate=10)
+    assert len(experiment['empty']) == 0
+    assert len(experiment['empty'][:].values) == 0
+    assert experiment.metadata('empty')['length'] == 0
+    experiment.close()
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_slices(experiment, lazy):
+    run = experiment['run'] if lazy else experiment['run'].load()
+
+    every_other = run[1::2]
+    np.testing.assert_array_equal(every_other.values, np.arange(1., 10, 2))
+    assert every_other.rate == 1 and every_other.start == 1.7e9 + 0.5
+
+    last = run[-4:]
+    np.testing.assert_array_equal(last.values, np.arange(6., 10))
+    assert last.rate == 2 and last.start == 1.7e9 + 3
+
+    assert len(run[8:2]) == 0
+    with pytest.raises(ValueError, match='negative step'):
+        run[::-1]
+
+
+def test_index_is_reconciled_with_the_file(tmp_path):
+    import tables as pt
+    filename = str(tmp_path / 'index.h5')
+    experiment = Experiment(filename)
+    for key in ('kept', 'removed'):
+        experiment[key] = Tombstone(np.arange(4.), rate=1)
+    experiment.close()
+
+    # Change the runs without going through Experiment
+    with pt.open_file(filename, 'a') as h5file:
+        h5file.remove_node('/removed')
+        untracked = h5file.create_array('/', 'untracked', np.arange(6.))
+        untracked.attrs.rate = 3
+        untracked.attrs.start = None
+        untracked.attrs.scale_factor = None
+
+    for read_only in (True, False, True):
+        experiment = Experiment(filename, read_only=read_only)
+        assert sorted(experiment.keys()) == ['kept', 'untracked']
+        assert experiment.metadata('untracked')['length'] == 6
+        assert experiment.where('rate == 3') == ['untracked']
+        experiment.close()
+
+    # The writable open updated the table itself
+    with pt.open_file(filename, 'r') as h5file:
+        assert sorted(h5file.root._index.col('key')) == [b'kept',
+                                                         b'untracked']
+
+
+def test_stored_pyramid_is_in_rotation_units(experiment):
+    values = np.random.default_rng(2).standard_normal(5000)
+    experiment.chunk_size = 512
+    experiment['scaled'] = Tombstone(values, rate=10, scale_factor=3.)
+    expected = Tombstone(values, rate=10, scale_factor=3.).pyramid()
+
+    for pyramid in (experiment.pyramid('scaled'),
+                    experiment.pyramid('scaled')):
+        assert len(pyramid.levels) == len(expected.levels)
+        for level, expected_level in zip(pyramid.levels, expected.levels):
+            np.testing.assert_allclose(level[:], expected_level)
+        np.testing.assert_allclose(pyramid.allan_deviation()[1],
+                                   experiment['scaled'].adev[1])
+
+    # Changing the scale factor rebuilds the pyramid
+    experiment.h5file.root.scaled.attrs.scale_factor = 6.
+    np.testing.assert_allclose(experiment.pyramid('scaled').levels[3][:],
+                               2 * expected.levels[3])
+
+
+def test_adev_cache_follows_changes():
+    values = np.random.default_rng(3).standard_normal(1000)
+    run = Tombstone(values.copy(), rate=10)
+    first = run.adev[1]
+    assert run.adev[1] is first
+
+    run[:500] = 2 * values[:500]
+    changed = Tombstone(run.values.copy(), rate=10).adev[1]
+    np.testing.assert_array_equal(run.adev[1], changed)
+    assert not np.allclose(changed, first)
+
+    run.values = values
+    np.testing.assert_array_equal(run.adev[1], first)
+    run.scale_factor = 2.
+    np.testing.assert_allclose(run.adev[1], 2 * first)
+    run.rate = 5
+    assert run.adev[0][0] == pytest.approx(.2)
@@ -0,0 +1,229 @@
+import numpy as np
+import pytest
+
+from pyfog.flight_simulator import (
+    Leg, get_navigation_error, power_law_allan_deviation, simulate_tombstone,
+    simulate_tombstone_chunks)
+from pyfog.signal_processing import overlapping_allan_deviation
+
+rate = 10
+size = 2 ** 17
+taus = 2 ** np.arange(2, 11) / rate
+
+# The log-log slope of the Allan deviation of each power law
+slopes = {-2: .5, -1: 0, 0: -.5, 1: -1, 2: -1}
+
+
+def _adev(power_law, rng=0, **noise):
+    data = simulate_tombstone(rate=rate, seconds=size / rate, rng=rng,
+                              power_law=power_law, **noise)
+    return overlapping_allan_deviation(np.asarray(data), rate, taus)[:2]
+
+
+@pytest.mark.parametrize('alpha', sorted(slopes))
+def test_power_law_matches_analytic_allan_deviation(alpha):
+    power_law = {alpha: 1e-2}
+    tau, dev = _adev(power_law)
+    expected = power_law_allan_deviation(tau, power_law, rate)
+    np.testing.assert_allclose(dev, expected, rtol=.15)
+
+    slope = np.polyfit(np.log(tau), np.log(dev), 1)[0]
+    assert slope == pytest.approx(slopes[alpha], abs=.1)
+
+
+def test_power_law_mix_matches_analytic_allan_deviation():
+    power_law = {-2: 1e-6, -1: 1e-3, 0: 1e-3}
+    tau, dev = _adev(power_law)
+    expected = power_law_allan_deviation(tau, power_law, rate)
+    np.testing.assert_allclose(dev, expected, rtol=.15)
+
+
+def test_chunks_match_single_block():
+    kwargs = dict(rate=rate, seconds=size / rate, arw=.04, drift=1, rng=3,
+                  power_law={-1: 1e-3, -2: 1e-6})
+    data = np.asarray(simulate_tombstone(**kwargs))
+    chunks = np.concatenate(list(simulate_tombstone_chunks(
+        chunk_size=10000, **kwargs)))
+    np.testing.assert_allclose(chunks, data, atol=1e-12)
+
+
+def test_power_law_does_not_change_lv_noise():
+    kwargs = dict(rate=rate, seconds=1000, arw=.04, drift=1)
+    plain = simulate_tombstone(rng=np.random.default_rng(5), **kwargs)
+    tiny = simulate_tombstone(rng=np.random.default_rng(5),
+                              power_law={-1: 1e-30}, **kwargs)
+    np.testing.assert_allclose(np.asarray(tiny), np.asarray(plain))
+
+
+def test_global_seed_repeats_default_runs():
+    kwargs = dict(rate=rate, seconds=1000, arw=.04, drift=1,
+                  power_law={-1: 1e-3})
+    np.random.seed(4)
+    first = np.asarray(simulate_tombstone(**kwargs))
+    second = np.asarray(simulate_tombstone(**kwargs))
+    np.random.seed(4)
+    np.testing.assert_array_equal(simulate_tombstone(**kwargs), first)
+    assert not np.array_equal(first, second)
+
+
+@pytest.mark.parametrize('alpha', [-3, .5, 1.5])
+def test_invalid_exponents(alpha):
+    with pytest.raises(ValueError):
+        simulate_tombstone(rate=rate, seconds=10, power_law={alpha: 1})
+    with pytest.raises(ValueError):
+        power_law_allan_deviation(taus, {alpha: 1}, rate)
+
+
+plan = [Leg(1000.3, 800), Leg(377, 700, turn_rate=1.5), Leg(5000, 900),
+        Leg(101, 500, turn_rate=-3), Leg(np.inf, 600)]
+
+
+def test_navigation_error_of_straight_flight():
+    data = np.random.default_rng(6).standard_normal((2, 100003)) * 100
+    along, cross = get_navigation_error(data, rate, 900, dtype=np.float64)
+
+    θ = np.cumsum(data, axis=-1) * np.pi / 180 / 3600 / rate
+    Δ = 900 * 1000 / 3600 / rate / 1852
+    for got, want in [(along, np.cumsum((np.cos(θ) - 1) * Δ, -1)),
+                      (cross, np.cumsum(np.sin(θ) * Δ, -1))]:
+        np.testing.assert_allclose(got, want, atol=1e-9 * np.abs(want).max())
+
+
+@pytest.mark.parametrize('flight_plan', [900, plan])
+def test_navigation_error_in_single_precision(flight_plan):
+    data = np.random.default_rng(7).standard_normal((3, 20001)) * 10 + 1
+    expected = get_navigation_error(data, rate, flight_plan,
+                                    dtype=np.float64)
+    result = get_navigation_error(data, rate, flight_plan, chunk_size=4099)
+    final = get_navigation_error(data, rate, flight_plan, final_only=True)
+    for got, end, want in zip(result, final, expected):
+        assert got.dtype == np.float32
+        scale = np.abs(want).max()
+        np.testing.assert_allclose(got, want, atol=1e-6 * scale)
+        np.testing.assert_allclose(end, want[..., -1], atol=1e-6 * scale)
+
+
+def test_navigation_error_of_chunks():
+    data = np.random.default_rng(8).standard_normal(50000)
+    expected = get_navigation_error(data, rate, plan)
+    for blocks in (np.array_split(data, 7), iter(np.array_split(data, 7))):
+        result = get_navigation_error(blocks, rate, plan)
+        final = get_navigation_error(iter(np.array_split(data, 7)), rate,
+                                     plan, final_only=True)
+        for got, end, want in zip(result, final, expected):
+            scale = np.abs(want).max()
+            np.testing.assert_allclose(got, want, atol=1e-6 * scale)
+            assert end == pytest.approx(want[-1], abs=1e-6 * scale)
+
+    # Lists of numbers are the data itself
+    for got, want in zip(get_navigation_error(list(data[:1000]), rate, plan),
+                         get_navigation_error(data[:1000], rate, plan)):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_cross_track_batch_streams_over_time():
+    from pyfog.flight_simulator import (
+        _cross_track_batch, _lv_noise, _lv_parameters, _noise_streams,
+        get_cross_track_error)
+    parameters = _lv_parameters(1, 1000, .04, .9, 100)
+    batch = (np.random.SeedSequence(3), 4, 1000, parameters, 1,
+             np.array([900., 800, 700, 600]))
+    # Blocks of 50 samples for each of the 4 trials
+    streamed = _cross_track_batch(batch, max_values=200)
+    # Spawning from the seed again would give other streams
+    data = np.concatenate(list(_lv_noise(
+        _noise_streams(np.random.SeedSequence(3))[:2], 1000, 50,
+        *parameters, shape=(4,))), axis=-1)
+    np.testing.assert_allclose(
+        streamed, get_cross_track_error(data, 1, batch[-1], final_only=True),
+        rtol=1e-10)
+
+
+def test_cross_track_error_of_a_batch():
+    from pyfog.flight_simulator import get_cross_track_error
+    data = np.random.default_rng(9).standard_normal((3, 500))
+    velocity = np.array([900., 800, 500])
+    xtk = get_cross_track_error(data, 10, velocity)
+
+    # Each sample turns the heading, which is then flown for one step
+    heading = np.cumsum(data * np.pi / 180 / 3600 / 10, axis=-1)
+    expected = np.cumsum(heading * velocity[:, np.newaxis] / 3.6 / 10,
+                         axis=-1) / 1852
+    close = dict(rtol=1e-10, atol=1e-10 * np.abs(expected).max())
+    np.testing.assert_allclose(xtk, expected, **close)
+    for row, v, want in zip(data, velocity, expected):
+        np.testing.assert_allclose(get_cross_track_error(row, 10, v), want,
+                                   **close)
+
+    np.testing.assert_allclose(
+        get_cross_track_error(data, 10, velocity, final_only=True),
+        expected[:, -1], **close)
+    single = get_cross_track_error(data, 10, velocity, dtype=np.float32)
+    assert single.dtype == np.float32
+    np.testing.assert_allclose(single, expected, rtol=1e-4,
+                               atol=1e-5 * np.abs(expected).max())
+
+    buffer = data.copy()
+    result = get_cross_track_error(buffer, 10, velocity, overwrite_data=True)
+    assert result is buffer
+    np.testing.assert_allclose(result, expected, **close)
+
+
+def test_simulation_sweep_matches_single_runs():
+    from pyfog.flight_simulator import SimulationSweep, get_cross_track_error
+    sweep = SimulationSweep(rate=10, seconds=2000, arw=[.02, .08],
+                            drift=[0, 3], correlation_time=[100, 600], rng=4)
+    assert len(sweep) == 8
+    assert [p['correlation_time'] for p in sweep.grid] == [100] * 4 + [600] * 4
+
+    points = list(sweep)
+    for (params, run), (_, tau, dev), (_, xtk) in zip(
+            points, sweep.adev(), sweep.cross_track_error(velocity=800)):
+        expected = simulate_tombstone(rate=10, seconds=2000, rng=4, **params)
+        np.testing.assert_allclose(run.values, expected.values,
+                                   rtol=1e-9, atol=1e-9)
+        expected_tau, expected_dev = overlapping_allan_deviation(
+            run.values, 10)[:2]
+        np.testing.assert_allclose(tau, expected_tau)
+        np.testing.assert_allclose(dev, expected_dev, rtol=1e-8)
+        assert xtk == pytest.approx(get_cross_track_error(
+            run.values, 10, 800, final_only=True), rel=1e-9)
+
+
+def test_allan_deviation_model_matches_simulation():
+    from pyfog.flight_simulator import allan_deviation_model
+    seconds = 2 ** 18 / 10
+    data = simulate_tombstone(rate=10, seconds=seconds, arw=.05, drift=1,
+                              correlation_time=300, rng=5)
+    tau, dev = overlapping_allan_deviation(data.values, 10, taus)[:2]
+    expected = allan_deviation_model(tau, arw=.05, drift=1,
+                                     correlation_time=300, duration=seconds)
+    np.testing.assert_allclose(dev, expected, rtol=.1)
+
+
+def test_fit_allan_deviation_recovers_the_model():
+    from pyfog.flight_simulator import allan_deviation_model, \
+        fit_allan_deviation
+    tau = np.logspace(-1, 4, 40)
+    correlation_times = np.logspace(1, 5, 61)
+    truth = [dict(arw=.03, drift=1, correlation_time=correlation_times[20],
+                  ramp=2, quantization=1e-5),
+             dict(arw=.1, drift=3, correlation_time=correlation_times[45],
+                  ramp=0, quantization=0)]
+    curves = np.array([allan_deviation_model(tau, duration=36000, **params)
+                       for params in truth])
+    curves[1, -1] = np.nan  # ignored
+
+    fit = fit_allan_deviation(tau, curves, correlation_times, duration=36000,
+                              ramp=True, quantization=True)
+    for name in truth[0]:
+        expected = [params[name] for params in truth]
+        np.testing.assert_allclose(fit[name], expected, rtol=1e-6,
+                                   atol=1e-4 * max(expected))
+    np.testing.assert_allclose(fit['residual'], 0, atol=1e-8)
+
+    single = fit_allan_deviation(tau, curves[0], correlation_times,
+                                 duration=36000, ramp=True,
+                                 quantization=True)
+    assert single['arw'] == pytest.approx(.03)
+    assert np.ndim(single['correlation_time']) == 0
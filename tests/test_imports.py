@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pyfog import _heavy_modules as heavy_modules
+from pyfog import _import_budget as import_budget
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import(code):
+    """Runs `code` in a fresh interpreter, and returns the time it took and
+    the heavy modules it imported."""
+    script = ('import sys, time\n'
+              't = time.perf_counter()\n'
+              '%s\n'
+              't = time.perf_counter() - t\n'
+              'print(t, *[m for m in %r if m in sys.modules])'
+              % (code, heavy_modules))
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=root).decode().split()
+    return float(output[0]), output[1:]
+
+
+@pytest.mark.parametrize('code', sorted(import_budget))
+def test_import_budget(code):
+    seconds, heavy = _import(code)
+    assert not heavy, '%s imports %s' % (code, ', '.join(heavy))
+    assert seconds < import_budget[code], \
+        '%s took %.3f s' % (code, seconds)
+
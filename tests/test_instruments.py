@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+from pyfog.instruments import InstrumentProxy, calibrate_scale_factor, \
+    wait_for
+from pyfog.simulated_instruments import SimulatedClock, \
+    SimulatedDataAcquisitionUnit, SimulatedLockInAmplifier, \
+    SimulatedRotationPlatform
+
+
+class Counter():
+    """An instrument counting the queries of its attribute."""
+
+    def __init__(self):
+        self.queries = 0
+
+    @property
+    def value(self):
+        self.queries += 1
+        return self.queries
+
+    def reset(self):
+        pass
+
+
+def test_proxy_caches_reads():
+    instrument = Counter()
+    proxy = InstrumentProxy(instrument, flush_reads=3)
+    assert proxy.value == 3
+    assert proxy.value == 3 and instrument.queries == 3
+
+    proxy.reset()
+    assert proxy.value == 6
+    proxy.queries = 0
+    assert instrument.queries == 0 and proxy.value == 3
+    proxy.invalidate('value')
+    assert proxy.value == 6
+
+
+def _after(seconds):
+    start = time.monotonic()
+
+    def predicate():
+        return time.monotonic() - start >= seconds
+    return predicate
+
+
+def test_wait_for_checks_at_the_deadline():
+    # The second interval would end past the deadline, so the predicate is
+    # evaluated at the deadline instead of giving up early
+    start = time.monotonic()
+    asyncio.run(wait_for(_after(.09), poll_interval=.08, backoff=1,
+                         timeout=.15))
+    assert time.monotonic() - start >= .09
+
+
+def test_wait_for_times_out_after_the_deadline():
+    start = time.monotonic()
+    with pytest.raises(TimeoutError, match='predicate'):
+        asyncio.run(wait_for(_after(10), poll_interval=.04, timeout=.1))
+    assert time.monotonic() - start >= .1
+
+
+def test_calibrate_scale_factor():
+    # Every instrument runs on a clock 20 times faster than real time
+    clock = SimulatedClock(20)
+    platform = SimulatedRotationPlatform(clock)
+    instruments = {
+        'rotation_platform': platform,
+        'lock_in_amplifier': SimulatedLockInAmplifier(clock),
+        'data_acquisition_unit': SimulatedDataAcquisitionUnit(
+            clock, platform, scale_factor=2e5),
+    }
+    scale_factor = asyncio.run(calibrate_scale_factor(
+        instruments, _padding=2, poll_interval=.002, timeout=5))
+    assert scale_factor == pytest.approx(2e5)
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+from pyfog import signal_processing as sp
+
+allantools = pytest.importorskip('allantools')
+
+reference = {
+    'oadev': allantools.oadev,
+    'mdev': allantools.mdev,
+    'hdev': allantools.ohdev,
+    'totdev': allantools.totdev,
+}
+
+
+def _data(n):
+    rng = np.random.default_rng(n)
+    # White noise plus a random walk, so the curves are not flat
+    return rng.standard_normal(n) + np.cumsum(rng.standard_normal(n)) / 100
+
+
+@pytest.mark.parametrize('kind', sorted(reference))
+@pytest.mark.parametrize('n, rate', [(1000, 1), (4097, 10), (20000, 100)])
+@pytest.mark.parametrize('m', [
+    None,
+    [1, 2, 3, 5, 10, 33, 100, 250],
+])
+def test_matches_allantools(kind, n, rate, m):
+    data = _data(n)
+    taus = None if m is None else np.array(m) / rate
+    tau, dev, dev_error, count = sp._estimators[kind](data, rate, taus)
+
+    expected = reference[kind](data, rate=rate, data_type='freq', taus=tau)
+    np.testing.assert_allclose(tau, expected[0])
+    np.testing.assert_allclose(dev, expected[1], rtol=1e-8)
+
+
+def test_deviations_share_phase():
+    data = _data(5000)
+    phase = sp.Phase(data, 10)
+    results = sp.deviations(phase, 10)
+    for kind, result in results.items():
+        for got, expected in zip(result, sp._estimators[kind](data, 10)):
+            np.testing.assert_allclose(got, expected)
+
+
+@pytest.mark.parametrize('alpha', [2, 1, 0, -1, -2])
+def test_edf_matches_allantools(alpha):
+    n = 10001
+    m = np.array([1, 2, 4, 16, 128, 1024])
+    expected = [allantools.edf_simple(n, k, alpha) for k in m]
+    np.testing.assert_allclose(sp.allan_edf(n, m, alpha), expected)
+
+
+def test_confidence_interval_matches_allantools():
+    data = _data(10000)
+    phase = sp.Phase(data, 1)
+    tau, dev, dev_error, count = sp.overlapping_allan_deviation(phase)
+    edf = sp.allan_edf(len(phase), tau)
+    low, high = sp.confidence_interval(dev, edf)
+    for i in range(len(dev)):
+        expected = allantools.confidence_interval(dev[i], edf[i])
+        np.testing.assert_allclose((low[i], high[i]), expected)
+    assert np.all((low < dev) & (dev < high))
+
+
+@pytest.mark.parametrize('n', [1000, 4096, 30001])
+def test_pyramid_allan_deviation_is_exact(n):
+    data = _data(n)
+    pyramid = sp.Pyramid.build(data, 10)
+    tau, dev = sp.allan_deviation(pyramid, 10)
+    expected = sp.allan_deviation(data, 10)
+    np.testing.assert_allclose(tau, expected[0])
+    np.testing.assert_allclose(dev, expected[1], rtol=1e-10)
+
+    # The decimated estimator only agrees within its confidence
+    tau, dev = pyramid.allan_deviation(min_overlap=4)
+    np.testing.assert_allclose(dev, expected[1], rtol=.2)
+
+
+def test_pyramid_sigma_deviation_is_exact():
+    data = _data(30000)
+    tau, sigma = sp.Pyramid.build(data, 10).sigma_deviation()
+    expected = sp.sigma_deviation(data, 10)
+    np.testing.assert_allclose(tau, expected[0])
+    np.testing.assert_allclose(sigma, expected[1], rtol=1e-10)
+
+
+def test_pyramid_from_chunks_matches_build():
+    data = _data(10001)
+    built = sp.Pyramid.build(data, 1)
+    chunked = sp.Pyramid.from_chunks(np.array_split(data, 7), 1)
+    assert len(built.levels) == len(chunked.levels)
+    for a, b in zip(built.levels, chunked.levels):
+        np.testing.assert_allclose(a, b)
+
+
+def test_allan_var_of_pyramid():
+    from pyfog.allan_variance import allan_var
+    data = _data(20000)
+    expected = allan_var(data, .1)
+    tau, sig = allan_var(sp.Pyramid.build(data, 10), .1)
+    np.testing.assert_allclose(tau, expected[0])
+    np.testing.assert_allclose(sig, expected[1], rtol=1e-10)
+
+
+def _reshaped_sigma_deviation(data, spacing):
+    """The standard deviation of the means of whole blocks of `spacing`
+    samples, computed by reshaping."""
+    blocks = len(data) // spacing
+    return np.std(data[:blocks * spacing].reshape(blocks, spacing).mean(1))
+
+
+def test_sigma_deviation_matches_reshaping():
+    data = _data(1000)
+    tau, sigma = sp.sigma_deviation(data, 2)
+    for t, s in zip(tau, sigma):
+        if 2 * t > len(data):
+            assert np.isnan(s)  # Not a single block
+        else:
+            assert s == pytest.approx(
+                _reshaped_sigma_deviation(data, 2 * t), rel=1e-10, abs=1e-15)
+
+
+def test_sigma_deviation_with_fractional_spacing():
+    # Blocks of 2.5 samples split the samples on their boundaries in half,
+    # as blocks of 5 samples do once every sample is repeated
+    data = _data(1001)
+    tau, sigma = sp.sigma_deviation(data, 2.5)
+    repeated = np.repeat(data, 2)
+    for t, s in zip(tau, sigma):
+        if 2.5 * t <= len(data):
+            assert s == pytest.approx(
+                _reshaped_sigma_deviation(repeated, 5 * t), rel=1e-10,
+                abs=1e-15)
+
+
+def test_sigma_deviation_of_a_batch():
+    data = np.stack([_data(999), 3 * _data(999)[::-1]])
+    tau, sigma = sp.sigma_deviation(data, 1.5)
+    assert sigma.shape == (2, len(tau))
+    for run, expected in zip(data, sigma):
+        np.testing.assert_allclose(sp.sigma_deviation(run, 1.5)[1], expected)
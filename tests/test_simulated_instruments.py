@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from pyfog.allan_variance import allan_var
+from pyfog.simulated_instruments import simulated_instruments
+
+
+def _acquire(instruments, hours, chunk_seconds=60, max_voltage=.001):
+    """Reads the data acquisition unit in chunks, as
+    `acquire_allan_variance` does, and returns the rotation in °/h."""
+    daq = instruments['data_acquisition_unit']
+    rate = 1 / instruments['lock_in_amplifier'].time_constant
+    chunks = [daq.read(seconds=chunk_seconds, frequency=rate,
+                       max_voltage=max_voltage)
+              for _ in range(int(hours * 3600 / chunk_seconds))]
+    return daq.scale_factor * np.concatenate(chunks), rate
+
+
+def test_acquired_arw():
+    instruments = simulated_instruments(rate=1000, arw=.04, scale_factor=1e6,
+                                        latency=0, speedup=1e5, rng=0)
+    rotation, rate = _acquire(instruments, hours=.25)
+    tau, sig = allan_var(rotation, 1 / rate, tau=[rate])
+    # The Allan deviation at 1 s of white noise is 60 times the ARW
+    assert sig[0] / 60 == pytest.approx(.04, rel=.05)
+    assert instruments['data_acquisition_unit'].clipped == 0
+
+
+def test_clipping_is_counted():
+    instruments = simulated_instruments(rate=1000, arw=.04, latency=0,
+                                        speedup=1e5, rng=0)
+    with pytest.warns(RuntimeWarning, match='clipped'):
+        rotation, _ = _acquire(instruments, hours=.01, chunk_seconds=36)
+    clipped = instruments['data_acquisition_unit'].clipped
+    assert clipped == np.count_nonzero(np.abs(rotation) >= 100)
+    # About 19% of the samples, at a standard deviation of 76 °/h
+    assert .15 < clipped / len(rotation) < .25
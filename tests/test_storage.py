@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from pyfog.experiment import Experiment, Tombstone
+from pyfog.storage import StorageService, _coalesce
+
+pytest.importorskip('tables')
+
+
+def _append_chunks(client, filename, key, n):
+    for i in range(n):
+        client.append(filename, key, np.full(10, i, dtype=float), rate=10)
+
+
+def test_thread_mode(tmp_path):
+    filename = str(tmp_path / 'runs.h5')
+    with StorageService() as service:
+        service.store(filename, 'stored', Tombstone(np.arange(5.), rate=2))
+        for i in range(3):
+            service.client.append(filename, 'appended', [i, i], rate=4)
+        service.flush()
+        service.append(filename, 'appended', [3], rate=4)
+
+    experiment = Experiment(filename, read_only=True)
+    np.testing.assert_array_equal(experiment['stored'][:].values,
+                                  np.arange(5.))
+    np.testing.assert_array_equal(experiment['appended'][:].values,
+                                  [0, 0, 1, 1, 2, 2, 3])
+    assert experiment['appended'].rate == 4
+    experiment.close()
+
+
+def test_save_errors_are_raised_by_flush(tmp_path):
+    pytest.importorskip('h5py')
+    filename = str(tmp_path / 'results.h5')
+    with StorageService() as service:
+        service.save(filename, 'run', {'tau': np.arange(3)}, {'n': 1})
+        service.flush()
+        service.save(filename, 'run', {'tau': np.arange(3)})
+        with pytest.raises(ValueError, match='already exists'):
+            service.flush()
+
+
+def test_process_mode(tmp_path):
+    filename = str(tmp_path / 'runs.h5')
+    with StorageService(processes=True) as service:
+        with ProcessPoolExecutor(2) as pool:
+            list(pool.map(_append_chunks, [service.client] * 2,
+                          [filename] * 2, ['a', 'b'], [20, 20]))
+
+    experiment = Experiment(filename, read_only=True)
+    for key in ('a', 'b'):
+        np.testing.assert_array_equal(experiment[key][:].values,
+                                      np.repeat(np.arange(20.), 10))
+    experiment.close()
+
+
+def test_coalesce_appends():
+    def append(key, data):
+        return ('append', key, (np.array(data, dtype=float), 1, None, None))
+
+    merged = _coalesce([
+        append('a', [1]), append('b', [2]), append('a', [3]),
+        ('store', 'b', (np.zeros(1), 1, None, None)),
+        append('b', [4]), append('a', [5]), append('b', [6]),
+    ])
+    assert [(kind, key, list(payload[0])) for kind, key, payload in merged] \
+        == [('append', 'a', [1, 3, 5]), ('append', 'b', [2]),
+            ('store', 'b', [0]), ('append', 'b', [4, 6])]
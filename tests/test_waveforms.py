@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from pyfog.waveforms import square_pulse, square_wave, square_wave_batch
+
+
+def _reference_square_pulse(points, duty_cycle, rise, fall):
+    """The original point by point definition of `square_pulse`."""
+    def height(ratio):
+        if ratio == 0:
+            return .5 if rise else 1
+        elif ratio == duty_cycle:
+            return .5 if fall else 0
+        elif 0 < ratio <= rise / 2:
+            return ratio / rise + .5
+        elif rise / 2 < ratio <= duty_cycle - fall / 2:
+            return 1
+        elif duty_cycle - fall / 2 < ratio <= duty_cycle + fall / 2:
+            return 1 - (ratio - duty_cycle + fall / 2) / fall
+        elif duty_cycle + fall / 2 < ratio <= 1 - rise / 2:
+            return 0
+        else:
+            return (ratio - 1 + rise / 2) / rise
+
+    return np.array([min(max(2 * height(t) - 1, -1), 1)
+                     for t in np.linspace(0, 1, points, endpoint=False)])
+
+
+@pytest.mark.parametrize('points', [1, 7, 100, 1001])
+@pytest.mark.parametrize('duty_cycle, rise, fall', [
+    (.5, 0, 0), (.5, .1, .1), (.3, .05, .2), (.25, 0, .1), (.75, .2, 0),
+])
+def test_square_pulse_matches_reference(points, duty_cycle, rise, fall):
+    np.testing.assert_allclose(
+        square_pulse(points, duty_cycle, rise, fall),
+        _reference_square_pulse(points, duty_cycle, rise, fall),
+        rtol=1e-12, atol=1e-12)
+
+
+def test_square_pulse_is_not_shared():
+    pulse = square_pulse(10, .5, .1, .1)
+    pulse[:] = 5
+    assert square_pulse(10, .5, .1, .1).max() == 1
+
+
+def test_trains_and_batches():
+    pulse = square_pulse(50, .4, .02, .04)
+    np.testing.assert_array_equal(square_wave(50, 3, .4, .02, .04),
+                                  np.tile(pulse, 3))
+
+    batch = square_wave_batch(50, 2, duty_cycle=[.4, .5, .4],
+                              rise_time_over_cycle_time=.02,
+                              fall_time_over_cycle_time=[.04, .04, 0])
+    assert batch.shape == (3, 100)
+    np.testing.assert_array_equal(batch[0], np.tile(pulse, 2))
+    np.testing.assert_array_equal(
+        batch[1], square_wave(50, 2, .5, .02, .04))
+    np.testing.assert_array_equal(
+        batch[2], square_wave(50, 2, .4, .02, 0))